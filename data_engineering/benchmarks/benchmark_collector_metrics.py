@@ -0,0 +1,154 @@
+"""
+benchmark_collector_metrics.py
+
+Per-tick overhead of the collector's instrumentation (COLLECTOR_METRICS = True),
+on the real call path: data_collector.on_orderbook_update(), which times the
+capture inline and appends the duration to a LatencySamples array when metrics are on.
+
+Compares, for the 'numpy' and 'deltas' capture modes:
+    - before metrics: on_orderbook_update() without its timing statements (those
+      using `update_latency`), ie. the callback as it was before the instrumentation.
+    - metrics off: on_orderbook_update() with feed.update_latency = None (COLLECTOR_METRICS = False).
+    - metrics on: on_orderbook_update() with a LatencySamples (COLLECTOR_METRICS = True).
+
+The callbacks are compiled from data_collector.py's own source (importing the
+module would start the collector), so the benchmark always times the current
+code. The runs are interleaved, and the overhead is the median over all rounds
+of each round's difference to 'before metrics' (this machine may be busy with
+other work), with the 10th-90th percentile range of those differences.
+
+Then bins the recorded durations into the per-minute summary (as roll_minute()
+does once a minute, off the event loop), and prints it and the plain text scrape output.
+
+Usage (from the data_engineering directory):
+    python benchmarks/benchmark_collector_metrics.py [updates per round] [rounds]
+"""
+
+import ast
+import gc
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+DATA_ENGINEERING_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+sys.path.insert(0, DATA_ENGINEERING_DIRECTORY)
+
+from benchmark_tick_capture import NUM_LEVELS, make_synthetic_books, make_synthetic_dom_ticks
+from collector_metrics import CollectorMetrics, format_summary_line
+from orderbook_buffer import OrderbookTickBuffer, now_epoch_us
+from orderbook_deltas import DepthDeltaRecorder
+
+# Same shape as the ib_insync Ticker fields the callback reads
+Contract = namedtuple('Contract', 'conId')
+TickUpdate = namedtuple('TickUpdate', 'contract domBids domAsks domTicks')
+
+CON_ID = 12087792
+
+
+class RemoveTimingStatements(ast.NodeTransformer):
+    # Drops the top level statements of a function that use the `update_latency` local
+    def visit_FunctionDef(self, node):
+        node.body = [
+            statement for statement in node.body
+            if not any(isinstance(n, ast.Name) and n.id == 'update_latency' for n in ast.walk(statement))]
+        return node
+
+
+def load_collector_callbacks(capture_mode):
+    """
+    Compiles on_orderbook_update() from data_collector.py, and a copy of it without its timing statements
+    (on_orderbook_update_before_metrics()), in a namespace with the collector's module state they use.
+    """
+    with open(os.path.join(DATA_ENGINEERING_DIRECTORY, 'data_collector.py')) as f:
+        source = f.read()
+    on_update, before_metrics = [
+        next(node for node in ast.parse(source).body if isinstance(node, ast.FunctionDef) and node.name == 'on_orderbook_update')
+        for _ in range(2)]
+    before_metrics = RemoveTimingStatements().visit(before_metrics)
+    before_metrics.name = 'on_orderbook_update_before_metrics'
+
+    namespace = dict(time=time, now_epoch_us=now_epoch_us, feeds_by_con_id={}, TICK_CAPTURE_MODE=capture_mode)
+    exec(compile(ast.fix_missing_locations(ast.Module(body=[on_update, before_metrics], type_ignores=[])),
+                 'data_collector.py', 'exec'), namespace)
+    return namespace
+
+
+def make_tick_updates(capture_mode, num_updates):
+    contract = Contract(CON_ID)
+    if capture_mode == 'deltas':
+        return [TickUpdate(contract, [], [], dom_ticks) for dom_ticks in make_synthetic_dom_ticks(num_updates)]
+    return [TickUpdate(contract, bids, asks, []) for bids, asks in make_synthetic_books(num_updates)]
+
+
+def timed_run(callback, tick_updates):
+    gc.disable()
+    start = time.perf_counter()
+    for tick_update in tick_updates:
+        callback(tick_update)
+    elapsed = time.perf_counter() - start
+    gc.enable()
+    return elapsed
+
+
+def benchmark_capture_mode(capture_mode, num_updates, num_rounds, update_latency):
+    namespace = load_collector_callbacks(capture_mode)
+    tick_updates = make_tick_updates(capture_mode, num_updates)
+
+    class Feed:
+        live_ring = None
+
+    feed = Feed()
+    namespace['feeds_by_con_id'][CON_ID] = feed
+
+    variants = {
+        'before metrics': (namespace['on_orderbook_update_before_metrics'], None),
+        'metrics off': (namespace['on_orderbook_update'], None),
+        'metrics on': (namespace['on_orderbook_update'], update_latency),
+    }
+    seconds = {name: [] for name in variants}
+
+    for i in range(num_rounds):
+        # Rotate the order of the variants, so none always runs first (eg. right after a buffer allocation)
+        names = list(variants)
+        names = names[i % len(names):] + names[:i % len(names)]
+        for name in names:
+            callback, feed.update_latency = variants[name]
+            feed.tick_buffer = (DepthDeltaRecorder(num_levels=NUM_LEVELS, capacity=4 * num_updates) if capture_mode == 'deltas'
+                                else OrderbookTickBuffer(num_levels=NUM_LEVELS, capacity=num_updates))
+            seconds[name].append(timed_run(callback, tick_updates))
+
+    baseline = np.array(seconds['before metrics'])
+    print(f"'{capture_mode}' capture:")
+    for name, durations in seconds.items():
+        line = f"  {name + ':':16} {np.median(durations) / num_updates * 1e6:6.3f} us/update"
+        if name != 'before metrics':
+            overhead_us = (np.array(durations) - baseline) / num_updates * 1e6
+            p10, p50, p90 = np.percentile(overhead_us, [10, 50, 90])
+            line += f", overhead {p50:+.3f} us/update (p10 {p10:+.3f}, p90 {p90:+.3f})"
+        print(line)
+
+
+if __name__ == '__main__':
+
+    num_updates = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 101
+
+    metrics = CollectorMetrics(['EURUSD'])
+
+    print(f"--- Collector metrics benchmark (on_orderbook_update(), {num_updates:,} updates x {num_rounds} rounds, "
+          f"median) ---")
+    for capture_mode in ('numpy', 'deltas'):
+        benchmark_capture_mode(capture_mode, num_updates, num_rounds, metrics.update_latency['EURUSD'])
+
+    print()
+    started = time.perf_counter()
+    summary = metrics.roll_minute()
+    print(f"roll_minute() (binning {summary['instruments']['EURUSD']['num_updates']:,} durations): "
+          f"{(time.perf_counter() - started) * 1e3:.1f} ms")
+    print(format_summary_line(summary))
+    print()
+    print(metrics.render_text())
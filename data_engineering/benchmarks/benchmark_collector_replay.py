@@ -0,0 +1,178 @@
+"""
+benchmark_collector_replay.py
+
+Offline load test of the collector: runs data_collector.py itself (in a
+subprocess) against simulated_ib.SimulatedIB, with its settings overridden
+through the ORDERBOOK_COLLECTOR_CONFIG environment variable (simulated feed,
+capture mode, a temporary data/log directory, no metrics endpoint).
+
+Several instruments are replayed at a high speed (synthetic books, or recorded
+minute files), optionally with injected Error 317 / disconnect faults, to
+exercise the resubscribe and reconnect paths under load. The collector flushes
+at the start of each (real) minute, so the run lasts whole minutes; it is then
+stopped with SIGTERM, which flushes the partial minute.
+
+Then checks the files the collector wrote:
+    - Every instrument has a data file for each minute flush, readable with read_tick_file(),
+      with its instrument and capture mode in the header.
+    - Each minute manifest lists the minute's files, with their tick counts and checksums.
+    - The log has no errors (except the injected faults, with --faults), and a metrics
+      line for every minute flush (none were skipped or late).
+
+Reports the ticks written per instrument, the updates not written (duplicates
+dropped by dedup, empty depth updates), and the collector's per minute
+metrics lines (updates/s, callback latency, flush block and file write times).
+
+Needs the collector's environment (libHelpers, ib_insync), as data_collector.py imports them.
+
+Usage (from the data_engineering directory):
+    python benchmarks/benchmark_collector_replay.py [minutes] [speed] [capture mode: numpy|deltas|journal] [--faults]
+    python benchmarks/benchmark_collector_replay.py 2 100 deltas --faults
+"""
+
+import glob
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+DATA_ENGINEERING_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+sys.path.insert(0, DATA_ENGINEERING_DIRECTORY)
+
+from minute_manifest import MANIFEST_FILE_EXTENSION, file_checksum
+from tick_file_format import TICK_FILE_EXTENSION, read_tick_file, read_tick_file_header
+
+INSTRUMENTS = ['EURUSD', 'GBPUSD', 'USDJPY', 'AUDUSD']
+
+# Set to a glob with an {instrument} placeholder to replay recorded files instead of synthetic books
+RECORDED_FILES = None
+
+# Time allowed for the collector to write the partial minute and exit, after SIGTERM
+SHUTDOWN_TIMEOUT_SECONDS = 60
+
+
+def run_collector(data_directory, log_directory, minutes, speed, capture_mode, inject_faults):
+    faults = dict(error_317_every=2.0, error_1101_every=5.0, disconnect_every=10.0, disconnect_duration=0.5) if inject_faults else {}
+    overrides = dict(
+        SIMULATED_FEED=dict(recorded_files=RECORDED_FILES, speed=speed, **faults),
+        TICK_CAPTURE_MODE=capture_mode,
+        LOCAL_DATA_DIRECTORY=data_directory,
+        LOG_DIRECTORY=log_directory,
+        METRICS_HTTP_PORT=None)
+
+    collector = subprocess.Popen(
+        [sys.executable, 'data_collector.py', ','.join(INSTRUMENTS)],
+        cwd=DATA_ENGINEERING_DIRECTORY,
+        env=dict(os.environ, ORDERBOOK_COLLECTOR_CONFIG=json.dumps(overrides)))
+
+    # The first flush is at the start of the next minute, then one per minute
+    started_at = time.time()
+    flush_times = [started_at - started_at % 60 + 60 * (i + 1) for i in range(minutes)]
+    try:
+        while time.time() < flush_times[-1] + 5:
+            if collector.poll() is not None:
+                raise RuntimeError(f"The collector exited early, with code {collector.returncode} (see the log in {log_directory})")
+            time.sleep(0.5)
+    finally:
+        if collector.poll() is None:
+            collector.send_signal(signal.SIGTERM)
+            collector.wait(timeout=SHUTDOWN_TIMEOUT_SECONDS)
+
+    assert collector.returncode == 0, f"The collector exited with code {collector.returncode}"
+    return time.time() - started_at, len(flush_times) + 1
+
+
+def check_written_files(data_directory, capture_mode, num_flushes):
+    """
+    Checks the data files and manifests, and returns the # of ticks written per instrument, and the totals of
+    the capture counters in the files' meta (updates dropped as duplicates, and empty depth updates).
+    """
+    data_files = [
+        path for path in glob.glob(os.path.join(data_directory, '*', f'*.{TICK_FILE_EXTENSION}'))
+        if os.path.basename(os.path.dirname(path)) not in ('journal', 'spill')]
+
+    num_ticks = {instrument: 0 for instrument in INSTRUMENTS}
+    num_files = {instrument: 0 for instrument in INSTRUMENTS}
+    # Book updates per file (the rows of a depth deltas file are change events, see orderbook_deltas.py)
+    ticks_per_file = {}
+    capture_counts = dict(num_suppressed_updates=0, num_empty_updates=0)
+    for path in data_files:
+        meta = read_tick_file_header(path)['meta']
+        for name in capture_counts:
+            capture_counts[name] += meta.get(name, 0)
+        instrument = os.path.basename(path).split('_orderbook_ticks_')[0]
+        assert meta.get('instrument', instrument) == instrument, path
+        assert (meta.get('kind') == 'depth_deltas') == (capture_mode == 'deltas'), path
+
+        num_rows = len(read_tick_file(path, columns=['timestamp'])['timestamp'])
+        ticks_per_file[path] = meta['n_updates'] if capture_mode == 'deltas' else num_rows
+        num_ticks[instrument] += ticks_per_file[path]
+        num_files[instrument] += 1
+
+    # Every flush writes a file per instrument (the last, partial minute one may be empty for a slow instrument)
+    for instrument in INSTRUMENTS:
+        assert num_files[instrument] >= num_flushes - 1, f"{instrument}: {num_files[instrument]} files for {num_flushes} flushes"
+
+    manifested = set()
+    for manifest_path in glob.glob(os.path.join(data_directory, '*', f'*.{MANIFEST_FILE_EXTENSION}')):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        for entry in manifest['files']:
+            path = os.path.join(os.path.dirname(manifest_path), entry['file'])
+            assert entry['n_ticks'] == ticks_per_file[path], path
+            assert entry['checksum'] == file_checksum(path), path
+            manifested.add(path)
+        assert manifest['n_ticks'] == sum(entry['n_ticks'] for entry in manifest['files']), manifest_path
+
+    assert manifested == set(data_files), f"Files without a manifest: {sorted(set(data_files) - manifested)}"
+    return num_ticks, len(data_files), capture_counts
+
+
+def read_log(log_directory):
+    lines = []
+    for path in glob.glob(os.path.join(log_directory, '*.log')):
+        with open(path) as f:
+            lines += f.read().splitlines()
+    return lines
+
+
+if __name__ == '__main__':
+
+    minutes = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 100
+    capture_mode = sys.argv[3] if len(sys.argv) > 3 and not sys.argv[3].startswith('--') else 'deltas'
+    inject_faults = '--faults' in sys.argv
+
+    with tempfile.TemporaryDirectory() as scratch_directory:
+        data_directory = os.path.join(scratch_directory, 'orderbook_data') + '/'
+        log_directory = os.path.join(scratch_directory, 'logs')
+        os.makedirs(log_directory)
+
+        elapsed, num_flushes = run_collector(data_directory, log_directory, minutes, speed, capture_mode, inject_faults)
+        num_ticks, num_files, capture_counts = check_written_files(data_directory, capture_mode, num_flushes)
+        log_lines = read_log(log_directory)
+
+    errors = [line for line in log_lines if '[ERROR]' in line]
+    if not inject_faults:
+        assert not errors, '\n'.join(errors[:20])
+
+    # The collector logs its metrics at every minute flush
+    metrics_lines = [line for line in log_lines if 'Collector metrics' in line]
+    assert len(metrics_lines) == num_flushes - 1, f"{len(metrics_lines)} minute flushes, expected {num_flushes - 1}"
+
+    print(f"--- Collector replay load test ({len(INSTRUMENTS)} instruments, {speed:g}x, "
+          f"'{capture_mode}' capture, {elapsed:.0f}s{', with faults' if inject_faults else ''}) ---")
+    print(f"written: {sum(num_ticks.values()):,} ticks ({sum(num_ticks.values()) / elapsed:,.0f}/s) "
+          f"to {num_files} files, over {num_flushes} flushes (incl. the one on SIGTERM)")
+    for instrument, n in num_ticks.items():
+        print(f"  {instrument}: {n:,} ticks")
+    print(f"not written: {capture_counts['num_suppressed_updates']:,} duplicate updates (dedup), "
+          f"{capture_counts['num_empty_updates']:,} empty depth updates ('deltas' capture)")
+    print(f"log errors: {len(errors)}")
+    for line in log_lines:
+        if 'Collector metrics' in line or 'Minute file writer closed' in line:
+            print(line.split(': ', 1)[-1])
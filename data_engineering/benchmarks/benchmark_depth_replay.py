@@ -0,0 +1,108 @@
+"""
+benchmark_depth_replay.py
+
+Time of replaying a busy minute of depth change events ('deltas' capture mode,
+8000 updates by default) into books, as the minute file writer does for every
+'deltas' file: the integrity checks (tick_integrity.validate_ticks, which runs
+orderbook_deltas.reconstruct_ticks) and the manifest summary
+(minute_manifest.summarize_ticks, which runs orderbook_deltas.top_of_book).
+
+Compares the vectorized replay against applying each event to an
+IncrementalOrderBook (the per-event replay), for a minute of level updates
+only (IB's usual depth operation), and for one with inserts/deletes (the
+snapshot segments that have any are replayed event by event). Also checks
+that both replays give the same books.
+
+Usage (from the data_engineering directory):
+    python benchmarks/benchmark_depth_replay.py [num_updates] [inserts/deletes per 1000 depth changes]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmark_tick_capture import MktDepthData
+from minute_manifest import summarize_ticks
+from orderbook_buffer import make_tick_dtype
+from orderbook_deltas import (OPERATION_DELETE, OPERATION_INSERT, OPERATION_UPDATE, SIDE_ASK, SIDE_BID,
+                              DepthDeltaRecorder, IncrementalOrderBook, reconstruct_ticks)
+from tick_integrity import validate_ticks
+
+NUM_LEVELS = 10
+
+NUM_REPEATS = 7
+
+
+def make_synthetic_minute(num_updates, shifts_per_1000, seed=0):
+    # 1 to 3 depth changes per update, at random levels and sides
+    rng = np.random.default_rng(seed)
+    recorder = DepthDeltaRecorder(num_levels=NUM_LEVELS)
+    timestamp_us = 1_709_589_600_000_000
+    for _ in range(num_updates):
+        dom_ticks = []
+        for _ in range(rng.integers(1, 4)):
+            operation = OPERATION_UPDATE
+            if rng.random() < shifts_per_1000 / 1000:
+                operation = OPERATION_INSERT if rng.random() < 0.5 else OPERATION_DELETE
+            dom_ticks.append(MktDepthData(
+                None, int(rng.integers(NUM_LEVELS)), '', operation, int(rng.integers(2)),
+                round(1.1 + rng.normal(0, 0.0005), 5), float(rng.integers(1, 50) * 100000)))
+        timestamp_us += int(rng.integers(1, 15000))
+        recorder.record(timestamp_us, dom_ticks)
+    return recorder.drain()
+
+
+def reconstruct_ticks_per_event(events, num_levels=NUM_LEVELS):
+    # Each event applied to an IncrementalOrderBook, copying the book out at every update end
+    update_end_indices = np.flatnonzero(events['update_end'])
+    ticks = np.zeros(len(update_end_indices), dtype=make_tick_dtype(num_levels))
+    ticks['timestamp'] = events['timestamp'][update_end_indices]
+
+    flat = ticks.view(np.float64).reshape(len(ticks), 1 + 4 * num_levels)
+    bids = flat[:, 1:1 + 2 * num_levels].reshape(len(ticks), num_levels, 2)
+    asks = flat[:, 1 + 2 * num_levels:].reshape(len(ticks), num_levels, 2)
+
+    book = IncrementalOrderBook(num_levels)
+    row = 0
+    for _, position, operation, side, update_end, price, size in events.tolist():
+        book.apply(position, operation, side, price, size)
+        if update_end:
+            bids[row] = book.levels[SIDE_BID].T
+            asks[row] = book.levels[SIDE_ASK].T
+            row += 1
+    return ticks
+
+
+def median_ms(function, *args):
+    durations = []
+    for _ in range(NUM_REPEATS):
+        started = time.perf_counter()
+        function(*args)
+        durations.append(time.perf_counter() - started)
+    return np.median(durations) * 1e3
+
+
+if __name__ == '__main__':
+
+    num_updates = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    shifts_per_1000 = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print(f"--- Depth delta replay benchmark ({num_updates:,} updates per minute, {NUM_LEVELS} levels, "
+          f"median of {NUM_REPEATS}) ---")
+
+    for label, shifts in (('level updates only', 0), (f'{shifts_per_1000:g} inserts/deletes per 1000 changes', shifts_per_1000)):
+        events = make_synthetic_minute(num_updates, shifts)
+        ticks = reconstruct_ticks(events, NUM_LEVELS)
+        assert np.array_equal(ticks.view(np.float64), reconstruct_ticks_per_event(events).view(np.float64))
+
+        per_event_ms = median_ms(reconstruct_ticks_per_event, events)
+        replay_ms = median_ms(reconstruct_ticks, events, NUM_LEVELS)
+        print(f"{label} ({len(events):,} events):")
+        print(f"  per-event replay:     {per_event_ms:7.2f} ms")
+        print(f"  reconstruct_ticks():  {replay_ms:7.2f} ms ({per_event_ms / replay_ms:.1f}x)")
+        print(f"  validate_ticks():     {median_ms(validate_ticks, events, NUM_LEVELS):7.2f} ms")
+        print(f"  summarize_ticks():    {median_ms(summarize_ticks, events, NUM_LEVELS):7.2f} ms")
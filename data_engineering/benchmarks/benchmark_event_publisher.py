@@ -0,0 +1,116 @@
+"""
+benchmark_event_publisher.py
+
+How long the health monitor's minute loop is blocked by publishing, inline vs. through the background publisher.
+
+Each simulated minute sends what a successful minute check does: one Pub/Sub
+event and three Cloud Logging entries, to LocalFileTransport with a simulated
+GCP round trip (`latency`) and a share of failed sends (`failure_rate`).
+Inline, the loop waits for every round trip (and has no retries). With the
+BackgroundPublisher, it only waits for the enqueue, and the publisher's
+latency percentiles (queued -> acknowledged, retries included) are reported.
+Also checks that the background publisher delivered every Pub/Sub event at
+most once (no resend of events already sent when a send fails partway), in order.
+
+Usage (from the data_engineering directory):
+    python benchmarks/benchmark_event_publisher.py [num_minutes] [latency_seconds] [failure_rate]
+"""
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from event_publisher import KIND_LOG, KIND_PUBSUB, BackgroundPublisher, LocalFileTransport, QueuedMessage
+
+
+def minute_messages(minute_index):
+    minute = f"2024-03-04T22:{minute_index % 60:02d}:00+00:00"
+    return [
+        (KIND_PUBSUB, 'data-files-created', dict(name='Successfully created data files for minute.', minute=minute, files=[],
+                                                 sequence=minute_index)),
+        (KIND_LOG, 'echelon_datafeed_orderbook_health_check', f"Success: All files present for: {minute}"),
+        (KIND_LOG, 'echelon_datafeed_orderbook_volume_monitor', dict(EURUSD=5000 + minute_index, GBPUSD=4000)),
+        (KIND_LOG, 'echelon_datafeed_orderbook_volume_monitor', dict(minute=minute, price_summary={})),
+    ]
+
+
+def run_inline(transport, num_minutes):
+    blocked_seconds = []
+    num_failed = 0
+    for minute_index in range(num_minutes):
+        start = time.perf_counter()
+        for kind, destination, payload in minute_messages(minute_index):
+            try:
+                transport.send(kind, destination, [QueuedMessage(kind, destination, payload)])
+            except ConnectionError:
+                num_failed += 1
+        blocked_seconds.append(time.perf_counter() - start)
+    return blocked_seconds, num_failed
+
+
+def run_background(transport, num_minutes):
+    # Retry warnings are expected here (failure_rate), so only errors are printed
+    quiet_logger = logging.getLogger('benchmark_event_publisher')
+    quiet_logger.setLevel(logging.ERROR)
+
+    publisher = BackgroundPublisher(transport, backoff_base=0.01, logger=quiet_logger)
+    health_check = publisher.cloud_logger('echelon_datafeed_orderbook_health_check')
+    volume_monitor = publisher.cloud_logger('echelon_datafeed_orderbook_volume_monitor')
+
+    blocked_seconds = []
+    for minute_index in range(num_minutes):
+        start = time.perf_counter()
+        for kind, destination, payload in minute_messages(minute_index):
+            if kind == KIND_PUBSUB:
+                publisher.publish(destination, payload)
+            elif isinstance(payload, dict):
+                volume_monitor.log_struct(payload, severity='INFO')
+            else:
+                health_check.log_text(payload, severity='INFO')
+        blocked_seconds.append(time.perf_counter() - start)
+
+        # The rest of the minute (compressed), so the publisher catches up like it would in production
+        time.sleep(transport.latency * 8)
+
+    publisher.close()
+    return blocked_seconds, publisher.get_metrics()
+
+
+def published_sequences(directory):
+    with open(os.path.join(directory, f"{KIND_PUBSUB}_data-files-created.jsonl")) as f:
+        return [json.loads(line)['payload']['sequence'] for line in f]
+
+
+if __name__ == '__main__':
+
+    num_minutes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    failure_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+
+    with tempfile.TemporaryDirectory() as directory:
+        inline_blocked, inline_failed = run_inline(
+            LocalFileTransport(os.path.join(directory, 'inline'), latency, failure_rate, seed=0), num_minutes)
+        background_blocked, metrics = run_background(
+            LocalFileTransport(os.path.join(directory, 'background'), latency, failure_rate, seed=0), num_minutes)
+        sequences = published_sequences(os.path.join(directory, 'background'))
+
+    # Every event sent at most once (only those given up on are missing), in the order they were published
+    assert sequences == sorted(set(sequences)), "Pub/Sub events delivered twice or out of order"
+    assert num_minutes - len(sequences) <= metrics['num_failed'], (len(sequences), metrics)
+
+    def describe(blocked_seconds):
+        p50, p99 = np.percentile(np.array(blocked_seconds) * 1000, [50, 99])
+        return f"p50 {p50:.3f} ms, p99 {p99:.3f} ms, max {max(blocked_seconds) * 1000:.3f} ms"
+
+    print(f"--- Event publisher benchmark ({num_minutes} minutes, {latency * 1000:.0f} ms round trip, "
+          f"{failure_rate:.0%} failed sends) ---")
+    print(f"minute loop blocked, inline:     {describe(inline_blocked)} ({inline_failed} messages lost)")
+    print(f"minute loop blocked, background: {describe(background_blocked)}")
+    print(f"background publisher: {metrics}")
@@ -0,0 +1,84 @@
+"""
+benchmark_gap_audit.py
+
+Time of the historical gap audit (gap_audit.py) over a synthetic tick archive.
+
+Creates `num_days` day directories with an empty data file and a manifest for
+every expected instrument-minute (like the collector writes), minus an injected
+outage, plus a few duplicate files, then runs audit_tick_archive() and checks
+the gaps and duplicates it reports. The time per day is extrapolated to a year.
+
+Usage (from the data_engineering directory):
+    python benchmarks/benchmark_gap_audit.py [num_days] [num_processes]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gap_audit import audit_tick_archive, expected_file_minutes
+from minute_manifest import manifest_file_name
+
+INSTRUMENTS = ['EURUSD', 'GBPUSD', 'USDJPY']
+
+START_DATE = date(2024, 3, 4)
+
+# Minutes (positions in the expected minutes) with no USDJPY files, and minutes with 2 EURUSD files
+OUTAGE = range(100, 160)
+DUPLICATES = (10, 500)
+
+
+def make_synthetic_archive(directory, num_days):
+    end_date = START_DATE + timedelta(days=num_days - 1)
+    expected = expected_file_minutes(START_DATE, end_date)
+
+    for i, minute in enumerate(expected):
+        day_directory = os.path.join(directory, minute.strftime('%Y-%m-%d'))
+        os.makedirs(day_directory, exist_ok=True)
+        minute_str = minute.strftime('%Y-%m-%dT%H:%M')
+
+        for instrument in INSTRUMENTS:
+            if instrument == 'USDJPY' and i in OUTAGE:
+                continue
+            n_files = 2 if instrument == 'EURUSD' and i in DUPLICATES else 1
+            for k in range(n_files):
+                open(os.path.join(day_directory, f"{instrument}_orderbook_ticks_{minute_str}:00.{10191 + k:06d}.obt"), 'w').close()
+            with open(os.path.join(day_directory, manifest_file_name(instrument, minute_str)), 'w') as f:
+                json.dump(dict(instrument=instrument, minute=minute_str, n_ticks=1000 + i), f)
+
+    return end_date, len(expected)
+
+
+if __name__ == '__main__':
+
+    num_days = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    num_processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    with tempfile.TemporaryDirectory() as directory:
+        end_date, num_expected = make_synthetic_archive(directory, num_days)
+
+        started = time.perf_counter()
+        report = audit_tick_archive(directory, INSTRUMENTS, START_DATE, end_date, processes=num_processes)
+        elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        audit_tick_archive(directory, INSTRUMENTS, START_DATE, end_date, processes=num_processes, tick_counts=False)
+        elapsed_listing_only = time.perf_counter() - started
+
+    gaps, duplicates = report['gaps'], report['duplicates']
+    assert len(gaps) == 1 and gaps['instrument'][0] == 'USDJPY' and gaps['missing_minutes'][0] == len(OUTAGE), gaps
+    assert list(duplicates['instrument']) == ['EURUSD'] * len(DUPLICATES), duplicates
+    assert report['tick_counts']['USDJPY'].isna().sum() == len(OUTAGE)
+
+    num_files = num_expected * len(INSTRUMENTS) * 2
+    print(f"--- Gap audit benchmark ({num_days} days, {num_expected} expected minutes, ~{num_files} files) ---")
+    print(f"with tick counts (manifests): {elapsed:.2f} s ({elapsed / num_days * 365 / 60:.1f} min / year extrapolated)")
+    print(f"listing only:                 {elapsed_listing_only:.2f} s "
+          f"({elapsed_listing_only / num_days * 365 / 60:.1f} min / year extrapolated)")
+    print(report['gaps'].to_string())
+    print(report['summary'])
@@ -0,0 +1,80 @@
+"""
+benchmark_live_tick_ring.py
+
+Publish cost and cross-process delivery latency of the live tick ring.
+
+A reader process attaches to the ring and polls it, while this process
+publishes synthetic 10 level books at a fixed rate. Delivery latency is the
+time between publish (the book's timestamp) and the reader copying the book.
+
+Usage (from the data_engineering directory):
+    python benchmarks/benchmark_live_tick_ring.py [num_updates]
+"""
+
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmark_tick_capture import make_synthetic_books
+from live_tick_ring import LiveTickRingReader, LiveTickRingWriter
+from orderbook_buffer import now_epoch_us
+
+INSTRUMENT = 'BENCHMARK'
+
+# Gap between published books, roughly a busy EURUSD minute
+PUBLISH_INTERVAL_SECONDS = 0.0005
+
+
+def read_until(num_updates, ready, results):
+    reader = LiveTickRingReader(INSTRUMENT)
+    next_seq = reader.write_count
+    ready.set()
+
+    latencies_us = []
+    num_missed = 0
+    while next_seq < num_updates:
+        ticks, next_seq, missed = reader.wait_for_ticks(next_seq, timeout=5, poll_interval=0)
+        received_us = now_epoch_us()
+        latencies_us.extend(received_us - ticks['timestamp'].view(np.int64))
+        num_missed += missed
+
+    reader.close()
+    results.put((latencies_us, num_missed))
+
+
+if __name__ == '__main__':
+
+    num_updates = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    books = make_synthetic_books(num_updates)
+    writer = LiveTickRingWriter(INSTRUMENT)
+
+    ready, results = multiprocessing.Event(), multiprocessing.Queue()
+    reader_process = multiprocessing.Process(target=read_until, args=(num_updates, ready, results))
+    reader_process.start()
+    ready.wait()
+
+    publish_seconds = 0.0
+    for bids, asks in books:
+        start = time.perf_counter()
+        writer.publish(now_epoch_us(), bids, asks)
+        publish_seconds += time.perf_counter() - start
+
+        # Spin (time.sleep() is too coarse for sub-millisecond gaps)
+        while time.perf_counter() - start < PUBLISH_INTERVAL_SECONDS:
+            pass
+
+    latencies_us, num_missed = results.get()
+    reader_process.join()
+    writer.close()
+
+    p50, p99, p999 = np.percentile(latencies_us, [50, 99, 99.9])
+    print(f"--- Live tick ring benchmark ({num_updates:,} updates, 1 reader) ---")
+    print(f"publish: {publish_seconds / num_updates * 1e6:.2f} us/update")
+    print(f"delivery latency: p50 {p50:.0f} us, p99 {p99:.0f} us, p99.9 {p999:.0f} us, max {max(latencies_us):.0f} us")
+    print(f"books received: {len(latencies_us):,}, missed: {num_missed}")
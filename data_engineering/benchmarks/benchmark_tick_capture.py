@@ -0,0 +1,135 @@
+"""
+benchmark_tick_capture.py
+
+Micro-benchmark of the collector's per-tick capture path (on_orderbook_update).
+
+Compares the legacy capture (DataFrame + dict per tick, appended to a list)
+against OrderbookTickBuffer.record(), using synthetic 10 level books, and
+DepthDeltaRecorder.record() ('deltas' mode) with one changed level per update.
+
+Usage (from the data_engineering directory):
+    python benchmarks/benchmark_tick_capture.py [num_updates]
+"""
+
+import os
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from orderbook_buffer import OrderbookTickBuffer, now_epoch_us
+from orderbook_deltas import OPERATION_UPDATE, DepthDeltaRecorder
+
+# Same shape as ib_insync's DOMLevel (price, size, marketMaker)
+DOMLevel = namedtuple('DOMLevel', 'price size marketMaker')
+
+# Same shape as ib_insync's MktDepthData (an item of ticker.domTicks)
+MktDepthData = namedtuple('MktDepthData', 'time position marketMaker operation side price size')
+
+NUM_LEVELS = 10
+
+
+def make_synthetic_books(num_books, num_levels=NUM_LEVELS, seed=0):
+    rng = np.random.default_rng(seed)
+    books = []
+    for _ in range(num_books):
+        mid = 1.1 + rng.normal(0, 0.0005)
+        bids = [DOMLevel(round(mid - 0.00001 * (i + 1), 5), float(rng.integers(1, 50) * 100000), '') for i in range(num_levels)]
+        asks = [DOMLevel(round(mid + 0.00001 * (i + 1), 5), float(rng.integers(1, 50) * 100000), '') for i in range(num_levels)]
+        books.append((bids, asks))
+    return books
+
+
+def make_synthetic_dom_ticks(num_updates, num_levels=NUM_LEVELS, seed=0):
+    # One size change per update (the typical update), at a random level and side
+    rng = np.random.default_rng(seed)
+    return [
+        [MktDepthData(None, int(rng.integers(num_levels)), '', OPERATION_UPDATE, int(rng.integers(2)),
+                      1.1, float(rng.integers(1, 50) * 100000))]
+        for _ in range(num_updates)]
+
+
+def legacy_capture(bids, asks, buffer_list, num_levels=NUM_LEVELS):
+    # Copy of the legacy body of on_orderbook_update()
+    now = datetime.now()
+    _update_dict = {'timestamp': now}
+
+    _dataframe = pd.DataFrame(
+        index=range(num_levels),
+        columns='bidSize bidPrice askPrice askSize'.split())
+
+    for i in range(num_levels):
+        _dataframe.iloc[i, 1] = bids[i].price if i < len(bids) else 0
+        _dataframe.iloc[i, 0] = bids[i].size if i < len(bids) else 0
+
+        _update_dict["bid_price_" + str(i + 1)] = bids[i].price if i < len(bids) else 0
+        _update_dict["bid_size_" + str(i + 1)] = bids[i].size if i < len(bids) else 0
+
+    for i in range(num_levels):
+        _dataframe.iloc[i, 2] = asks[i].price if i < len(asks) else 0
+        _dataframe.iloc[i, 3] = asks[i].size if i < len(asks) else 0
+
+        _update_dict["ask_price_" + str(i + 1)] = asks[i].price if i < len(asks) else 0
+        _update_dict["ask_size_" + str(i + 1)] = asks[i].size if i < len(asks) else 0
+
+    buffer_list.append(_update_dict)
+
+
+def run_legacy(books):
+    buffer_list = []
+    start = time.perf_counter()
+    for bids, asks in books:
+        legacy_capture(bids, asks, buffer_list)
+    return time.perf_counter() - start
+
+
+def run_numpy(books):
+    tick_buffer = OrderbookTickBuffer(num_levels=NUM_LEVELS)
+    record = tick_buffer.record
+    start = time.perf_counter()
+    for bids, asks in books:
+        record(now_epoch_us(), bids, asks)
+    elapsed = time.perf_counter() - start
+    tick_buffer.drain()
+    return elapsed
+
+
+def run_deltas(dom_ticks_per_update):
+    recorder = DepthDeltaRecorder(num_levels=NUM_LEVELS)
+    record = recorder.record
+    start = time.perf_counter()
+    for dom_ticks in dom_ticks_per_update:
+        record(now_epoch_us(), dom_ticks)
+    elapsed = time.perf_counter() - start
+    events = recorder.drain()
+    return elapsed, events.nbytes
+
+
+if __name__ == '__main__':
+
+    num_updates = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    books = make_synthetic_books(num_updates)
+
+    # The legacy path is ~1000x slower, so only time a slice of it
+    num_legacy_updates = min(num_updates, 2000)
+    legacy_seconds = run_legacy(books[:num_legacy_updates])
+    numpy_seconds = run_numpy(books)
+    deltas_seconds, deltas_nbytes = run_deltas(make_synthetic_dom_ticks(num_updates))
+
+    legacy_rate = num_legacy_updates / legacy_seconds
+    numpy_rate = num_updates / numpy_seconds
+    deltas_rate = num_updates / deltas_seconds
+    numpy_nbytes = num_updates * OrderbookTickBuffer(num_levels=NUM_LEVELS, capacity=1).dtype.itemsize
+
+    print(f"--- Tick capture benchmark ({NUM_LEVELS} levels) ---")
+    print(f"legacy (DataFrame + dict): {legacy_rate:>12,.0f} updates/sec  ({1e6 / legacy_rate:8.2f} us/update)")
+    print(f"numpy  (OrderbookTickBuffer): {numpy_rate:>9,.0f} updates/sec  ({1e6 / numpy_rate:8.2f} us/update)")
+    print(f"deltas (DepthDeltaRecorder): {deltas_rate:>10,.0f} updates/sec  ({1e6 / deltas_rate:8.2f} us/update)")
+    print(f"speedup: {numpy_rate / legacy_rate:.0f}x (numpy vs legacy)")
+    print(f"minute size, before file compression: numpy {numpy_nbytes / 1e6:.2f} MB, deltas {deltas_nbytes / 1e6:.2f} MB")
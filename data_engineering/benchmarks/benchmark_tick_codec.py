@@ -0,0 +1,87 @@
+"""
+benchmark_tick_codec.py
+
+Compression ratio and decode throughput of the 'delta' tick file codec.
+
+Writes the same synthetic minute of L2 ticks as a raw '.obt' file and as a
+'delta' '.obt' file, and reports the size ratio and the number of decoded
+values per second (single thread).
+
+Usage (from the data_engineering directory):
+    python benchmarks/benchmark_tick_codec.py [num_ticks]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tick_codec
+from orderbook_buffer import make_tick_dtype
+from tick_file_format import read_tick_file, write_tick_file
+
+NUM_LEVELS = 10
+
+
+def make_synthetic_minute(num_ticks, num_levels=NUM_LEVELS, pip=0.00001, seed=0):
+    # EURUSD-like book: mid moves by whole pips, most updates only change a size or two
+    rng = np.random.default_rng(seed)
+    ticks = np.zeros(num_ticks, dtype=make_tick_dtype(num_levels))
+
+    start_us = 1_709_590_500_000_000
+    ticks['timestamp'] = (start_us + np.cumsum(rng.integers(1, 15000, num_ticks))).astype('datetime64[us]')
+
+    best_bid_pips = 110000 + np.cumsum(rng.choice([-1, 0, 0, 0, 0, 0, 1], num_ticks))
+    spread_pips = rng.choice([1, 1, 1, 2], num_ticks)
+
+    for i in range(1, num_levels + 1):
+        # Sizes change on ~10% of ticks, in lots of 100k
+        bid_changes = rng.random(num_ticks) < 0.1
+        ask_changes = rng.random(num_ticks) < 0.1
+        bid_lots = rng.integers(1, 50, num_ticks)
+        ask_lots = rng.integers(1, 50, num_ticks)
+        bid_lots[0] = ask_lots[0] = 10
+        bid_lots = bid_lots[np.maximum.accumulate(np.where(bid_changes, np.arange(num_ticks), 0))]
+        ask_lots = ask_lots[np.maximum.accumulate(np.where(ask_changes, np.arange(num_ticks), 0))]
+
+        ticks[f'bid_price_{i}'] = np.round((best_bid_pips - (i - 1)) * pip, 5)
+        ticks[f'ask_price_{i}'] = np.round((best_bid_pips + spread_pips + (i - 1)) * pip, 5)
+        ticks[f'bid_size_{i}'] = bid_lots * 100000.0
+        ticks[f'ask_size_{i}'] = ask_lots * 100000.0
+
+    return ticks
+
+
+if __name__ == '__main__':
+
+    num_ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    ticks = make_synthetic_minute(num_ticks)
+    num_values = num_ticks * len(ticks.dtype.names)
+
+    with tempfile.TemporaryDirectory() as directory:
+        raw_path = os.path.join(directory, 'raw.obt')
+        delta_path = os.path.join(directory, 'delta.obt')
+
+        raw_size = write_tick_file(raw_path, ticks)
+
+        start = time.perf_counter()
+        delta_size = write_tick_file(delta_path, ticks, codec='delta')
+        encode_seconds = time.perf_counter() - start
+
+        read_tick_file(delta_path)  # warm up
+        start = time.perf_counter()
+        decoded = read_tick_file(delta_path)
+        decode_seconds = time.perf_counter() - start
+
+        assert all(np.array_equal(decoded[name], ticks[name]) for name in ticks.dtype.names), "Round trip mismatch"
+
+    print(f"--- Tick codec benchmark ({num_ticks:,} ticks x {len(ticks.dtype.names)} columns, compressor: {tick_codec.default_compressor()}) ---")
+    print(f"raw   .obt: {raw_size / 1e6:10.2f} MB")
+    print(f"delta .obt: {delta_size / 1e6:10.2f} MB  ({raw_size / delta_size:.1f}x smaller)")
+    print(f"encode: {num_values / encode_seconds / 1e6:8.1f} M values/sec")
+    print(f"decode: {num_values / decode_seconds / 1e6:8.1f} M values/sec")
@@ -0,0 +1,351 @@
+"""
+collector_metrics.py
+
+Low-overhead instrumentation for the data collector (COLLECTOR_METRICS = True).
+
+Tracks, per instrument, the latency of every on_orderbook_update() call and
+the number of updates, plus the ib_insync event loop lag, how long the main
+loop blocks at each minute flush, and how long each data file takes to write.
+
+Latencies go into HDR-style log-linear histograms: 16 sub-buckets per power
+of 2 (<= 6.25% relative error), stored as a plain list of counts, so recording
+a value is a few integer operations. The on_orderbook_update() durations are
+only appended to a compact array on the event loop (LatencySamples), and binned
+into a histogram with NumPy once a minute: with the two perf_counter_ns() calls
+around the capture, well under 1 us per update (see
+benchmarks/benchmark_collector_metrics.py). Percentiles are only computed once
+a minute, in roll_minute(), which also produces the per-minute summary that is
+logged, and served in plain text (Prometheus exposition format) by
+start_metrics_http_server().
+"""
+
+import array
+import http.server
+import threading
+import time
+
+import numpy as np
+
+# 16 sub-buckets per power of 2
+_SUB_BUCKET_BITS = 4
+_SUB_BUCKET_COUNT = 1 << _SUB_BUCKET_BITS
+
+# Largest bucket starts at ~2^40 ns (~18 minutes). Longer values are counted in it.
+_MAX_SHIFT = 36
+_NUM_BUCKETS = (_MAX_SHIFT + 2) * _SUB_BUCKET_COUNT
+
+REPORTED_PERCENTILES = (50, 90, 99, 99.9)
+
+
+def _bucket_midpoints():
+    midpoints = np.zeros(_NUM_BUCKETS)
+    for i in range(_NUM_BUCKETS):
+        if i < 2 * _SUB_BUCKET_COUNT:
+            midpoints[i] = i
+        else:
+            shift = i // _SUB_BUCKET_COUNT - 1
+            mantissa = i - shift * _SUB_BUCKET_COUNT
+            midpoints[i] = (mantissa << shift) + (1 << shift) / 2
+    return midpoints
+
+
+_BUCKET_MIDPOINTS = _bucket_midpoints()
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of durations, in nanoseconds.
+
+    `record()` may be called from one thread while another thread calls
+    `snapshot()`; a `reset()` racing with a `record()` may lose that one value.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * _NUM_BUCKETS
+        self.max_ns = 0
+
+    def record(self, value_ns: int) -> None:
+        if value_ns <= 0:
+            self.counts[0] += 1
+            return
+
+        # Values < 32 ns get their own bucket, then 16 buckets per power of 2
+        shift = value_ns.bit_length() - (_SUB_BUCKET_BITS + 1)
+        if shift <= 0:
+            index = value_ns
+        elif shift <= _MAX_SHIFT:
+            index = (shift << _SUB_BUCKET_BITS) + (value_ns >> shift)
+        else:
+            index = _NUM_BUCKETS - 1
+        self.counts[index] += 1
+
+        if value_ns > self.max_ns:
+            self.max_ns = value_ns
+
+    def record_many(self, values_ns: np.ndarray) -> None:
+        """Records an array of values (same buckets as record(), computed with NumPy)."""
+        values_ns = np.asarray(values_ns, dtype=np.int64)
+        if len(values_ns) == 0:
+            return
+
+        positive = np.maximum(values_ns, 1)
+        # frexp's exponent is the bit length (exact for values < 2^53)
+        shift = np.frexp(positive.astype(np.float64))[1].astype(np.int64) - (_SUB_BUCKET_BITS + 1)
+        indices = np.where(
+            shift <= 0, positive,
+            (shift << _SUB_BUCKET_BITS) + (positive >> np.clip(shift, 0, _MAX_SHIFT)))
+        indices[shift > _MAX_SHIFT] = _NUM_BUCKETS - 1
+        indices[values_ns <= 0] = 0
+
+        bucket_counts = np.bincount(indices, minlength=_NUM_BUCKETS)
+        for index in np.flatnonzero(bucket_counts):
+            self.counts[index] += int(bucket_counts[index])
+
+        self.max_ns = max(self.max_ns, int(values_ns.max()))
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: count, max_ns, and 'p50_ns', 'p90_ns', ... (see REPORTED_PERCENTILES), or just count=0.
+        """
+        counts = np.array(self.counts, dtype=np.int64)
+        count = int(counts.sum())
+        if count == 0:
+            return dict(count=0)
+
+        cumulative = np.cumsum(counts)
+        summary = dict(count=count, max_ns=self.max_ns)
+        for percentile in REPORTED_PERCENTILES:
+            index = int(np.searchsorted(cumulative, count * percentile / 100))
+            summary[f"p{percentile:g}_ns"] = min(float(_BUCKET_MIDPOINTS[index]), float(self.max_ns))
+        return summary
+
+
+class LatencySamples:
+    """
+    Raw durations, in nanoseconds, recorded on a hot path (eg. every on_orderbook_update() call).
+
+    `append(value_ns)` only appends to a compact int64 array (no bucket computation), and
+    `drain()` swaps in an empty array and returns the recorded values, to bin them into a
+    LatencyHistogram with record_many(). A value appended by another thread during the swap may be lost.
+    """
+
+    def __init__(self):
+        self._values = array.array('q')
+        self.append = self._values.append
+
+    def drain(self) -> np.ndarray:
+        values = self._values
+        self._values = array.array('q')
+        self.append = self._values.append
+        return np.frombuffer(values, dtype=np.int64) if values else np.zeros(0, dtype=np.int64)
+
+
+class EventLoopLagProbe:
+    """
+    Measures how late the asyncio event loop (ib_insync's) runs a timer scheduled every `interval` seconds.
+
+    A lag of more than a few ms means callbacks (eg. on_orderbook_update) are
+    queueing up behind slow work on the loop.
+    """
+
+    def __init__(self, loop, histogram: LatencyHistogram, interval: float = 0.1):
+        self.loop = loop
+        self.histogram = histogram
+        self.interval = interval
+        self._handle = None
+        self._expected_at = None
+
+    def start(self):
+        self._expected_at = self.loop.time() + self.interval
+        self._handle = self.loop.call_at(self._expected_at, self._fire)
+
+    def _fire(self):
+        now = self.loop.time()
+        self.histogram.record(int((now - self._expected_at) * 1e9))
+        self._expected_at = now + self.interval
+        self._handle = self.loop.call_at(self._expected_at, self._fire)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+class CollectorMetrics:
+    """
+    All of the collector's metrics. The histograms are recorded into directly.
+
+    roll_minute() is called by the main loop once a minute: it summarizes the
+    minute, resets the histograms, and keeps the summary for the scrape endpoint.
+    """
+
+    def __init__(self, instruments: list):
+        self.instruments = list(instruments)
+
+        # Recorded on the event loop thread (binned into a histogram in roll_minute())
+        self.update_latency = {instrument: LatencySamples() for instrument in self.instruments}
+        self.event_loop_lag = LatencyHistogram()
+
+        # Recorded on the main loop (drain + submit of a minute's buffers)
+        self.flush_block = LatencyHistogram()
+
+        # Recorded on the writer thread (one value per data file)
+        self.file_write = LatencyHistogram()
+
+        self.num_updates_total = {instrument: 0 for instrument in self.instruments}
+
+        # Set by the collector, called at scrape time: eg. lambda: {'EURUSD': 1234}
+        self.get_buffered_ticks = None
+        self.get_writer_queue_depth = None
+
+        self.last_summary = None
+        self._minute_started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def roll_minute(self, ticks_per_instrument: dict = None, writer_queue_depth: int = None) -> dict:
+        """
+        Summarizes the minute since the last call, and resets the histograms.
+
+        Args:
+            ticks_per_instrument (dict): Buffer length of each instrument, just before the flush.
+            writer_queue_depth (int): Minute batches waiting to be written.
+
+        Returns:
+            dict: The summary (also kept in `last_summary`, for the scrape endpoint).
+        """
+        now = time.monotonic()
+        elapsed = max(now - self._minute_started_at, 1e-9)
+        self._minute_started_at = now
+
+        instruments = {}
+        for instrument, samples in self.update_latency.items():
+            histogram = LatencyHistogram()
+            histogram.record_many(samples.drain())
+            latency = histogram.snapshot()
+            self.num_updates_total[instrument] += latency['count']
+
+            instruments[instrument] = dict(
+                num_updates=latency['count'],
+                updates_per_second=latency['count'] / elapsed,
+                buffered_ticks=(ticks_per_instrument or {}).get(instrument),
+                callback_latency=latency)
+
+        summary = dict(
+            elapsed_seconds=elapsed,
+            instruments=instruments,
+            event_loop_lag=self.event_loop_lag.snapshot(),
+            flush_block=self.flush_block.snapshot(),
+            file_write=self.file_write.snapshot(),
+            writer_queue_depth=writer_queue_depth)
+
+        for histogram in (self.event_loop_lag, self.flush_block, self.file_write):
+            histogram.reset()
+
+        with self._lock:
+            self.last_summary = summary
+
+        return summary
+
+    def render_text(self) -> str:
+        """Plain text (Prometheus exposition format) view of the metrics, for the scrape endpoint."""
+        with self._lock:
+            summary = self.last_summary
+
+        lines = []
+
+        def add(name, metric_type, samples):
+            if not samples:
+                return
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        def quantiles(histogram_summary, scale, labels):
+            if not histogram_summary or histogram_summary['count'] == 0:
+                return []
+            return [(dict(labels, quantile=f"{p / 100:g}"), round(histogram_summary[f"p{p:g}_ns"] * scale, 3))
+                    for p in REPORTED_PERCENTILES]
+
+        add('orderbook_updates_total', 'counter',
+            [({'instrument': i}, n) for i, n in self.num_updates_total.items()])
+
+        if self.get_buffered_ticks is not None:
+            add('orderbook_buffered_ticks', 'gauge',
+                [({'instrument': i}, n) for i, n in self.get_buffered_ticks().items()])
+
+        if self.get_writer_queue_depth is not None:
+            add('orderbook_writer_queue_depth', 'gauge', [({}, self.get_writer_queue_depth())])
+
+        if summary is not None:
+            add('orderbook_updates_per_second', 'gauge',
+                [({'instrument': i}, round(s['updates_per_second'], 3)) for i, s in summary['instruments'].items()])
+            add('orderbook_callback_latency_us', 'summary',
+                [sample for i, s in summary['instruments'].items()
+                 for sample in quantiles(s['callback_latency'], 1e-3, {'instrument': i})])
+            add('orderbook_event_loop_lag_us', 'summary', quantiles(summary['event_loop_lag'], 1e-3, {}))
+            add('orderbook_flush_block_ms', 'summary', quantiles(summary['flush_block'], 1e-6, {}))
+            add('orderbook_file_write_ms', 'summary', quantiles(summary['file_write'], 1e-6, {}))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _format_latency(histogram_summary, unit='us'):
+    if histogram_summary['count'] == 0:
+        return 'n/a'
+    scale = 1e-3 if unit == 'us' else 1e-6
+    return (f"p50 {histogram_summary['p50_ns'] * scale:.1f}{unit} "
+            f"p99 {histogram_summary['p99_ns'] * scale:.1f}{unit} "
+            f"max {histogram_summary['max_ns'] * scale:.1f}{unit}")
+
+
+def format_summary_line(summary: dict) -> str:
+    """One log line for roll_minute()'s summary."""
+    parts = []
+    for instrument, s in summary['instruments'].items():
+        parts.append(
+            f"{instrument}: {s['num_updates']} updates ({s['updates_per_second']:.1f}/s), "
+            f"buffered {s['buffered_ticks']}, callback {_format_latency(s['callback_latency'])}")
+
+    parts.append(f"loop lag {_format_latency(summary['event_loop_lag'], 'ms')}")
+    parts.append(f"flush block {_format_latency(summary['flush_block'], 'ms')}")
+    parts.append(f"file write {_format_latency(summary['file_write'], 'ms')}")
+    if summary['writer_queue_depth'] is not None:
+        parts.append(f"writer queue {summary['writer_queue_depth']}")
+
+    return f"Collector metrics ({summary['elapsed_seconds']:.1f}s): " + ' | '.join(parts)
+
+
+def start_metrics_http_server(metrics: CollectorMetrics, port: int, host: str = '127.0.0.1'):
+    """
+    Serves `metrics.render_text()` at http://<host>:<port>/metrics, on a daemon thread.
+
+    Returns:
+        http.server.ThreadingHTTPServer: call .shutdown() to stop it.
+    """
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+
+            body = metrics.render_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Don't write a line to stderr per scrape
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='collector-metrics-http', daemon=True).start()
+    return server
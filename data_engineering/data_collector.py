@@ -25,6 +25,16 @@
 # C. Check in GUI that data feeds reconnected.
 # - Link: https://remotedesktop.google.com/access/session/be06e795-fa40-4439-9be8-9e38c7809150
 # ---
+# 3. MULTI-INSTRUMENT MODE
+# ---
+# Pass a comma separated list of instruments, to collect all of them in ONE process, over ONE IB connection:
+# ---
+    # `python main_datafeed_orderbook.py EURUSD,GBPUSD,USDJPY`
+# ---
+# Each instrument still gets its own buffer and its own data file per minute (same file names as before),
+# and all buffers are flushed together at the start of each minute.
+# Logs go to: /localDataStoreDisk/logs/orderbook_python/EURUSD-GBPUSD-USDJPY_orderbook.log
+# ---
 
 
 # ------------------------------------
@@ -33,10 +43,72 @@ DEBUG = False
 
 # ------------------------------------
 
-from datetime import datetime, timezone
+# How depth updates are captured in on_orderbook_update():
+# - 'numpy': write each update straight into a preallocated structured array (see orderbook_buffer.py). No pandas/dict per tick.
+# - 'journal': same as 'numpy', but the array is a memory-mapped journal file on disk (see tick_journal.py).
+#   Ticks survive a crash/OOM/kill of this script, and are recovered on the next start. Always writes '.obt' files.
+# - 'deltas': apply each update's per-level changes (ticker.domTicks) to an in-place book, and only record the changes,
+#   plus periodic full snapshots (see orderbook_deltas.py). Much smaller files, and far less work per update. Always writes '.obt' files.
+# - 'legacy': build a DataFrame + dict per tick, and append it to the instrument's buffer_list_of_orderbook_ticks.
+# All modes produce the same column names, so pd.DataFrame(<file contents>) works the same way for any of them
+# ('deltas' files hold change events: use tick_file_format.load_minute_file_as_dataframe(), which replays them into full books).
+TICK_CAPTURE_MODE = 'numpy'
+
+# Format of the one-minute data files written by dump_buffer_to_file():
+# - 'obt': columnar tick file (see tick_file_format.py). Typed column per field, readable without unpickling.
+# - 'joblib': legacy joblib pickle of the buffer.
+OUTPUT_FILE_FORMAT = 'obt'
+
+# Encoding of '.obt' files written from the buffer ('journal' mode files are never encoded):
+# - 'delta': prices/sizes as integer deltas vs the previous tick, + zstd/lz4/zlib compression (see tick_codec.py). Lossless.
+# - None: raw typed columns.
+TICK_FILE_CODEC = 'delta'
+
+# After each data file is on disk, write a small JSON manifest for the instrument's minute next to it (see minute_manifest.py),
+# with the tick count, first/last tick time, size and checksum. health_monitor.py reads these, instead of listing the
+# day directory and opening the data files.
+WRITE_MINUTE_MANIFESTS = True
+
+# Also run the data integrity checks (crossed books, zero-filled levels, out of order timestamps, unordered ladders,
+# stale books, see tick_integrity.py) on each minute file, and store the counters in its manifest. A few ms per file,
+# on the file writer's thread. health_monitor.py adds them to the minute's Pub/Sub event.
+VALIDATE_MINUTE_FILES = True
+
+# Drop depth updates that leave the top levels byte-identical to the previous update (bursts of these inflate the
+# files and the downstream `total_ticks` features). Suppressed updates are only counted, in each file's
+# meta['num_suppressed_updates']. Not applied in 'legacy' mode.
+# - Off by default: turning it on lowers tick counts vs. the historical files the models were trained on.
+DEDUP_IDENTICAL_BOOKS = False
+
+# Also publish every depth update to a shared memory ring per instrument (see live_tick_ring.py), so local
+# consumers (eg. the prediction service) get each book within microseconds, instead of after the minute flush.
+LIVE_FANOUT = False
+
+# Built-in instrumentation (see collector_metrics.py): on_orderbook_update() latency histograms, updates/sec,
+# buffer length, event loop lag and flush/write durations. A summary line is logged every minute.
+# - Adds ~0.6 us per depth update to on_orderbook_update() (see benchmarks/benchmark_collector_metrics.py).
+COLLECTOR_METRICS = True
+
+# Serve the metrics in plain text at http://127.0.0.1:<port>/metrics (None: don't serve them).
+# - If the port is taken (eg. by another collector process), the endpoint is skipped with a warning.
+METRICS_HTTP_PORT = 9108
+
+# Offline load testing: use simulated_ib.SimulatedIB (replayed or synthetic books, with injected errors/disconnects)
+# instead of connecting to an IB gateway. None: connect to IB. Otherwise, the SimulatedIB arguments, eg.
+# - dict(speed=100, error_317_every=60, disconnect_every=600)
+# - dict(recorded_files='/localDataStoreDisk/orderbook_data/2024-03-04/{instrument}_orderbook_ticks_*.obt', speed=10)
+SIMULATED_FEED = None
 
-import threading
+# ------------------------------------
+
+from datetime import datetime, timedelta, timezone
+
+import signal
 import sys
+import time
+import os
+import glob
+import json
 import logging
 import logging.handlers
 import pandas as pd
@@ -48,13 +120,72 @@ from libHelpers import fileHelpers
 from libHelpers import getConfig
 from libHelpers import ibAPIHelpers
 
+from orderbook_buffer import OrderbookTickBuffer, now_epoch_us, ticks_from_records
+from tick_file_format import read_tick_file, write_tick_file
+from tick_journal import TickJournal, TICK_JOURNAL_EXTENSION, read_tick_journal_meta, recover_tick_journal
+from orderbook_deltas import DepthDeltaRecorder
+from minute_file_writer import MinuteFileWriter
+from live_tick_ring import LiveTickRingWriter
+from collector_metrics import CollectorMetrics, EventLoopLagProbe, format_summary_line, start_metrics_http_server
+from simulated_ib import SimulatedIB
+from minute_manifest import SUMMARY_COLUMNS, summarize_ticks, write_minute_manifest
+from tick_integrity import integrity_errors, validate_tick_file, validate_ticks
+from session_calendar import instrument_class_of_contract_type, is_trading_minute
+
 # ------------------------------------
 
-buffer_list_of_orderbook_ticks = []
+# Local store for data files
+LOCAL_DATA_DIRECTORY = '/localDataStoreDisk/orderbook_data/'
 
-pending_tasks = []
+# Unfinished tick journals (TICK_CAPTURE_MODE = 'journal'). Kept outside the date folders, so the health monitor never sees them.
+TICK_JOURNAL_DIRECTORY = LOCAL_DATA_DIRECTORY + 'journal/'
+
+# Minute batches that didn't fit in the writer queue (slow disk), see minute_file_writer.py
+WRITER_SPILL_DIRECTORY = LOCAL_DATA_DIRECTORY + 'spill/'
+
+# Max # of minute batches waiting to be written, before new batches are spilled to disk
+WRITER_MAX_QUEUE_SIZE = 4
+
+# Log files, one per process (see setup_logging())
+LOG_DIRECTORY = '/localDataStoreDisk/logs/orderbook_python'
+
+# Overrides of any of the settings above, as a JSON object of setting name -> value in this environment variable.
+# Eg. to run this script against a simulated feed, in a scratch directory (see benchmarks/benchmark_collector_replay.py):
+    # `ORDERBOOK_COLLECTOR_CONFIG='{"SIMULATED_FEED": {"speed": 100}, "LOCAL_DATA_DIRECTORY": "/tmp/replay/", "METRICS_HTTP_PORT": null}' python data_collector.py EURUSD`
+# The journal and spill directories follow an overridden LOCAL_DATA_DIRECTORY, unless they're overridden too.
+CONFIG_OVERRIDES_ENVIRONMENT_VARIABLE = 'ORDERBOOK_COLLECTOR_CONFIG'
+
+def apply_config_overrides(overrides):
+    if 'LOCAL_DATA_DIRECTORY' in overrides:
+        overrides.setdefault('TICK_JOURNAL_DIRECTORY', overrides['LOCAL_DATA_DIRECTORY'] + 'journal/')
+        overrides.setdefault('WRITER_SPILL_DIRECTORY', overrides['LOCAL_DATA_DIRECTORY'] + 'spill/')
+
+    for name, value in overrides.items():
+        if not name.isupper() or name not in globals():
+            raise ValueError(f"Unknown setting in {CONFIG_OVERRIDES_ENVIRONMENT_VARIABLE}: {name}")
+        globals()[name] = value
+
+if os.environ.get(CONFIG_OVERRIDES_ENVIRONMENT_VARIABLE):
+    apply_config_overrides(json.loads(os.environ[CONFIG_OVERRIDES_ENVIRONMENT_VARIABLE]))
 
-ticker = None
+# ------------------------------------
+
+# Writes the data files on a persistent background thread (created at the start of the main while loop)
+minute_file_writer = None
+
+# Used when COLLECTOR_METRICS == True (created in MAIN SET UP)
+collector_metrics = None
+
+# ------------------------------------
+
+# One InstrumentFeed per instrument collected by this process, eg. {'EURUSD': InstrumentFeed(...)}
+feeds = {}
+
+# Used by on_orderbook_update() to route each depth update to its instrument: {contract.conId: InstrumentFeed}
+feeds_by_con_id = {}
+
+# Eg. [('resubscribe_depth_data()', 'EURUSD')]
+pending_tasks = []
 
 # Used for tracking script run time while api connected
 last_successful_api_connect_time = None 
@@ -76,6 +207,66 @@ last_successful_api_connect_time = None
 # print("k" + 1) 
 # ------------------------------------
 
+class InstrumentFeed:
+    # State for a single instrument's order book subscription.
+    # Every instrument gets its own contract, ticker and tick buffer,
+    # but all of them share the same IB connection and event loop.
+
+    def __init__(self, instrument, type_of_contract):
+        self.instrument = instrument
+        self.type_of_contract = type_of_contract
+
+        self.contract = None
+        self.ticker = None
+
+        # Used when TICK_CAPTURE_MODE == 'numpy', 'journal' or 'deltas' (created in ib_connect(), once we know num_orderbook_levels)
+        self.tick_buffer = None
+
+        # Used when TICK_CAPTURE_MODE == 'legacy'
+        self.buffer_list_of_orderbook_ticks = []
+
+        # Used when LIVE_FANOUT == True (created in ib_connect())
+        self.live_ring = None
+
+        # Used when COLLECTOR_METRICS == True: on_orderbook_update() durations (collector_metrics.LatencySamples)
+        self.update_latency = None
+
+    def num_buffered_ticks(self):
+        if TICK_CAPTURE_MODE in ('numpy', 'journal', 'deltas'):
+            return len(self.tick_buffer) if self.tick_buffer is not None else 0
+        return len(self.buffer_list_of_orderbook_ticks)
+
+    def drain_capture_meta(self):
+        # Capture stats for the minute being drained, stored in the data file's meta. Call just before drain_tick_buffer().
+        meta = {}
+        if DEDUP_IDENTICAL_BOOKS and TICK_CAPTURE_MODE in ('numpy', 'deltas'):
+            meta['num_suppressed_updates'] = self.tick_buffer.num_suppressed
+        if TICK_CAPTURE_MODE == 'deltas':
+            # Update events with an empty domTicks (nothing to record), counted whether or not dedup is on
+            meta['num_empty_updates'] = self.tick_buffer.num_empty_updates
+
+        # ('journal' mode: the journal stores its own count when it's finalized)
+        return meta
+
+    def drain_tick_buffer(self):
+        # Returns the ticks captured so far, and clears the buffer for the next minute.
+        # The returned data is a copy, so it's safe to hand to dump_buffer_to_file() on another thread.
+        if TICK_CAPTURE_MODE in ('numpy', 'deltas'):
+            return self.tick_buffer.drain()
+
+        if TICK_CAPTURE_MODE == 'journal':
+            # A journal isn't drained: hand over this minute's journal (it's finalized by dump_buffer_to_file), and start a new one for the next minute
+            journal = self.tick_buffer
+            self.tick_buffer = open_tick_journal(self.instrument)
+            return journal
+
+        buffer_copy = self.buffer_list_of_orderbook_ticks.copy()
+
+        # Clear current buffer
+        self.buffer_list_of_orderbook_ticks = []
+
+        return buffer_copy
+
 class CustomIBLogFilter(logging.FileHandler):
     def emit(self, record):
         # Change the log level of expected IB API errors
@@ -95,7 +286,16 @@ def custom_error_handler_IB_API(reqId, errorCode, errorString, contract):
         # 317: "Market depth data has been RESET" 
         # 1101: "Connectivity between IB and TWS has been restored - data lost.""
         script_logger.info(f"Handling Error {errorCode}: Adding pending_task to resubscribe_depth_data next flush for contract {contract}")
-        pending_tasks.append('resubscribe_depth_data()') # will run during next flush_buffer
+
+        # Only resubscribe the instrument the error is about.
+        # Errors without a contract (eg. 1101, which affects the whole connection) resubscribe every instrument.
+        feed = feeds_by_con_id.get(contract.conId) if contract is not None else None
+        instruments_to_resubscribe = [feed.instrument] if feed is not None else list(feeds)
+
+        for instrument in instruments_to_resubscribe:
+            task = ('resubscribe_depth_data()', instrument)
+            if task not in pending_tasks:
+                pending_tasks.append(task) # will run during next flush
 
     # elif errorCode == 1100:
     #     # Expected maintenance window for North American IB servers
@@ -116,7 +316,7 @@ def setup_logging(instrument):
 
     ib_api_logger_level = logging.ERROR
 
-    log_file_path = "/localDataStoreDisk/logs/orderbook_python"
+    log_file_path = LOG_DIRECTORY
     log_filename_format = f"{log_file_path}/{instrument}_orderbook.log"
 
     # include file name and function name in log events
@@ -164,13 +364,13 @@ if __name__ == "__main__":
 
     if len(sys.argv) < 2:
 
-        print("Usage: python monitor_instrument_orderbook.py <instrument> <contract_type (optional)>")
+        print("Usage: python monitor_instrument_orderbook.py <instrument[,instrument,...]> <contract_type (optional)>")
         # contract_type: options are: <Forex|Crypto>. eg. BTC
         # ---
         # eg. /home/austengary/my-jupyter-env/bin/python /home/austengary/Desktop/Dev/System_Code/Testing/IB_API/main_datafeed_orderbook.py BTC Crypto
         sys.exit(1)
 
-    instrument_to_monitor = sys.argv[1] # 'EURUSD', 'USDJPY', 'GBPUSD'
+    instruments_to_monitor = sys.argv[1].split(',') # 'EURUSD', 'USDJPY', 'GBPUSD', or 'EURUSD,GBPUSD,USDJPY'
 
     try: 
         # Optional argument
@@ -179,7 +379,38 @@ if __name__ == "__main__":
         # If optional argument is not given, default to forex
         type_of_contract = 'Forex'
 
-    script_logger = setup_logging(instrument=instrument_to_monitor)
+    for instrument in instruments_to_monitor:
+        feeds[instrument] = InstrumentFeed(instrument, type_of_contract)
+
+    script_logger = setup_logging(instrument='-'.join(instruments_to_monitor))
+
+    if TICK_CAPTURE_MODE == 'journal' and OUTPUT_FILE_FORMAT != 'obt':
+        raise ValueError("TICK_CAPTURE_MODE = 'journal' finalizes journals into '.obt' files. Set OUTPUT_FILE_FORMAT = 'obt'.")
+
+    if TICK_CAPTURE_MODE == 'deltas' and OUTPUT_FILE_FORMAT != 'obt':
+        raise ValueError("TICK_CAPTURE_MODE = 'deltas' writes '.obt' files (tagged as depth deltas for readers). Set OUTPUT_FILE_FORMAT = 'obt'.")
+
+    def handle_sigterm(signum, frame):
+        # `systemctl stop/restart` sends SIGTERM. Raise SystemExit instead of dying immediately,
+        # so the main loop's `finally` block runs, and every buffered/queued minute is written before exiting.
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    if COLLECTOR_METRICS:
+        collector_metrics = CollectorMetrics(instruments_to_monitor)
+
+        for feed in feeds.values():
+            feed.update_latency = collector_metrics.update_latency[feed.instrument]
+
+        collector_metrics.get_buffered_ticks = lambda: {feed.instrument: feed.num_buffered_ticks() for feed in feeds.values()}
+
+        if METRICS_HTTP_PORT is not None:
+            try:
+                start_metrics_http_server(collector_metrics, METRICS_HTTP_PORT)
+                script_logger.info(f"Serving collector metrics at http://127.0.0.1:{METRICS_HTTP_PORT}/metrics")
+            except OSError as e:
+                script_logger.warning(f"Not serving collector metrics, port {METRICS_HTTP_PORT} is unavailable: {e}.")
 
 # ----------------------------------------------------
 # ----------------------------------------------------
@@ -189,7 +420,34 @@ if __name__ == "__main__":
 
 def on_orderbook_update(tick_update):
 
-    global buffer_list_of_orderbook_ticks
+    # All instruments share this callback, so look up which instrument this update is for
+    feed = feeds_by_con_id[tick_update.contract.conId]
+
+    # COLLECTOR_METRICS: the capture is timed inline (no extra function call), and only the raw duration is
+    # appended here; it's binned into the latency histogram once a minute (see collector_metrics.LatencySamples).
+    update_latency = feed.update_latency
+    if update_latency is not None:
+        started_ns = time.perf_counter_ns()
+
+    timestamp_us = now_epoch_us()
+
+    if feed.live_ring is not None:
+        feed.live_ring.publish(timestamp_us, tick_update.domBids, tick_update.domAsks)
+
+    if TICK_CAPTURE_MODE in ('numpy', 'journal'):
+        # Fast path: this runs on the ib_insync event loop for EVERY depth update, so keep it allocation free.
+        feed.tick_buffer.record(timestamp_us, tick_update.domBids, tick_update.domAsks)
+    elif TICK_CAPTURE_MODE == 'deltas':
+        # Only the levels that changed since the last update event (ib_insync clears domTicks after every update event)
+        feed.tick_buffer.record(timestamp_us, tick_update.domTicks)
+    else:
+        capture_legacy_orderbook_update(feed, tick_update)
+
+    if update_latency is not None:
+        update_latency.append(time.perf_counter_ns() - started_ns)
+
+def capture_legacy_orderbook_update(feed, tick_update):
+    # TICK_CAPTURE_MODE == 'legacy': a dict (and DataFrame) per update, appended to a list
 
     ###########
     
@@ -210,8 +468,8 @@ def on_orderbook_update(tick_update):
         pass # Minimal logging in production callback
     
     if DEBUG:
-        print(f'Got orderbook update for {instrument_to_monitor} at {now}')
-        #script_logger.debug(f"Got orderbook update for {instrument_to_monitor} at {now}")
+        print(f'Got orderbook update for {feed.instrument} at {now}')
+        #script_logger.debug(f"Got orderbook update for {feed.instrument} at {now}")
 
     ###########
 
@@ -276,39 +534,42 @@ def on_orderbook_update(tick_update):
     # print(market_actor_in_control)
 
     # Add bids and ask ticks to buffer
-    buffer_list_of_orderbook_ticks.append(_update_dict)
+    feed.buffer_list_of_orderbook_ticks.append(_update_dict)
 
-def resubscribe_depth_data():
+def resubscribe_depth_data(feed):
     # Function to be used when data connection is reset
-    global ticker
     
     try:
-        script_logger.info('Attempting to resubscribe_depth_data().')
+        script_logger.info(f'Attempting to resubscribe_depth_data() for {feed.instrument}.')
 
         # Clean up existing subscription if any
-        if ticker is not None:
+        if feed.ticker is not None:
 
             # Remove existing handler first
-            ticker.updateEvent -= on_orderbook_update
+            feed.ticker.updateEvent -= on_orderbook_update
 
             # Then cancel the market depth subscription
-            ib.cancelMktDepth(contract, isSmartDepth=True)
+            ib.cancelMktDepth(feed.contract, isSmartDepth=True)
 
             # Clear the reference
-            ticker = None  
+            feed.ticker = None  
 
             # Sleep to give IB Java API a chance to clear any remaining handlers
             ib.sleep(0.2)
 
+        if TICK_CAPTURE_MODE == 'deltas':
+            # The new subscription sends the whole book again (as inserts), so start from an empty book
+            feed.tick_buffer.reset(now_epoch_us())
+
         # Create new subscription
-        ticker = ib.reqMktDepth(contract, 
-                               numRows=num_orderbook_levels, 
-                               isSmartDepth=True)
+        feed.ticker = ib.reqMktDepth(feed.contract, 
+                                    numRows=num_orderbook_levels, 
+                                    isSmartDepth=True)
         
         # Add new handler
-        ticker.updateEvent += on_orderbook_update
+        feed.ticker.updateEvent += on_orderbook_update
 
-        script_logger.info('Ran resubscribe_depth_data() successfully.')
+        script_logger.info(f'Ran resubscribe_depth_data() for {feed.instrument} successfully.')
 
         return True
     
@@ -322,17 +583,38 @@ def resubscribe_depth_data():
 
         return False
 
+def create_contract(instrument, type_of_contract):
+
+    # Docs on how to use IB contracts API: 
+    if True:
+        # Guide to set up IB contracts for various instruments (eg. stock, options, bond, crypto, etc.): 
+        # > https://github.com/erdewit/ib_insync/blob/master/ib_insync/contract.py
+        # ---
+        pass
+
+    if type_of_contract == 'Forex':
+        return ib_insync.Forex(instrument)
+
+    elif type_of_contract == 'Crypto':
+        # Using zerohash exchange
+        return ib_insync.Crypto(instrument, 'ZEROHASH', 'USD')
+
+    else:
+        raise ValueError('Invalid type_of_contract. Options are: <Forex|Crypto>')
+
 def ib_connect():
 
     global num_orderbook_levels, \
         last_successful_api_connect_time, \
-            pending_tasks, \
-                ticker
+            pending_tasks
 
     #############
 
     # Read IB API config file
-    if True:
+    if SIMULATED_FEED is not None:
+        host, port = 'simulated', 0
+
+    else:
 
         config = getConfig.read_config_file()
         defaults = config.defaults()
@@ -350,13 +632,17 @@ def ib_connect():
 
         try:
 
-            unused_client_id = ibAPIHelpers.find_unused_ib_client_id(script_logger)
+            if SIMULATED_FEED is not None:
+                unused_client_id = 1
+            else:
+                unused_client_id = ibAPIHelpers.find_unused_ib_client_id(script_logger)
+
             if unused_client_id is None:
                 raise Exception("Got invalid clientID from ibAPIHelpers.find_unused_ib_client_id.")
             
             script_logger.info(
                 f"Attempting to connect to IB API: {host}, {port}, "
-                f"clientId={unused_client_id}, contract={instrument_to_monitor}.")
+                f"clientId={unused_client_id}, contracts={', '.join(feeds)}.")
 
             ib.connect(host, port, clientId=unused_client_id)
             ib.errorEvent += custom_error_handler_IB_API
@@ -387,62 +673,71 @@ def ib_connect():
 
     ###################
 
-    # Setup contact for instrument
+    # Setup contract for each instrument
     if True:
 
-        # Docs on how to use IB contracts API: 
-        if True:
-            # Guide to set up IB contracts for various instruments (eg. stock, options, bond, crypto, etc.): 
-            # > https://github.com/erdewit/ib_insync/blob/master/ib_insync/contract.py
-            # ---
-            pass
-
-        if type_of_contract == 'Forex':
-            contract = ib_insync.Forex(instrument_to_monitor)
-
-        elif type_of_contract == 'Crypto':
-            # Using zerohash exchange
-            contract = ib_insync.Crypto(instrument_to_monitor, 'ZEROHASH', 'USD')
-
-        else:
-            raise ValueError('Invalid type_of_contract. Options are: <Forex|Crypto>')
+        for feed in feeds.values():
+            feed.contract = create_contract(feed.instrument, feed.type_of_contract)
     
-        ib.qualifyContracts(contract)
+        # Qualify all contracts in one request (fills in conId, used to route ticker updates)
+        ib.qualifyContracts(*[feed.contract for feed in feeds.values()])
+
+        feeds_by_con_id.clear()
+        for feed in feeds.values():
+            feeds_by_con_id[feed.contract.conId] = feed
 
     ###################
 
     # Setup orderbook connection
     if True:
         num_orderbook_levels = 10
-        
-        script_logger.info(
-            f"Starting orderbook monitoring for {instrument_to_monitor}, with {num_orderbook_levels} levels of market depth.")
-        
-        if DEBUG:
-            print(f"Starting orderbook monitoring for {instrument_to_monitor}, {num_orderbook_levels} levels of market depth")
 
-        # Setup orderbook callback
-        ticker = ib.reqMktDepth(contract, 
-                                numRows=num_orderbook_levels, 
-                                isSmartDepth=True)
-        ticker.updateEvent += on_orderbook_update
+        for feed in feeds.values():
+
+            if TICK_CAPTURE_MODE == 'numpy' and feed.tick_buffer is None:
+                feed.tick_buffer = OrderbookTickBuffer(num_levels=num_orderbook_levels, dedup=DEDUP_IDENTICAL_BOOKS)
+
+            if TICK_CAPTURE_MODE == 'journal' and feed.tick_buffer is None:
+                feed.tick_buffer = open_tick_journal(feed.instrument)
 
-    return contract
+            if TICK_CAPTURE_MODE == 'deltas':
+                if feed.tick_buffer is None:
+                    feed.tick_buffer = DepthDeltaRecorder(num_levels=num_orderbook_levels, dedup=DEDUP_IDENTICAL_BOOKS)
+                else:
+                    # Reconnecting: the new subscription sends the whole book again, so start from an empty book
+                    feed.tick_buffer.reset(now_epoch_us())
+
+            if LIVE_FANOUT and feed.live_ring is None:
+                feed.live_ring = LiveTickRingWriter(feed.instrument, num_levels=num_orderbook_levels)
+            
+            script_logger.info(
+                f"Starting orderbook monitoring for {feed.instrument}, with {num_orderbook_levels} levels of market depth.")
+            
+            if DEBUG:
+                print(f"Starting orderbook monitoring for {feed.instrument}, {num_orderbook_levels} levels of market depth")
+
+            # Setup orderbook callback (the same callback is shared by all instruments)
+            feed.ticker = ib.reqMktDepth(feed.contract, 
+                                        numRows=num_orderbook_levels, 
+                                        isSmartDepth=True)
+            feed.ticker.updateEvent += on_orderbook_update
 
     ################### [FUNCTION END: ib_connect()]
 
-def ib_disconnect(contract):
+def ib_disconnect():
     script_logger.info('Disconnecting from IB API...')
 
     try: 
-        ib.cancelMktDepth(contract, isSmartDepth=True)
+        for feed in feeds.values():
+            if feed.contract is not None:
+                ib.cancelMktDepth(feed.contract, isSmartDepth=True)
         ib.disconnect()
         script_logger.info('Successfully disconnected from IB API...')
 
     except Exception as e:
         script_logger.exception(f"Error processing ib_disconnect(): {e}.")
 
-def dump_buffer_to_file(data_array, incomplete_sample_type=None):
+def dump_buffer_to_file(data_array, instrument, incomplete_sample_type=None, capture_meta=None):
 
     # ------------------------------------------------------
     # Be careful NOT to introduce any signficiant processing TIME into this function (flush_buffer)
@@ -462,23 +757,28 @@ def dump_buffer_to_file(data_array, incomplete_sample_type=None):
     if incomplete_sample_type is not None:
         file_label = incomplete_sample_type
         
-    current_datetime, current_date = timeHelpers.get_current_date_and_time()
+    # The file is named after the minute its ticks were drained at (see drain_all_tick_buffers()), not the time it's
+    # written at, which is later when the writer queue is backed up or the batch was spilled to disk before a restart
+    capture_meta = capture_meta or {}
+    if 'drained_at' in capture_meta:
+        current_datetime, current_date = capture_meta['drained_at'], capture_meta['drained_date']
+    else:
+        current_datetime, current_date = timeHelpers.get_current_date_and_time()
 
     # Local store for data files
-    _local_data_directory = '/localDataStoreDisk/orderbook_data/'
-    _local_data_directory = _local_data_directory + current_date + '/'
+    _local_data_directory = LOCAL_DATA_DIRECTORY + current_date + '/'
 
     fileHelpers.create_folder_if_not_exists(_local_data_directory)
 
     file_label = None
 
-    base_name = f"{instrument_to_monitor}_orderbook_ticks_{current_datetime}"
+    base_name = f"{instrument}_orderbook_ticks_{current_datetime}"
     if file_label is not None:
         base_name += f"_{file_label}"
 
     output_file_name = fileHelpers.generate_unique_filename(
         base_name=base_name,
-        extension="joblib",
+        extension=OUTPUT_FILE_FORMAT,
         directory=_local_data_directory)
     
     output_file_name_with_path = _local_data_directory + output_file_name
@@ -492,33 +792,171 @@ def dump_buffer_to_file(data_array, incomplete_sample_type=None):
             f"Saving buffer contents to local file: {output_file_name_with_path}\n"
             f"Total orderbook update ticks written: {len(data_array)}")
    
-    # Use joblib to write to file
-    joblib.dump(data_array, output_file_name_with_path) 
+    # Volume statistics and integrity counters for the manifest (journal ticks are only summarized once finalized, below)
+    tick_summary = None
+    integrity = None
+    if WRITE_MINUTE_MANIFESTS and not isinstance(data_array, TickJournal):
+        tick_summary = summarize_ticks(data_array, num_levels=num_orderbook_levels)
+        if VALIDATE_MINUTE_FILES:
+            integrity = validate_ticks(data_array, num_levels=num_orderbook_levels)
+
+    if isinstance(data_array, TickJournal):
+        # The ticks are already on disk, so this is just a truncate + rename
+        data_array.finalize(output_file_name_with_path)
+
+        if WRITE_MINUTE_MANIFESTS:
+            tick_summary = summarize_ticks(read_tick_file(output_file_name_with_path, columns=SUMMARY_COLUMNS, mmap=True))
+            if VALIDATE_MINUTE_FILES:
+                integrity = validate_tick_file(output_file_name_with_path)
+
+    elif OUTPUT_FILE_FORMAT == 'obt':
+        if isinstance(data_array, list):
+            # Ticks captured with TICK_CAPTURE_MODE = 'legacy'
+            data_array = ticks_from_records(data_array, num_levels=num_orderbook_levels)
+
+        meta = dict(instrument=instrument, num_levels=num_orderbook_levels, **capture_meta)
+
+        if TICK_CAPTURE_MODE == 'deltas':
+            # Rows are depth change events, not books (see orderbook_deltas.py)
+            meta.update(kind='depth_deltas', n_updates=int(data_array['update_end'].sum()))
+
+        write_tick_file(
+            output_file_name_with_path,
+            data_array,
+            meta=meta,
+            codec=TICK_FILE_CODEC)
+    else:
+        # Use joblib to write to file
+        joblib.dump(data_array, output_file_name_with_path) 
+
+    if WRITE_MINUTE_MANIFESTS:
+        # Only once the data file is complete (renamed into place), so the manifest's existence means the minute is written.
+        # The minute is the one in the data file's name, eg. '2024-03-04T22:16' for '..._2024-03-04T22:16:00.010191.obt'.
+        write_minute_manifest(output_file_name_with_path, instrument, current_datetime[:16], tick_summary, integrity)
+
+        if integrity is not None and integrity_errors(integrity):
+            script_logger.warning(f"Data integrity check failed for {output_file_name}: {integrity_errors(integrity)}")
 
     # Clear buffer
     data_array = [] 
 
-    # If we have pending tasks, execute them
-    if len(pending_tasks) > 0:
+    return data_array
+
+def open_tick_journal(instrument):
+    # Starts a new journal for the instrument's next minute of ticks (TICK_CAPTURE_MODE = 'journal')
+    current_datetime, current_date = timeHelpers.get_current_date_and_time()
+
+    fileHelpers.create_folder_if_not_exists(TICK_JOURNAL_DIRECTORY)
 
-        # For each pending task
-        for task in pending_tasks.copy():
-            # If orderbook data was reset
-            if task == "resubscribe_depth_data()":
-                if resubscribe_depth_data():
-                    # Remove task only *AFTER* it has sucessfully ran
-                    pending_tasks.remove(task)
+    return TickJournal(
+        journal_path=f"{TICK_JOURNAL_DIRECTORY}{instrument}_orderbook_ticks_{current_datetime}.{TICK_JOURNAL_EXTENSION}",
+        num_levels=num_orderbook_levels,
+        meta=dict(instrument=instrument, num_levels=num_orderbook_levels, opened_at=current_datetime, opened_date=current_date),
+        dedup=DEDUP_IDENTICAL_BOOKS)
 
-    return data_array
+def recover_unfinished_tick_journals():
+    # Journals left behind by a crash/kill of this script are finalized into '_recovered' data files,
+    # in the date folder of the minute they were started in.
+    # - The '_recovered' label keeps them out of the health monitor's checks for the current minute.
+    for journal_path in glob.glob(f"{TICK_JOURNAL_DIRECTORY}*.{TICK_JOURNAL_EXTENSION}"):
+
+        meta = read_tick_journal_meta(journal_path)
+
+        if meta['instrument'] not in feeds:
+            # Belongs to another collector process
+            continue
+
+        _local_data_directory = LOCAL_DATA_DIRECTORY + meta['opened_date'] + '/'
+        fileHelpers.create_folder_if_not_exists(_local_data_directory)
+
+        output_file_name_with_path = (
+            f"{_local_data_directory}{meta['instrument']}_orderbook_ticks_{meta['opened_at']}_recovered.obt")
+
+        num_recovered_ticks = recover_tick_journal(journal_path, output_file_name_with_path)
+
+        if num_recovered_ticks == 0:
+            script_logger.info(f"Removed empty unfinished tick journal: {journal_path}.")
+        else:
+            script_logger.info(
+                f"Recovered unfinished tick journal: {journal_path}. "
+                f"# of ticks recovered: {num_recovered_ticks}, written to: {output_file_name_with_path}")
+
+def dump_buffers_to_files(buffers_to_write):
+    # Writes one data file per instrument, eg. [('EURUSD', <ticks>, <capture meta>), ('GBPUSD', <ticks>, <capture meta>)]
+    for instrument, data_array, capture_meta in buffers_to_write:
+        try:
+            started_ns = time.perf_counter_ns()
+            dump_buffer_to_file(data_array, instrument, capture_meta=capture_meta)
+
+            if collector_metrics is not None:
+                collector_metrics.file_write.record(time.perf_counter_ns() - started_ns)
+        except Exception as e:
+            # Don't let one failed write stop the other instruments' files from being written
+            script_logger.exception(f"Error writing data file for {instrument}: {e}.")
+
+def drain_all_tick_buffers():
+    # Drain every instrument's buffer in the same pass, so all files for a minute cover the same time range.
+    # - We use `>1` and NOT `0` - as sometimes the API passes a single tick/char during closed periods, which would result in an empty data file being created.
+    buffers_to_write = []
+    feeds_without_ticks = []
+
+    # Drain time, for the file names, day folder and manifests (carried in the capture meta, so a batch written
+    # late - from a backed up queue, or a spill file picked up on restart - still gets its own minute)
+    drained_at, drained_date = timeHelpers.get_current_date_and_time()
+
+    for feed in feeds.values():
+        if feed.num_buffered_ticks() > 1:
+            capture_meta = dict(feed.drain_capture_meta(), drained_at=drained_at, drained_date=drained_date)
+            buffers_to_write.append((feed.instrument, feed.drain_tick_buffer(), capture_meta))
+        else:
+            feeds_without_ticks.append(feed)
+
+    return buffers_to_write, feeds_without_ticks
+
+def num_buffered_ticks():
+    return sum(feed.num_buffered_ticks() for feed in feeds.values())
+
+def run_pending_tasks():
+    # Runs on the main loop (never on the writer thread), since ib_insync is not thread safe.
+    for task in pending_tasks.copy():
+        task_name, instrument = task
+
+        # If orderbook data was reset
+        if task_name == "resubscribe_depth_data()":
+            if resubscribe_depth_data(feeds[instrument]):
+                # Remove task only *AFTER* it has sucessfully ran
+                pending_tasks.remove(task)
 
 # ---------------
 
 # MAIN WHILE LOOP
 try:
 
+    # Recover ticks from journals left behind by a previous crash (before we start new journals in ib_connect)
+    if TICK_CAPTURE_MODE == 'journal':
+        recover_unfinished_tick_journals()
+
+    minute_file_writer = MinuteFileWriter(
+        write_batch=dump_buffers_to_files,
+        max_queue_size=WRITER_MAX_QUEUE_SIZE,
+        spill_directory=WRITER_SPILL_DIRECTORY,
+        logger=script_logger)
+
+    if collector_metrics is not None:
+        collector_metrics.get_writer_queue_depth = lambda: minute_file_writer.queue_depth
+
     # Set up connection to IB API
-    ib = ib_insync.IB() 
-    contract = ib_connect()
+    if SIMULATED_FEED is not None:
+        script_logger.info(f"Using a simulated IB feed (offline load test): {SIMULATED_FEED}")
+        ib = SimulatedIB(logger=script_logger, **SIMULATED_FEED)
+    else:
+        ib = ib_insync.IB() 
+
+    if collector_metrics is not None and SIMULATED_FEED is None:
+        # Measures how late ib_insync's event loop runs, eg. when updates arrive faster than we process them
+        EventLoopLagProbe(ib_insync.util.getLoop(), collector_metrics.event_loop_lag).start()
+
+    ib_connect()
 
     # Loop params
     iterations = 1
@@ -534,40 +972,54 @@ try:
 
             # IB.sleep() until the START of the NEXT minute.
             time_to_next_minute = timeHelpers.time_until_next_minute()
-            ib_insync.IB.sleep(time_to_next_minute)
+            ib.sleep(time_to_next_minute)
 
             if DEBUG:
                 print(f'sleeping till {time_to_next_minute}.')
 
             # --------------------
 
-            # If we have ticks to flush, write them to the file.
-            # - We use `>1` and NOT `0` - as sometimes the API passes a single tick/char during closed periods, which would result in an empty data file being created.
+            # If we have ticks to flush, write them to the file (one file per instrument).
 
-            if len(buffer_list_of_orderbook_ticks) > 1: 
-                buffer_copy = buffer_list_of_orderbook_ticks.copy()
+            ticks_per_instrument = {feed.instrument: feed.num_buffered_ticks() for feed in feeds.values()}
+            flush_started_ns = time.perf_counter_ns()
 
-                # Clear current buffer
-                buffer_list_of_orderbook_ticks = [] 
+            buffers_to_write, feeds_without_ticks = drain_all_tick_buffers()
 
-                threading.Thread(target=dump_buffer_to_file, args=(buffer_copy,)).start()
+            if buffers_to_write: 
+                minute_file_writer.submit(buffers_to_write)
 
                 if DEBUG:
                     print('flushing data')
 
-            else: 
+            script_logger.debug(f"Minute file writer metrics: {minute_file_writer.get_metrics()}")
+
+            if collector_metrics is not None:
+                collector_metrics.flush_block.record(time.perf_counter_ns() - flush_started_ns)
+
+                metrics_summary = collector_metrics.roll_minute(ticks_per_instrument, minute_file_writer.queue_depth)
+                script_logger.info(format_summary_line(metrics_summary))
+
+            for feed in feeds_without_ticks: 
                 # If we have no ticks to flush
 
                 if DEBUG:
-                    print('skipping flush due to insufficient data.')
+                    print(f'skipping flush for {feed.instrument} due to insufficient data.')
                     
-                script_logger.info('skipping flush due to insufficent data.')
+                script_logger.info(f'skipping flush for {feed.instrument} due to insufficent data.')
 
-                if instrument_to_monitor == 'USDJPY':
+                if feed.instrument == 'USDJPY':
                     # What this does, is that for every minute we don't have any ticks in the buffer, for USDJPY, we reset the orderbook connection.
                     # - I'm testing this change, since USDJPY seems to be having issues reconnecting to the datafeed (periodically/intermittently) after the daily 5pm ET forex market pause
                     # - For more info, see: (`TEXT/DONE/11.18.24 - BIG PROBLEM DATA FEED.txt`).
-                    resubscribe_depth_data()
+                    # Only if the market was open during the minute that just ended (see session_calendar.py):
+                    # no ticks while it's closed (daily pause, weekend) is expected, and resubscribing then is just churn.
+                    minute_just_ended = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(minutes=1)
+                    if is_trading_minute(instrument_class_of_contract_type(feed.type_of_contract), minute_just_ended):
+                        resubscribe_depth_data(feed)
+
+            # If we have pending tasks (eg. resubscribe after Error 317), execute them
+            run_pending_tasks()
 
             # -------------
 
@@ -585,7 +1037,7 @@ try:
             # ----- 
             script_logger.info(
                 f"Number of orderbook ticks in memory at time of failure. "
-                f"# of ticks flushed: {len(buffer_list_of_orderbook_ticks)}")
+                f"# of ticks flushed: {num_buffered_ticks()}")
             # -----
             script_logger.info(
                 f"Duration the script was running for before it failed: "
@@ -600,25 +1052,23 @@ try:
             last_successful_api_connect_time = None 
             
             # If we have ticks to flush
-            if len(buffer_list_of_orderbook_ticks) > 1: 
+            if num_buffered_ticks() > 1: 
                 script_logger.info(
                     f"Initiating emergency flush of the ticks in the buffer due to a failure. "
-                    f"# of ticks flushed: {len(buffer_list_of_orderbook_ticks)}.")
+                    f"# of ticks flushed: {num_buffered_ticks()}.")
                 
-                buffer_copy = buffer_list_of_orderbook_ticks.copy()
-
-                # Clear current buffer
-                buffer_list_of_orderbook_ticks = [] 
+                buffers_to_write, _ = drain_all_tick_buffers()
 
-                threading.Thread(target=dump_buffer_to_file, args=(buffer_copy,)).start()
+                if buffers_to_write:
+                    minute_file_writer.submit(buffers_to_write)
 
             # Reconnect to IB API
             while True:
                 try: 
                     script_logger.info(f"Attempting to reconnect to IB API via ib_connect_loop.")
 
-                    ib_disconnect(contract)
-                    contract = ib_connect()
+                    ib_disconnect()
+                    ib_connect()
 
                     reconnect_time_taken = timeHelpers.td_format(datetime.now() - disconnect_time)
                     script_logger.info(f"Reconnected successfully! "
@@ -635,4 +1085,26 @@ except Exception as e:
 
     script_logger.error(e)
 
-    ib_disconnect(contract)
\ No newline at end of file
+    ib_disconnect()
+
+finally:
+    # Graceful shutdown (eg. SIGTERM from systemd): write the partial minute still in the buffers,
+    # and wait for the writer to finish everything that's queued, so no minute is lost.
+    if minute_file_writer is not None:
+        buffers_to_write, _ = drain_all_tick_buffers()
+        if buffers_to_write:
+            script_logger.info(f"Shutting down. Flushing partial minute. # of ticks flushed: {sum(len(data) for _, data, _ in buffers_to_write)}.")
+            minute_file_writer.submit(buffers_to_write)
+
+        if minute_file_writer.close():
+            script_logger.info(f"Minute file writer closed. Metrics: {minute_file_writer.get_metrics()}")
+        else:
+            script_logger.error(
+                f"Minute file writer closed without writing every batch (spilled batches are written on the next start). "
+                f"Metrics: {minute_file_writer.get_metrics()}")
+
+    # Remove the shared memory rings, so consumers never attach to a stale one
+    for feed in feeds.values():
+        if feed.live_ring is not None:
+            feed.live_ring.close()
+            feed.live_ring = None
\ No newline at end of file
@@ -0,0 +1,454 @@
+"""
+event_publisher.py
+
+Background publisher for the health monitor's Pub/Sub events and GCP Cloud Logging entries.
+
+`publish()`, and `log_text()`/`log_struct()` on the loggers from `cloud_logger()`,
+only append to a bounded in-memory queue and return (a few microseconds), so
+a slow or failing GCP round trip never delays the monitor's next minute check.
+A single worker thread drains the queue:
+
+    - Batching: messages queued within `max_batch_delay` seconds (up to
+      `max_batch_size`) are sent together, grouped by destination. Cloud Logging
+      entries for one logger go out in a single API call.
+    - Retries: a failed send is retried with exponential backoff (with jitter),
+      up to `max_attempts` times. After that, the messages are dropped and
+      `on_failure(message, error)` is called (errors it raises are logged).
+      Retries are per destination: while one destination is backing off, the
+      others keep sending. A transport that sends messages one at a time raises
+      PartialSendError when it fails partway, and only the unsent messages are
+      retried, so no message is delivered twice (a send that made progress
+      restarts the attempt count).
+    - Ordering: every message has an ordering key (by default, its topic), and
+      messages are sent in queue order per destination: new messages for a
+      destination that is being retried wait behind the failed ones, so messages
+      with the same key are never sent out of order. GcpTransport publishes each
+      event with its ordering key (message ordering enabled), so subscriptions
+      with message ordering enabled also receive them in order.
+    - Bounded queue: if `max_queue_size` messages are already waiting (eg. GCP is
+      down), new messages are dropped and counted, instead of growing memory.
+
+The transport does the actual sending: GcpTransport in production, or
+LocalFileTransport (JSON lines files, with optional injected latency/failures)
+to run and test the monitor offline. `get_metrics()` reports queue depth,
+counters, and publish latency percentiles (queued -> acknowledged).
+"""
+
+import collections
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+KIND_PUBSUB = 'pubsub'
+KIND_LOG = 'log'
+
+
+class PartialSendError(Exception):
+    """Raised by a transport's send() when only the first `num_sent` messages were sent, before `error`."""
+
+    def __init__(self, num_sent: int, error: Exception):
+        super().__init__(f"{error} (after {num_sent} message(s) were sent)")
+        self.num_sent = num_sent
+        self.error = error
+
+
+class QueuedMessage:
+    """One Pub/Sub event (kind='pubsub', destination=topic), or Cloud Logging entry (kind='log', destination=logger name)."""
+
+    __slots__ = ('kind', 'destination', 'payload', 'severity', 'ordering_key', 'queued_at')
+
+    def __init__(self, kind, destination, payload, severity=None, ordering_key=None):
+        self.kind = kind
+        self.destination = destination
+        self.payload = payload
+        self.severity = severity
+        self.ordering_key = ordering_key if ordering_key is not None else destination
+        self.queued_at = time.perf_counter()
+
+    def __repr__(self):
+        return f"QueuedMessage({self.kind}, {self.destination}, {self.payload!r})"
+
+
+class GcpTransport:
+    """
+    Sends to GCP: Pub/Sub events (JSON encoded) with their ordering key, and Cloud Logging
+    entries in one batch call per logger.
+
+    Args:
+        logging_client: google.cloud.logging.Client.
+        publisher_client: google.cloud.pubsub_v1.PublisherClient, created with
+                          `publisher_options=pubsub_v1.types.PublisherOptions(enable_message_ordering=True)`.
+        project_id (str): GCP project of the Pub/Sub topics.
+        logger (logging.Logger): Pub/Sub confirmations are logged here.
+        publish_timeout (float): Seconds to wait for each event's message id.
+    """
+
+    def __init__(self, logging_client, publisher_client, project_id: str, logger: logging.Logger = None,
+                 publish_timeout: float = 60.0):
+        self.logging_client = logging_client
+        self.publisher_client = publisher_client
+        self.project_id = project_id
+        self.logger = logger or logging.getLogger(__name__)
+        self.publish_timeout = publish_timeout
+        self._cloud_loggers = {}
+
+    def send(self, kind: str, destination: str, messages: list) -> None:
+        if kind == KIND_PUBSUB:
+            # One event at a time, waiting for its message id, so a failure says exactly which events were sent
+            topic_path = self.publisher_client.topic_path(self.project_id, destination)
+            for num_sent, message in enumerate(messages):
+                try:
+                    message_id = self.publisher_client.publish(
+                        topic_path, json.dumps(message.payload, default=str).encode('utf-8'),
+                        ordering_key=message.ordering_key).result(timeout=self.publish_timeout)
+                except Exception as e:
+                    # The client pauses an ordering key after a failed publish, until it's resumed
+                    self.publisher_client.resume_publish(topic_path, message.ordering_key)
+                    raise PartialSendError(num_sent, e) from e
+                self.logger.info(f"PubSub confirmation: {message_id}")
+            return
+
+        if destination not in self._cloud_loggers:
+            self._cloud_loggers[destination] = self.logging_client.logger(destination)
+
+        with self._cloud_loggers[destination].batch() as batch:
+            for message in messages:
+                if isinstance(message.payload, dict):
+                    batch.log_struct(message.payload, severity=message.severity)
+                else:
+                    batch.log_text(message.payload, severity=message.severity)
+
+
+class LocalFileTransport:
+    """
+    Offline stand-in for GcpTransport: appends every message as a JSON line to
+    `<directory>/<kind>_<destination>.jsonl`.
+
+    Args:
+        directory (str): Output directory (created if needed).
+        latency (float): Seconds each send takes (simulated network round trip).
+        failure_rate (float): Probability of each send raising a ConnectionError (to exercise retries). Pub/Sub
+                              events are sent one at a time like GcpTransport's, so a send can fail partway
+                              (PartialSendError), after writing the events before the failed one.
+    """
+
+    def __init__(self, directory: str, latency: float = 0.0, failure_rate: float = 0.0, seed: int = None):
+        self.directory = directory
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, kind: str, destination: str, messages: list) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+        # Number of messages sent before the simulated failure (Pub/Sub: each event can fail, Cloud Logging: all or none)
+        num_sent = len(messages)
+        if kind == KIND_PUBSUB:
+            num_sent = next((i for i in range(len(messages)) if self._rng.random() < self.failure_rate), len(messages))
+        elif self._rng.random() < self.failure_rate:
+            num_sent = 0
+
+        sent_at = datetime.now(timezone.utc).isoformat()
+        with open(os.path.join(self.directory, f"{kind}_{destination}.jsonl"), 'a') as f:
+            for message in messages[:num_sent]:
+                f.write(json.dumps(dict(
+                    sent_at=sent_at, ordering_key=message.ordering_key, severity=message.severity,
+                    payload=message.payload), default=str) + '\n')
+
+        if num_sent < len(messages):
+            error = ConnectionError(f"Simulated {kind} send failure for {destination}.")
+            raise PartialSendError(num_sent, error) if num_sent else error
+
+
+class _CloudLogger:
+    # Drop-in for a google.cloud.logging Logger's log_text()/log_struct(), that queues the entry instead
+    def __init__(self, publisher, name):
+        self._publisher = publisher
+        self.name = name
+
+    def log_text(self, text, severity=None):
+        self._publisher.enqueue(QueuedMessage(KIND_LOG, self.name, text, severity=severity))
+
+    def log_struct(self, info, severity=None):
+        self._publisher.enqueue(QueuedMessage(KIND_LOG, self.name, info, severity=severity))
+
+
+class _PendingRetry:
+    # A destination's failed messages, waiting for their next attempt, and the messages queued for it since (sent after them)
+    __slots__ = ('messages', 'attempt', 'next_attempt_at', 'waiting')
+
+    def __init__(self, messages, attempt, next_attempt_at):
+        self.messages = messages
+        self.attempt = attempt
+        self.next_attempt_at = next_attempt_at
+        self.waiting = []
+
+
+class BackgroundPublisher:
+    """
+    Bounded queue + worker thread in front of a transport (see module docstring).
+    """
+
+    def __init__(self, transport, max_queue_size: int = 10000, max_batch_size: int = 100,
+                 max_batch_delay: float = 0.01, max_attempts: int = 6, backoff_base: float = 0.1,
+                 backoff_max: float = 10.0, on_failure=None, logger: logging.Logger = None):
+        self.transport = transport
+        self.max_queue_size = max_queue_size
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_failure = on_failure
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._cond = threading.Condition()
+        self._queued = collections.deque()
+        self._num_in_flight = 0
+        # (kind, destination) -> _PendingRetry, for the destinations whose last send failed
+        self._retries = {}
+        self._stopping = False
+
+        # Metrics (see get_metrics())
+        self._publish_latencies = collections.deque(maxlen=4096)
+        self.num_sent = 0
+        self.num_batches_sent = 0
+        self.num_retries = 0
+        self.num_failed = 0
+        self.num_dropped = 0
+
+        self._worker = threading.Thread(target=self._run, name='event-publisher', daemon=True)
+        self._worker.start()
+
+    # ---- Producer side (monitor's main loop) ----
+
+    def publish(self, topic: str, payload: dict, ordering_key: str = None) -> bool:
+        """
+        Queues a Pub/Sub event. Never blocks.
+
+        Returns:
+            bool: False if the queue was full, and the event was dropped.
+        """
+        return self.enqueue(QueuedMessage(KIND_PUBSUB, topic, payload, ordering_key=ordering_key))
+
+    def cloud_logger(self, name: str):
+        """A stand-in for `google.cloud.logging.Client().logger(name)`, whose log_text()/log_struct() are queued."""
+        return _CloudLogger(self, name)
+
+    def enqueue(self, message: QueuedMessage) -> bool:
+        with self._cond:
+            if self._stopping:
+                if threading.current_thread() is self._worker:
+                    # Queued by a callback on the worker (eg. on_failure logging to GCP) while closing: drop it
+                    self.num_dropped += 1
+                    self.logger.warning(f"Event publisher is closing. Dropped: {message}")
+                    return False
+                raise RuntimeError("BackgroundPublisher is closed.")
+
+            if len(self._queued) >= self.max_queue_size:
+                self.num_dropped += 1
+                dropped = True
+            else:
+                self._queued.append(message)
+                self._cond.notify()
+                dropped = False
+
+        if dropped:
+            self.logger.warning(f"Event publisher queue is full ({self.max_queue_size} messages). Dropped: {message}")
+        return not dropped
+
+    # ---- Worker ----
+
+    def _run(self):
+        while True:
+            try:
+                if not self._run_once():
+                    return
+            except Exception as e:
+                # The worker must survive any error, or publish() would only fill the queue from then on
+                self.logger.exception(f"Error in the event publisher worker: {e}.")
+                with self._cond:
+                    self._num_in_flight = 0
+                    self._cond.notify_all()
+
+    def _run_once(self):
+        # Sends the next batch, and the retries that are due. Returns False once stopped with nothing left to send.
+        with self._cond:
+            while not self._queued and not self._due_retries():
+                if self._stopping and not self._retries:
+                    return False
+                next_attempt_at = min((retry.next_attempt_at for retry in self._retries.values()), default=None)
+                self._cond.wait(None if next_attempt_at is None else max(0.0, next_attempt_at - time.perf_counter()))
+
+            batch = []
+            if self._queued:
+                # Give messages queued right after this one a chance to join the batch
+                deadline = time.perf_counter() + self.max_batch_delay
+                while len(self._queued) < self.max_batch_size and not self._stopping:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                batch = [self._queued.popleft() for _ in range(min(self.max_batch_size, len(self._queued)))]
+
+            # Group by destination, keeping queue order within each group (and so within each ordering key).
+            # A destination being retried gets its new messages queued behind the failed ones.
+            groups = {}
+            for message in batch:
+                key = (message.kind, message.destination)
+                if key in self._retries:
+                    self._retries[key].waiting.append(message)
+                else:
+                    groups.setdefault(key, []).append(message)
+
+            self._num_in_flight = sum(len(messages) for messages in groups.values())
+            due_retries = self._due_retries()
+
+        for (kind, destination), messages in groups.items():
+            backoff, unsent, attempt = self._send(kind, destination, messages, attempt=1)
+            with self._cond:
+                self._num_in_flight -= len(messages)
+                if backoff is not None:
+                    self._retries[(kind, destination)] = _PendingRetry(unsent, attempt, time.perf_counter() + backoff)
+
+        for key in due_retries:
+            retry = self._retries[key]
+            backoff, unsent, attempt = self._send(*key, retry.messages, attempt=retry.attempt + 1)
+            with self._cond:
+                if backoff is not None:
+                    retry.messages = unsent
+                    retry.attempt = attempt
+                    retry.next_attempt_at = time.perf_counter() + backoff
+                elif retry.waiting:
+                    # Sent (or given up on): the messages queued behind it go next, as a first attempt
+                    retry.messages, retry.waiting, retry.attempt, retry.next_attempt_at = retry.waiting, [], 0, 0.0
+                else:
+                    del self._retries[key]
+
+        with self._cond:
+            if batch:
+                self.num_batches_sent += 1
+            self._cond.notify_all()
+        return True
+
+    def _due_retries(self):
+        now = time.perf_counter()
+        return [key for key, retry in self._retries.items() if retry.next_attempt_at <= now]
+
+    def _send(self, kind, destination, messages, attempt):
+        # One attempt. Returns the backoff before the next attempt (None if the messages were sent or given up on),
+        # the messages to retry (those after the ones a PartialSendError says were sent), and the attempt's number.
+        try:
+            self.transport.send(kind, destination, messages)
+        except Exception as e:
+            if isinstance(e, PartialSendError) and e.num_sent:
+                # Made progress, so the destination is up: the rest start over as a first attempt
+                self._acknowledge(messages[:e.num_sent])
+                messages = messages[e.num_sent:]
+                attempt = 1
+
+            if attempt >= self.max_attempts:
+                self._give_up(kind, destination, messages, attempt, e)
+                return None, [], attempt
+
+            # Exponential backoff with full jitter
+            backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+            self.num_retries += 1
+            self.logger.warning(
+                f"Error sending {kind} message(s) to {destination} (attempt {attempt}): {e}. "
+                f"Retrying {len(messages)} message(s) in {backoff:.3f} seconds.")
+            return backoff, messages, attempt
+
+        self._acknowledge(messages)
+        return None, [], attempt
+
+    def _acknowledge(self, messages):
+        acknowledged_at = time.perf_counter()
+        for message in messages:
+            self._publish_latencies.append(acknowledged_at - message.queued_at)
+        self.num_sent += len(messages)
+
+    def _give_up(self, kind, destination, messages, attempt, error):
+        self.num_failed += len(messages)
+        self.logger.error(
+            f"Failed to send {len(messages)} {kind} message(s) to {destination} "
+            f"after {attempt} attempts: {error}")
+
+        if self.on_failure is None:
+            return
+        for message in messages:
+            try:
+                self.on_failure(message, error)
+            except Exception as e:
+                self.logger.exception(f"Error in the event publisher's on_failure callback: {e}.")
+
+    # ---- Metrics and shutdown ----
+
+    def _num_pending(self):
+        # Queued, being sent, and waiting for a retry (call with self._cond held)
+        num_retrying = sum(len(retry.messages) + len(retry.waiting) for retry in self._retries.values())
+        return len(self._queued) + self._num_in_flight + num_retrying
+
+    @property
+    def queue_depth(self) -> int:
+        with self._cond:
+            return self._num_pending()
+
+    def get_metrics(self) -> dict:
+        """
+        Publisher metrics, for logging.
+
+        Returns:
+            dict: queue depth, counters, and publish latency (queued -> acknowledged)
+                  percentiles in milliseconds, over the last 4096 messages.
+        """
+        latencies_ms = np.array(self._publish_latencies) * 1000
+
+        with self._cond:
+            metrics = dict(
+                queue_depth=self._num_pending(),
+                num_retrying_destinations=len(self._retries),
+                num_sent=self.num_sent,
+                num_batches_sent=self.num_batches_sent,
+                num_retries=self.num_retries,
+                num_failed=self.num_failed,
+                num_dropped=self.num_dropped,
+            )
+
+        if len(latencies_ms):
+            p50, p90, p99 = np.percentile(latencies_ms, [50, 90, 99])
+            metrics.update(
+                publish_latency_p50_ms=round(float(p50), 3),
+                publish_latency_p90_ms=round(float(p90), 3),
+                publish_latency_p99_ms=round(float(p99), 3),
+                publish_latency_max_ms=round(float(latencies_ms.max()), 3))
+
+        return metrics
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until every queued message has been sent (or given up on). Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._num_pending():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = None) -> bool:
+        """Sends everything still queued, then stops the worker. Returns False if it didn't finish within `timeout`."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+        return not self._worker.is_alive()
@@ -0,0 +1,127 @@
+"""
+file_arrival_watcher.py
+
+Event-driven detection of new data files, for health_monitor.py (FILE_ARRIVAL_DETECTION = 'inotify').
+
+Instead of re-listing a directory every millisecond until the minute's files
+show up, the monitor blocks on a Linux inotify watch of the day directory, and
+re-checks only when a file in it is closed after writing (IN_CLOSE_WRITE) or
+renamed into it (IN_MOVED_TO, as the collector's temp file + rename writes do).
+It wakes up within microseconds of a file arriving, and uses no CPU while waiting.
+
+Uses libc's inotify calls through ctypes (no extra dependency). On other
+platforms, or if inotify can't be set up, open_directory_watcher() returns
+None and the monitor falls back to polling.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+
+# struct inotify_event header: wd, mask, cookie, len (followed by `len` bytes of NUL padded name)
+_EVENT_HEADER = struct.Struct('iIII')
+
+_READ_SIZE = 64 * 1024
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return _libc
+
+
+class DirectoryWatcher:
+    """
+    inotify watch on one directory, for files that are finished being written into it.
+
+    Usage:
+        watcher = DirectoryWatcher('/localDataStoreDisk/orderbook_data/2024-03-04')
+        file_names = watcher.wait(timeout=1.0)  # [] if nothing arrived in time
+        watcher.close()
+    """
+
+    def __init__(self, directory: str, mask: int = IN_CLOSE_WRITE | IN_MOVED_TO):
+        self.directory = directory
+        libc = _load_libc()
+
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}: {os.strerror(errno)}")
+
+        # Set when the kernel's event queue overflowed: some arrivals weren't reported, so the caller should re-check everything
+        self.overflowed = False
+
+    def wait(self, timeout: float = None) -> list:
+        """
+        Blocks until at least one file arrives (or `timeout` seconds pass).
+
+        Returns:
+            list: Names (not paths) of the files that arrived, in order. Empty on timeout.
+                  Temp files (eg. '.EURUSD_...obt.tmp') are included: filter them as needed.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        return self.read_events()
+
+    def read_events(self) -> list:
+        """Names of the files that arrived since the last call, without blocking."""
+        try:
+            data = os.read(self._fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+
+        file_names = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+            elif name_length and not mask & IN_IGNORED:
+                file_names.append(os.fsdecode(data[offset:offset + name_length].rstrip(b'\0')))
+            offset += name_length
+
+        return file_names
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def open_directory_watcher(directory: str, logger=None):
+    """
+    Returns a DirectoryWatcher on `directory`, or None if inotify isn't available (or the directory doesn't exist yet).
+    """
+    if not hasattr(select, 'select') or not os.path.isdir(directory):
+        return None
+    try:
+        return DirectoryWatcher(directory)
+    except (OSError, AttributeError) as e:
+        # AttributeError: libc without inotify (not Linux)
+        if logger is not None:
+            logger.warning(f"inotify unavailable, polling for data files instead: {e}")
+        return None
@@ -0,0 +1,266 @@
+"""
+gap_audit.py
+
+Historical gap audit of the tick archive (`<data_dir>/<YYYY-MM-DD>/`), run with
+`python health_monitor.py AUDIT <start date> <end date> [output directory]`, or
+directly with `python gap_audit.py <data_dir> <instruments file> <start date> <end date> [output directory]`.
+
+Reconciles every minute a data file is expected for (from the session calendar,
+see session_calendar.py) against the files actually in the archive:
+
+    - gaps: expected minutes with no data file for an instrument, merged into
+      runs of consecutive missing minutes (eg. a collector outage is one row).
+    - duplicates: minutes with more than one data file for an instrument.
+    - tick counts: a minute x instrument matrix of tick counts (NaN where missing).
+
+A data file is named with the minute it was flushed at, and holds the ticks of
+the minute before, so a file is expected for minute `m` if the market was open
+during `m - 1` (eg. 17:16 ET for the first session minute, up to 17:00 ET for the last).
+
+Each day directory is listed once (os.scandir) and its file names parsed with
+one precompiled pattern, in a process pool (one task per day). Tick counts come
+from the minute manifests when present (one small read per instrument-minute),
+otherwise from the tick file headers (first 4 KB); legacy '.joblib' files are
+not opened (count is NaN). With `tick_counts=False`, nothing but the directory
+listings is read.
+"""
+
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from session_calendar import INSTRUMENT_CLASS_FOREX, get_session_calendar
+
+# Data files ('<instrument>_orderbook_ticks_<YYYY-MM-DDTHH:MM:SS.ffffff>[_<label>].<obt|joblib>') and
+# manifests ('<instrument>_orderbook_manifest_<YYYY-MM-DDTHH:MM>.json'). Temp files ('.<name>.tmp') don't match.
+ARCHIVE_FILE_PATTERN = re.compile(
+    r'^(?P<instrument>[^_.][^_]*)_orderbook_'
+    r'(?:ticks_(?P<minute>\d{4}-\d\d-\d\dT\d\d:\d\d):\d\d\.\d{6}(?:_[^.]+)?\.(?:obt|joblib)'
+    r'|manifest_(?P<manifest_minute>\d{4}-\d\d-\d\dT\d\d:\d\d)\.json)$')
+
+
+def scan_day_directory(directory: str, instruments: list = None, tick_counts: bool = True) -> dict:
+    """
+    Lists one day directory, and counts data files (and ticks) per instrument and minute.
+
+    Args:
+        directory (str): Eg. '/localDataStoreDisk/orderbook_data/2024-03-04'.
+        instruments (list): Only these instruments (default: all found).
+        tick_counts (bool): Also get each minute's tick count (see module docstring).
+
+    Returns:
+        dict: (instrument, 'YYYY-MM-DDTHH:MM') -> [number of data files, tick count (NaN if unknown)].
+    """
+    wanted = set(instruments) if instruments is not None else None
+    minutes = {}
+    manifests = set()
+    data_files = {}
+
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return minutes
+
+    with entries:
+        for entry in entries:
+            match = ARCHIVE_FILE_PATTERN.match(entry.name)
+            if match is None:
+                continue
+            instrument = match['instrument']
+            if wanted is not None and instrument not in wanted:
+                continue
+
+            if match['manifest_minute'] is not None:
+                manifests.add((instrument, match['manifest_minute']))
+                continue
+
+            key = (instrument, match['minute'])
+            if key in minutes:
+                minutes[key][0] += 1
+            else:
+                minutes[key] = [1, np.nan]
+            data_files.setdefault(key, []).append(entry.name)
+
+    if not tick_counts:
+        return minutes
+
+    from minute_manifest import manifest_file_name
+    from tick_file_format import TICK_FILE_EXTENSION, read_tick_file_header
+
+    for key, file_names in data_files.items():
+        if key in manifests:
+            try:
+                with open(os.path.join(directory, manifest_file_name(*key)), 'rb') as f:
+                    minutes[key][1] = json.loads(f.read())['n_ticks']
+                continue
+            except (OSError, ValueError, KeyError):
+                # Unreadable manifest: fall back to the data files
+                pass
+
+        n_ticks = 0
+        for file_name in file_names:
+            if not file_name.endswith('.' + TICK_FILE_EXTENSION):
+                n_ticks = np.nan
+                break
+            try:
+                header = read_tick_file_header(os.path.join(directory, file_name))
+            except (OSError, ValueError):
+                n_ticks = np.nan
+                break
+            n_ticks += header['meta'].get('n_updates', header['n_ticks'])
+        minutes[key][1] = n_ticks
+
+    return minutes
+
+
+def _scan_day_directory_task(args):
+    return scan_day_directory(*args)
+
+
+def expected_file_minutes(start_date: date, end_date: date, instrument_class: str = INSTRUMENT_CLASS_FOREX) -> pd.DatetimeIndex:
+    """UTC minutes from `start_date` 00:00 through `end_date` 23:59 a data file is expected for (see module docstring)."""
+    minutes = np.arange(
+        np.datetime64(start_date, 'm'), np.datetime64(end_date + timedelta(days=1), 'm'), np.timedelta64(1, 'm'))
+    ticks_minutes = minutes - np.timedelta64(1, 'm')
+
+    # One calendar per year (the calendars cover a week into the next/previous year, so only the year of each minute matters)
+    expected = np.zeros(len(minutes), dtype=bool)
+    years = ticks_minutes.astype('datetime64[Y]').astype(int) + 1970
+    for year in np.unique(years):
+        in_year = years == year
+        calendar = get_session_calendar(instrument_class, int(year))
+        expected[in_year] = ~np.isnan(calendar.minutes_since_open_array(ticks_minutes[in_year]))
+
+    return pd.DatetimeIndex(minutes[expected])
+
+
+def _gap_runs(instrument, missing_positions, expected_minutes):
+    # Consecutive missing minutes (consecutive in the expected sequence, so a run can span a session break) -> one row
+    if len(missing_positions) == 0:
+        return []
+    run_starts = np.flatnonzero(np.diff(missing_positions, prepend=-2) != 1)
+    run_ends = np.append(run_starts[1:], len(missing_positions)) - 1
+    return [
+        dict(instrument=instrument,
+             first_missing_minute=expected_minutes[missing_positions[start]],
+             last_missing_minute=expected_minutes[missing_positions[end]],
+             missing_minutes=int(end - start + 1))
+        for start, end in zip(run_starts, run_ends)]
+
+
+def audit_tick_archive(data_directory: str, instruments: list, start_date: date, end_date: date,
+                       instrument_class: str = INSTRUMENT_CLASS_FOREX, processes: int = None,
+                       tick_counts: bool = True) -> dict:
+    """
+    Audits the archive between two dates (UTC, inclusive), in a process pool.
+
+    Args:
+        data_directory (str): Root of the day directories, eg. '/localDataStoreDisk/orderbook_data'.
+        instruments (list): Instruments to audit, eg. ['EURUSD', 'GBPUSD', 'USDJPY'].
+        start_date (date): First day.
+        end_date (date): Last day.
+        instrument_class (str): Session calendar of the instruments ('forex' or 'crypto').
+        processes (int): Pool size (default: number of CPUs).
+        tick_counts (bool): Build the tick count matrix (see scan_day_directory()).
+
+    Returns:
+        dict:
+            gaps (pd.DataFrame): instrument, first_missing_minute, last_missing_minute, missing_minutes.
+            duplicates (pd.DataFrame): instrument, minute, n_files.
+            unexpected (pd.DataFrame): instrument, minute, n_files, for data files outside the expected minutes.
+            tick_counts (pd.DataFrame): Expected minutes x instruments, NaN where missing (or not counted).
+            summary (dict): Totals per instrument.
+    """
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    tasks = [(os.path.join(data_directory, day.strftime('%Y-%m-%d')), instruments, tick_counts) for day in days]
+
+    found = {}
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for day_minutes in pool.map(_scan_day_directory_task, tasks, chunksize=max(1, len(tasks) // 64)):
+            found.update(day_minutes)
+
+    expected_minutes = expected_file_minutes(start_date, end_date, instrument_class)
+    position_of_minute = {minute: i for i, minute in enumerate(expected_minutes.strftime('%Y-%m-%dT%H:%M'))}
+
+    n_files = np.zeros((len(expected_minutes), len(instruments)), dtype=np.int64)
+    n_ticks = np.full((len(expected_minutes), len(instruments)), np.nan)
+    column_of_instrument = {instrument: j for j, instrument in enumerate(instruments)}
+
+    duplicates, unexpected = [], []
+    for (instrument, minute), (files_in_minute, ticks_in_minute) in found.items():
+        i = position_of_minute.get(minute)
+        if i is None:
+            unexpected.append(dict(instrument=instrument, minute=pd.Timestamp(minute), n_files=files_in_minute))
+            continue
+        j = column_of_instrument[instrument]
+        n_files[i, j] = files_in_minute
+        n_ticks[i, j] = ticks_in_minute
+        if files_in_minute > 1:
+            duplicates.append(dict(instrument=instrument, minute=pd.Timestamp(minute), n_files=files_in_minute))
+
+    gaps = []
+    summary = {}
+    for instrument, j in column_of_instrument.items():
+        missing_positions = np.flatnonzero(n_files[:, j] == 0)
+        gaps.extend(_gap_runs(instrument, missing_positions, expected_minutes))
+        summary[instrument] = dict(
+            expected_minutes=len(expected_minutes),
+            missing_minutes=len(missing_positions),
+            duplicate_minutes=int(np.count_nonzero(n_files[:, j] > 1)),
+            total_ticks=float(np.nansum(n_ticks[:, j])))
+
+    def frame(rows, columns, sort_by):
+        return pd.DataFrame(rows, columns=columns).sort_values(sort_by, ignore_index=True)
+
+    return dict(
+        gaps=frame(gaps, ['instrument', 'first_missing_minute', 'last_missing_minute', 'missing_minutes'],
+                   ['instrument', 'first_missing_minute']),
+        duplicates=frame(duplicates, ['instrument', 'minute', 'n_files'], ['instrument', 'minute']),
+        unexpected=frame(unexpected, ['instrument', 'minute', 'n_files'], ['instrument', 'minute']),
+        tick_counts=pd.DataFrame(n_ticks, index=expected_minutes.rename('minute'), columns=instruments),
+        summary=summary)
+
+
+def write_gap_audit_report(report: dict, output_directory: str) -> list:
+    """Writes the report as CSV files (tick counts gzipped) plus summary.json, and returns their paths."""
+    os.makedirs(output_directory, exist_ok=True)
+    paths = []
+    for name in ('gaps', 'duplicates', 'unexpected'):
+        paths.append(os.path.join(output_directory, f"{name}.csv"))
+        report[name].to_csv(paths[-1], index=False)
+
+    paths.append(os.path.join(output_directory, 'tick_counts.csv.gz'))
+    report['tick_counts'].to_csv(paths[-1])
+
+    paths.append(os.path.join(output_directory, 'summary.json'))
+    with open(paths[-1], 'w') as f:
+        json.dump(report['summary'], f, indent=2)
+
+    return paths
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    if len(sys.argv) not in (5, 6):
+        print("Usage: python gap_audit.py <data directory> <instruments file> <start YYYY-MM-DD> <end YYYY-MM-DD> [output directory]")
+        sys.exit(1)
+
+    with open(sys.argv[2]) as f:
+        instruments_to_audit = [line.strip() for line in f if line.strip()]
+
+    started = time.perf_counter()
+    audit_report = audit_tick_archive(
+        sys.argv[1], instruments_to_audit, date.fromisoformat(sys.argv[3]), date.fromisoformat(sys.argv[4]))
+    print(f"Audited {sys.argv[3]} - {sys.argv[4]} in {time.perf_counter() - started:.1f} seconds.")
+    print(json.dumps(audit_report['summary'], indent=2))
+    print(audit_report['gaps'].to_string(max_rows=50))
+
+    if len(sys.argv) == 6:
+        print(f"Report written to: {write_gap_audit_report(audit_report, sys.argv[5])}")
@@ -1,10 +1,19 @@
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from google.cloud import logging as gcp_logging
+from google.cloud import pubsub_v1
 from joblib import load
 
 from libHelpers import getConfig
-from libHelpers import mktHours
-from libHelpers import pubSub
+
+from tick_file_format import TICK_FILE_EXTENSION, read_tick_file_header
+from minute_manifest import MANIFEST_MINUTE_FORMAT, read_minute_manifest
+from file_arrival_watcher import open_directory_watcher
+from event_publisher import BackgroundPublisher, GcpTransport, LocalFileTransport, KIND_PUBSUB
+from session_calendar import get_session_calendar
+from gap_audit import audit_tick_archive, write_gap_audit_report
+from volume_anomaly import VolumeAnomalyDetector, ticks_minute_of_file_minute
+from metrics_store import MetricsStore
+from tick_integrity import integrity_errors, merge_integrity_counters, validate_tick_file
 
 import os
 import sys
@@ -58,6 +67,40 @@ default_config = config.defaults()
 DATA_DIR_ORDERBOOK = config.get(default_config['env'], 'data_dir')
 INSTRUMENTS_FILE = config.get(default_config['env'], 'base_path') + "/config/instrumentsToMonitor.txt"
 
+# Check each instrument's minute via the manifest the collector writes once the data file is on disk (see minute_manifest.py):
+# one small read per instrument, and the tick counts come from the manifest, so no data file is opened.
+# Set to False for collectors that don't write manifests (WRITE_MINUTE_MANIFESTS = False): lists the day directory instead.
+USE_MINUTE_MANIFESTS = True
+
+# How the monitor waits for a minute's files that aren't there yet:
+# - 'inotify': block on an inotify watch of the day directory, and re-check only when a file is written/renamed into it
+#   (see file_arrival_watcher.py). Falls back to polling if inotify is unavailable, or the day directory doesn't exist yet.
+# - 'polling': re-check every CHECK_FILES_SLEEP_INTERVAL (1 ms).
+FILE_ARRIVAL_DETECTION = 'inotify'
+
+# Where Pub/Sub events and GCP log entries go. Either way they're sent by a background thread (see event_publisher.py),
+# batched and retried, so a slow GCP round trip never delays the next minute's check.
+# - 'gcp': GCP Pub/Sub + Cloud Logging.
+# - 'local': JSON lines files in EVENT_PUBLISHER_LOCAL_DIRECTORY, for running the monitor offline.
+EVENT_PUBLISHER_TRANSPORT = 'gcp'
+EVENT_PUBLISHER_LOCAL_DIRECTORY = "/localDataStoreDisk/logs/orderbook_python/published_events"
+
+# Market hours of the monitored instruments, from the precomputed session calendar (see session_calendar.py):
+# 'forex' (Sun 17:15 ET - Fri 17:00 ET, daily break 17:00 - 17:15 ET) or 'crypto' (24/7). DST is handled by the calendar.
+MONITORED_INSTRUMENT_CLASS = 'forex'
+
+# Compare each minute's tick counts with a rolling baseline per instrument and minute of the session (see volume_anomaly.py),
+# and alert on stalls (eg. USDJPY not coming back after the 5 PM ET pause) and tick floods.
+# The baseline is saved to VOLUME_ANOMALY_STATE_FILE every minute, so a restart picks up where it left off.
+VOLUME_ANOMALY_DETECTION = True
+VOLUME_ANOMALY_STATE_FILE = "/localDataStoreDisk/logs/orderbook_python/volume_baseline.npz"
+
+# Also keep every minute's tick counts, file arrival lag and integrity counters in a local time-series store
+# (see metrics_store.py), one file per metric and day, eg. tick_count.EURUSD/2024-03-04.mts.
+# Read them back with MetricsStore(METRICS_STORE_DIRECTORY).query('tick_count.EURUSD', start, end).
+WRITE_METRICS_STORE = True
+METRICS_STORE_DIRECTORY = "/localDataStoreDisk/monitor_metrics"
+
 def setup_logging():
     # --------------------------------------------------------------------
     # --------------------------------------------------------------------
@@ -112,12 +155,23 @@ def setup_logging():
 # Configure python logging
 logger = setup_logging()
 
-# Configure GCP logging
-gcp_client = gcp_logging.Client()
-gcp_cloud_logger_health_check = gcp_client.logger("echelon_datafeed_orderbook_health_check")
-gcp_cloud_logger_volume_monitor = gcp_client.logger("echelon_datafeed_orderbook_volume_monitor")
-gcp_cloud_logger_market_status = gcp_client.logger("echelon_market_status")
-gcp_cloud_logger_generic = gcp_client.logger("echelon_generic")
+# Configure GCP logging + Pub/Sub, through the background publisher (log_text()/log_struct() only queue the entry)
+if EVENT_PUBLISHER_TRANSPORT == 'local':
+    event_publisher_transport = LocalFileTransport(EVENT_PUBLISHER_LOCAL_DIRECTORY)
+else:
+    gcp_client = gcp_logging.Client()
+    # Message ordering on, so each event's ordering key (its topic, see broadcast_event_via_pubSub_with_error_handling())
+    # is honoured: subscriptions with message ordering enabled get the events of a topic in order
+    pubsub_publisher_client = pubsub_v1.PublisherClient(
+        publisher_options=pubsub_v1.types.PublisherOptions(enable_message_ordering=True))
+    event_publisher_transport = GcpTransport(gcp_client, pubsub_publisher_client, gcp_client.project, logger=logger)
+
+event_publisher = BackgroundPublisher(event_publisher_transport, logger=logger)
+
+gcp_cloud_logger_health_check = event_publisher.cloud_logger("echelon_datafeed_orderbook_health_check")
+gcp_cloud_logger_volume_monitor = event_publisher.cloud_logger("echelon_datafeed_orderbook_volume_monitor")
+gcp_cloud_logger_market_status = event_publisher.cloud_logger("echelon_market_status")
+gcp_cloud_logger_generic = event_publisher.cloud_logger("echelon_generic")
 
 def read_instruments(file_path):
     with open(file_path, "r") as f:
@@ -131,6 +185,26 @@ def check_if_data_files_exist(instruments, minute_dt):
 
     successfully_created_files = []
 
+    # Manifest per instrument, with its volume statistics (empty when USE_MINUTE_MANIFESTS is False)
+    manifests = {}
+
+    if USE_MINUTE_MANIFESTS:
+        minute = minute_dt.strftime(MANIFEST_MINUTE_FORMAT)
+        date_directory = os.path.join(DATA_DIR_ORDERBOOK, minute_dt.strftime('%Y-%m-%d'))
+
+        for instrument in instruments:
+            manifest = read_minute_manifest(date_directory, instrument, minute)
+
+            if manifest is None:
+                missing_files.append(f"{instrument}_orderbook_ticks_{minute}")
+                continue
+
+            for file_entry in manifest['files']:
+                successfully_created_files.append(os.path.join(date_directory, file_entry['file']))
+            manifests[instrument] = manifest
+
+        return missing_files, successfully_created_files, manifests
+
     # iterate through each instrument
     for instrument in instruments:
 
@@ -138,14 +212,15 @@ def check_if_data_files_exist(instruments, minute_dt):
         timestamp = minute_dt.strftime('%Y-%m-%dT%H:%M')
 
         # Create a pattern to match the file names
-        pattern = f"{instrument}_orderbook_ticks_{timestamp}:\\d{{2}}\\.\\d{{6}}\\.joblib"
+        # (the collector writes either '.obt' tick files, or legacy '.joblib' files, see OUTPUT_FILE_FORMAT in data_collector.py)
+        pattern = f"{instrument}_orderbook_ticks_{timestamp}:\\d{{2}}\\.\\d{{6}}\\.(joblib|{TICK_FILE_EXTENSION})$"
 
         # Construct the date part of the path
         date_path = minute_dt.strftime('%Y-%m-%d')
 
         # Get the list of all files in the directory, for the given date
         current_files = glob.glob(os.path.join(
-                DATA_DIR_ORDERBOOK, date_path, f"{instrument}_orderbook_ticks_*.joblib"))
+                DATA_DIR_ORDERBOOK, date_path, f"{instrument}_orderbook_ticks_*"))
 
         # Filter the list of files to *ONLY* include those that match the pattern
         matching_files = [file for file in current_files if re.search(pattern, file)]
@@ -159,42 +234,130 @@ def check_if_data_files_exist(instruments, minute_dt):
             missing_files.append(f"{instrument}_orderbook_ticks_{minute_dt.strftime('%Y-%m-%dT%H:%M')}")
 
     # Return the lists of file
-    return missing_files, successfully_created_files
+    return missing_files, successfully_created_files, manifests
+
+def measure_arrival_lags(file_paths, minute_dt):
+    # Milliseconds between the minute boundary the files were flushed at (the minute in their names), and the files
+    # landing on disk (their modification time: they're renamed into place right after being written).
+    minute_boundary_ns = int(minute_dt.timestamp()) * 1_000_000_000
+    arrival_lags_ms = {}
+    for file_path in file_paths:
+        try:
+            arrival_lags_ms[os.path.basename(file_path)] = round((os.stat(file_path).st_mtime_ns - minute_boundary_ns) / 1e6, 3)
+        except FileNotFoundError:
+            pass
+    return arrival_lags_ms
+
+def count_ticks_in_data_file(file_name):
+    # Tick files store the tick count in their header, so only the first 4 KB of the file is read.
+    # Legacy joblib files have to be fully unpickled.
+    if file_name.endswith('.' + TICK_FILE_EXTENSION):
+        header = read_tick_file_header(file_name)
+        # Depth delta files hold change events, so count the book updates instead (same meaning as for the other modes)
+        return header['meta'].get('n_updates', header['n_ticks'])
+
+    return len(load(file_name))
+
+def collect_integrity_counters(file_paths, manifests):
+    # Data integrity counters per instrument (see tick_integrity.py): from the manifests when the collector validated
+    # its files (VALIDATE_MINUTE_FILES), otherwise by validating the data files here (vectorized, a few ms per file).
+    integrity = {}
+    files_per_instrument = {}
+    for file_path in file_paths:
+        instrument = os.path.basename(file_path).split('_orderbook_ticks')[0]
+        files_per_instrument.setdefault(instrument, []).append(file_path)
+
+    for instrument, instrument_files in files_per_instrument.items():
+        if 'integrity' in manifests.get(instrument, {}):
+            integrity[instrument] = manifests[instrument]['integrity']
+            continue
+        try:
+            integrity[instrument] = merge_integrity_counters(validate_tick_file(file_path) for file_path in instrument_files)
+        except Exception as e:
+            logger.exception(f"Error validating data files for {instrument}: {e}")
+
+    return integrity
+
+def minute_metrics(tick_counts, arrival_lags_ms, integrity_counters):
+    # Metric name -> value, for the metrics store (eg. 'tick_count.EURUSD', 'arrival_lag_ms.EURUSD', 'integrity.crossed_books.EURUSD')
+    metrics = {f"tick_count.{instrument}": n_ticks for instrument, n_ticks in tick_counts.items()}
+
+    # The latest of the instrument's files, if there's more than one
+    for file_name, arrival_lag_ms in arrival_lags_ms.items():
+        key = f"arrival_lag_ms.{file_name.split('_orderbook_ticks')[0]}"
+        metrics[key] = max(metrics.get(key, arrival_lag_ms), arrival_lag_ms)
+
+    for instrument, counters in integrity_counters.items():
+        for check, count in counters.items():
+            if check != 'n_ticks':
+                metrics[f"integrity.{check}.{instrument}"] = count
+
+    return metrics
+
+def check_tick_volume_anomalies(MODE, volume_anomaly_detector, file_minute_dt, tick_counts):
+    # Tick counts are of the minute BEFORE the minute in the data file names (eg. 22:16 files hold the ticks of 22:15)
+    alerts = volume_anomaly_detector.update(ticks_minute_of_file_minute(file_minute_dt), tick_counts)
+
+    for alert in alerts:
+        logger.warning(f"Tick volume anomaly: {alert}")
+        if MODE == 'PROD':
+            gcp_cloud_logger_volume_monitor.log_struct(severity="WARNING", info=alert)
 
-def broadcast_event_via_pubSub_with_error_handling(MODE, pubsub_topic_name, event_payload):
     try:
-        response = pubSub.broadcast_event(
-            pubsub_topic_name=pubsub_topic_name,
-            event_payload=event_payload
-        )
-        
-        # Log PubSub confirmation to local server log.
-        logger.info(f"PubSub confirmation: {response}")
-
-    except Exception as e: # PubSub broadcast error
-        # Log PubSub error to local server log.
-        logger.error(
-            f"PubSub broadcast error:\n"
-            f"Error occured in file: main_datafeed_monitor.py\n"
-            f"Full error: {str(e)}"
-        )
-        # Log PubSub error to GCP.
-        if MODE == 'PROD':
-            gcp_cloud_logger_health_check.log_text(
-                severity="ERROR",
-                text=(
-                    f"PubSub broadcast error:\n"
-                    f"Error occured in file: main_datafeed_monitor.py\n"
-                    f"Full error: {str(e)}"
-                )
-            )
-        # end exception
+        volume_anomaly_detector.save()
+    except OSError as e:
+        logger.error(f"Error saving the tick volume baseline to {VOLUME_ANOMALY_STATE_FILE}: {e}")
+
+    return alerts
+
+def broadcast_event_via_pubSub_with_error_handling(MODE, pubsub_topic_name, event_payload):
+    # Only queues the event: it's sent (and retried) by the background publisher.
+    # Events to the same topic are delivered in order (the topic is their ordering key).
+    # If it still fails after all retries, report_publish_failure() is called.
+    event_publisher.publish(
+        topic=pubsub_topic_name,
+        payload=event_payload
+    )
+
     return True
 
+def report_publish_failure(MODE, message, error):
+    # Called on the publisher's thread, once a message has failed all its retries
+    if message.kind != KIND_PUBSUB:
+        # A GCP log entry: the error is already in the local log (and logging it to GCP would likely fail too)
+        return
+
+    # Log PubSub error to local server log.
+    logger.error(
+        f"PubSub broadcast error:\n"
+        f"Error occured in file: main_datafeed_monitor.py\n"
+        f"Topic: {message.destination}, payload: {message.payload}\n"
+        f"Full error: {str(error)}"
+    )
+    # Log PubSub error to GCP.
+    if MODE == 'PROD':
+        gcp_cloud_logger_health_check.log_text(
+            severity="ERROR",
+            text=(
+                f"PubSub broadcast error:\n"
+                f"Error occured in file: main_datafeed_monitor.py\n"
+                f"Full error: {str(error)}"
+            )
+        )
+
 def main(MODE):
     
     instruments_to_monitor = read_instruments(INSTRUMENTS_FILE)
 
+    event_publisher.on_failure = lambda message, error: report_publish_failure(MODE, message, error)
+
+    metrics_store = MetricsStore(METRICS_STORE_DIRECTORY) if WRITE_METRICS_STORE else None
+
+    volume_anomaly_detector = None
+    if VOLUME_ANOMALY_DETECTION:
+        volume_anomaly_detector = VolumeAnomalyDetector(
+            instruments_to_monitor, instrument_class=MONITORED_INSTRUMENT_CLASS, state_path=VOLUME_ANOMALY_STATE_FILE)
+
     while True:
 
         now = datetime.utcnow().replace(tzinfo=pytz.UTC) # Eg. 5:15 PM
@@ -225,13 +388,18 @@ def main(MODE):
 
         time.sleep(seconds_till_next_check)
 
+        # Publish latency percentiles, retries and drops of the background publisher (over the last few thousand messages)
+        logger.info(f"Event publisher metrics: {event_publisher.get_metrics()}")
+
         # --------------------------------------------------------------------
         # --------------------------------------------------------------------
         # -------- REMINDER: ALL CODE BELOW - WILL BE DELAYED - BY CODE ABOVE
         # --------------------------------------------------------------------
         # --------------------------------------------------------------------
 
-        if mktHours.is_trading_minute(current_minute) is False:
+        session_calendar = get_session_calendar(MONITORED_INSTRUMENT_CLASS, current_minute.year)
+
+        if session_calendar.is_trading_minute(current_minute) is False:
 
             logger.info(f"Market isn't open, at {current_minute}, skipping check for data files.")
 
@@ -265,50 +433,24 @@ def main(MODE):
 
             # ----------------------------------------------------------
 
-            # Check if is the FIRST minute of the forex session (eg. 5:15 PM ET).
+            # Check if is the FIRST minute of the session (eg. 5:15 PM ET for forex: 21:15 UTC during DST, 22:15 UTC otherwise).
             # If yes, skip check for data files.
+            # The session calendar knows each instrument class's open times (none for crypto, which trades continuously).
 
-            # Forex
-
-            if mktHours.is_dst(now) is True: 
-                # DST ACTIVE, UTC + 4
-                # -----
-                # When Daylight Saving Time (DST) is active, Eastern Time (ET) is 4 hours behind Coordinated Universal Time (UTC). So, 5 PM ET in UTC 24-hour time would be 21:00 (9 PM) UTC.
-                hour_to_skip = 21
-            else:
-                # NOT DST, UTC + 5
-                # -----
-                # When Daylight Saving Time (DST) is not active, Eastern Standard Time (EST) is 5 hours behind Coordinated Universal Time (UTC). Therefore, 5 PM ET in UTC 24-hour time would be 22:00 (10 PM) UTC.
-                hour_to_skip = 22
-
-            if now.hour == hour_to_skip and now.minute == 15:
-
-                # This is a temporary fix, to stop getting errors/alerts at this time. 
-                # But this WILL have to be changed during DST, to 21:15, vs 22.15 (DST/non-DST)
-
-                # This is a ugly fix too (hardcoding like this).
-                # This *WILL* break the datafeed with other instruments (non-forex), that have different market hours (different open/closing times).
+            if session_calendar.is_first_session_minute(current_minute):
 
-                logger.info('Skipping data check for first minute of forex trading session.')
+                logger.info(f'Skipping data check for first minute of {MONITORED_INSTRUMENT_CLASS} trading session.')
 
                 # Note: This log statement shows up *LATE* in the `datafeed_monitor.log`, like this:
-                # `2024-02-29 22:16:00,059 [INFO] Skipping last minute of forex trading session.``
+                # `2024-02-29 22:16:00,059 [INFO] Skipping first minute of forex trading session.``
 
                 # It shows up a minute late. 
-                # Even though we are using `if now.hour == 22 and now.minute == 15:`
-
                 # Because by the time logic execution resumes,
-                # The `now` variable is out of sync with the current time (real now),
+                # `current_minute` is out of sync with the current time (real now),
                 # Due to the .sleep() usage, above.
 
                 continue # SKIP EXECUTION OF ALL CODE BELOW
 
-            # -----
-            # If you add more instruments to monitor in the future beyond forex,
-            # It would be wise to just have a check if it's the first minute of trading hours,
-            # For that instrument, and then just skip the check.
-            # -----
-
         # ----------
 
         DEBUG = True
@@ -324,25 +466,30 @@ def main(MODE):
          # Wait 1 second before triggering an error (if data files not yet created)
         ERROR_WAIT_TIME = 1 
 
+        # Watch the day directory BEFORE the first check, so a file landing in between is never missed
+        arrival_watcher = None
+        if FILE_ARRIVAL_DETECTION == 'inotify':
+            arrival_watcher = open_directory_watcher(
+                os.path.join(DATA_DIR_ORDERBOOK, current_minute.strftime('%Y-%m-%d')), logger=logger)
+
         # Keep checking for files, until the max wait time 
         while time_elapsed < ERROR_WAIT_TIME:
 
-            missing_instrument_files, success_instrument_files = check_if_data_files_exist(
+            missing_instrument_files, success_instrument_files, manifests = check_if_data_files_exist(
                 instruments_to_monitor, 
                 current_minute
             )
 
             # If NO files are missing, print a "success" message, and exit the loop
             if not missing_instrument_files:
-                
-                log_success_message_for_new_minute_data = True
-                if log_success_message_for_new_minute_data:
-                    logger.info(f"Success: All files present for {current_minute}")
-                    # Log success msg to GCP log
-                    if MODE == 'PROD':
-                        gcp_cloud_logger_health_check.log_text(
-                            f"Success: All files present for: {current_minute}", severity="INFO")
-                    
+
+                # Integrity counters go in the Pub/Sub event, so consumers can skip a bad minute
+                integrity_counters = {}
+                validate_data_files = True
+                if validate_data_files:
+                    integrity_counters = collect_integrity_counters(success_instrument_files, manifests)
+
+                # Notify downstream consumers (eg. ML inference) FIRST: logging and volume statistics can wait.
                 pubsub_broadcast_new_minute_data = True
                 if pubsub_broadcast_new_minute_data: 
 
@@ -353,10 +500,22 @@ def main(MODE):
                         event_payload=dict(
                             name='Successfully created data files for minute.',
                             minute=current_minute.isoformat(),
-                            files=success_instrument_files
+                            files=success_instrument_files,
+                            integrity=integrity_counters
                         )
                     )
 
+                arrival_lags_ms = {}
+                log_success_message_for_new_minute_data = True
+                if log_success_message_for_new_minute_data:
+                    logger.info(f"Success: All files present for {current_minute}")
+                    arrival_lags_ms = measure_arrival_lags(success_instrument_files, current_minute)
+                    logger.info(f"File arrival lag (ms after the minute boundary): {arrival_lags_ms}")
+                    # Log success msg to GCP log
+                    if MODE == 'PROD':
+                        gcp_cloud_logger_health_check.log_text(
+                            f"Success: All files present for: {current_minute}", severity="INFO")
+                    
                 data_integrity_checks = True
                 if data_integrity_checks:
                     if len(success_instrument_files) > len(instruments_to_monitor):
@@ -366,18 +525,40 @@ def main(MODE):
                             severity="ERROR",
                             text=(
                                 f"Got MORE data files, then the number of instruments we are monitoring. Occured during: {current_minute}. Error occured in main_datafeed_monitor.py. See bug report link in comments."))
+
+                    failed_integrity_checks = {
+                        instrument: integrity_errors(counters)
+                        for instrument, counters in integrity_counters.items() if integrity_errors(counters)}
+                    if failed_integrity_checks:
+                        logger.warning(f"Data integrity checks failed for {current_minute}: {failed_integrity_checks}")
+                        if MODE == 'PROD':
+                            gcp_cloud_logger_health_check.log_struct(
+                                severity="WARNING",
+                                info=dict(
+                                    name='Data integrity checks failed for minute.',
+                                    minute=current_minute.isoformat(),
+                                    failed_checks=failed_integrity_checks))
                         
                 generate_volume_summary_statistics = True
                 if generate_volume_summary_statistics:
                     # Measure the ticks per minute, for volume monitoring.
                     tick_volume_summary = {}
 
+                    # Level 1 spread and mid price range per instrument (only from manifests)
+                    price_summary = {}
+
                     for file_name in success_instrument_files:
 
                         instrument_name = file_name.split('_orderbook_ticks')[0].split('/')[-1]
-                        instrument_file_contents = load(file_name)
 
-                        num_of_ticks_for_instrument = len(instrument_file_contents)
+                        if instrument_name in manifests:
+                            # Already summarized by the collector (all of the instrument's files for the minute), no data file is read
+                            manifest = manifests[instrument_name]
+                            num_of_ticks_for_instrument = manifest['n_ticks']
+                            price_summary[instrument_name] = {
+                                key: manifest.get(key) for key in ('spread_mean', 'spread_min', 'spread_max', 'mid_low', 'mid_high')}
+                        else:
+                            num_of_ticks_for_instrument = count_ticks_in_data_file(file_name)
 
                         tick_volume_summary[instrument_name] = num_of_ticks_for_instrument
 
@@ -385,17 +566,37 @@ def main(MODE):
 
                     # Log the tick summary, for the minute, to the datafeed_monitor.log file 
                     logger.info(tick_volume_summary)
+                    if price_summary:
+                        logger.info(price_summary)
 
                     # Log the tick summary for the minute minute to GCP.
                     if MODE == 'PROD':
                         gcp_cloud_logger_volume_monitor.log_struct(
                             severity="INFO",
                             info=tick_volume_summary)
+                        if price_summary:
+                            gcp_cloud_logger_volume_monitor.log_struct(
+                                severity="INFO",
+                                info=dict(minute=current_minute.isoformat(), price_summary=price_summary))
+
+                    if volume_anomaly_detector is not None:
+                        check_tick_volume_anomalies(MODE, volume_anomaly_detector, current_minute, tick_volume_summary)
+
+                    if metrics_store is not None:
+                        try:
+                            metrics_store.append_many(
+                                current_minute, minute_metrics(tick_volume_summary, arrival_lags_ms, integrity_counters))
+                        except OSError as e:
+                            logger.error(f"Error writing metrics to {METRICS_STORE_DIRECTORY}: {e}")
 
                 break # Done - stop while loop for checking for files, for this minute.
 
             # If files NOT found yet, WAIT and try again.
-            time.sleep(CHECK_FILES_SLEEP_INTERVAL)
+            if arrival_watcher is not None:
+                # Sleeps until a file is written/renamed into the day directory, or the wait time is up
+                arrival_watcher.wait(timeout=max(ERROR_WAIT_TIME - time_elapsed, 0))
+            else:
+                time.sleep(CHECK_FILES_SLEEP_INTERVAL)
             
             time_elapsed = (datetime.now(timezone.utc) - next_time_to_check).total_seconds()
 
@@ -405,6 +606,9 @@ def main(MODE):
                     message="sleeping... (files NOT found yet, WAIT and try again.)"
                 ))
 
+        if arrival_watcher is not None:
+            arrival_watcher.close()
+
         # After waiting for max wait time, if there  ARE* missing files, trigger an error.
         if missing_instrument_files:
 
@@ -442,10 +646,57 @@ def main(MODE):
                 )
             )
 
+            if metrics_store is not None:
+                try:
+                    metrics_store.append_many(current_minute, {
+                        f"missing_data_file.{missing_file.split('_orderbook_ticks')[0]}": 1 for missing_file in missing_instrument_files})
+                except OSError as e:
+                    logger.error(f"Error writing metrics to {METRICS_STORE_DIRECTORY}: {e}")
+
+            # A missing data file is a minute without ticks: the instrument's volume anomaly shows how long it's been stalled
+            if volume_anomaly_detector is not None:
+                check_tick_volume_anomalies(MODE, volume_anomaly_detector, current_minute, {
+                    missing_file.split('_orderbook_ticks')[0]: 0 for missing_file in missing_instrument_files})
+
+def run_gap_audit(start_date, end_date, output_directory=None):
+    # Reconcile every expected minute between the two dates (inclusive) against the data files in the archive,
+    # listing the day directories in parallel (a year takes about a minute).
+    instruments_to_audit = read_instruments(INSTRUMENTS_FILE)
+
+    started = time.perf_counter()
+    report = audit_tick_archive(
+        DATA_DIR_ORDERBOOK, instruments_to_audit, start_date, end_date, instrument_class=MONITORED_INSTRUMENT_CLASS)
+
+    logger.info(f"Gap audit of {start_date} - {end_date} done in {time.perf_counter() - started:.1f} seconds: {report['summary']}")
+    for gap in report['gaps'].itertuples():
+        logger.warning(
+            f"Gap audit: {gap.instrument} missing {gap.missing_minutes} minute(s), "
+            f"from {gap.first_missing_minute} to {gap.last_missing_minute}")
+    for duplicate in report['duplicates'].itertuples():
+        logger.warning(f"Gap audit: {duplicate.instrument} has {duplicate.n_files} data files for {duplicate.minute}")
+
+    print(json.dumps(report['summary'], indent=2))
+    print(report['gaps'].to_string(max_rows=50))
+
+    if output_directory is not None:
+        print(f"Report written to: {write_gap_audit_report(report, output_directory)}")
+
+    return report
+
 if __name__ == "__main__":
 
-    if len(sys.argv) != 2:
+    if len(sys.argv) >= 4 and sys.argv[1] == 'AUDIT':
+        # Batch mode: audit a date range of the tick archive for gaps and duplicates, instead of monitoring (see gap_audit.py)
+        # Eg. 'python main_datafeed_monitor.py AUDIT 2024-01-01 2024-12-31 /localDataStoreDisk/logs/orderbook_python/gap_audit'
+        run_gap_audit(
+            start_date=date.fromisoformat(sys.argv[2]),
+            end_date=date.fromisoformat(sys.argv[3]),
+            output_directory=sys.argv[4] if len(sys.argv) > 4 else None)
+        event_publisher.close(timeout=10)
+
+    elif len(sys.argv) != 2:
         print("Usage: python main_datafeed_orderbook_monitor.py <mode (DEBUG or PROD)>")
+        print("       python main_datafeed_orderbook_monitor.py AUDIT <start date YYYY-MM-DD> <end date YYYY-MM-DD> [report directory]")
         sys.exit(1)
 
     else:
@@ -466,4 +717,8 @@ if __name__ == "__main__":
             raise Exception('Wrong mode! Must either be DEBUG or PROD')
         
         # Run main script
-        main(IS_DEBUG_MODE)
+        try:
+            main(IS_DEBUG_MODE)
+        finally:
+            # Send whatever is still queued (eg. the last minute's events) before exiting
+            event_publisher.close(timeout=10)
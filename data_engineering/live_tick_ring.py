@@ -0,0 +1,248 @@
+"""
+live_tick_ring.py
+
+Low-latency, same-machine fan-out of live order book updates (LIVE_FANOUT = True).
+
+The collector publishes every depth update into a shared memory ring of the
+latest `capacity` books per instrument (`/dev/shm/orderbook_live_<instrument>`),
+so local consumers (eg. the prediction service) can see each update within
+microseconds, instead of waiting for the minute flush, the health monitor and
+a Pub/Sub hop. Any number of reader processes can attach; the writer never
+waits for them.
+
+Layout:
+
+    [ 64 byte header: magic, num_levels, capacity, write_count ][ slot 0 ][ slot 1 ] ...
+
+    slot = [ seq (uint64) ][ timestamp ][ bid_price_1, bid_size_1, ... ask_size_10 ]
+
+The part of a slot after `seq` has the same layout as a tick file row (see
+orderbook_buffer.make_tick_dtype), so readers get the usual columns.
+
+Each slot is a seqlock: the writer sets `seq` to an odd value, writes the
+book, then sets `seq` to `2 * (n + 1)` for the n-th published book (0-based),
+and finally bumps `write_count`. A reader copies a slot and re-checks `seq`,
+so a book being overwritten while it was read is detected and skipped. This
+relies on stores becoming visible in program order, as on x86-64.
+"""
+
+import mmap
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from orderbook_buffer import DEFAULT_NUM_LEVELS, make_tick_dtype
+
+LIVE_RING_NAME_PREFIX = 'orderbook_live_'
+
+LIVE_RING_MAGIC = b'OBLIVE01'
+
+# Where POSIX shared memory segments show up on Linux
+SHARED_MEMORY_DIRECTORY = '/dev/shm'
+
+# Books kept per instrument. ~1.4 MB of shared memory with 10 levels.
+DEFAULT_LIVE_RING_CAPACITY = 4096
+
+_HEADER_SIZE = 64
+
+# Header fields, as uint64 slots (after the 8 byte magic)
+_HEADER_NUM_LEVELS = 1
+_HEADER_CAPACITY = 2
+_HEADER_WRITE_COUNT = 3
+
+
+def live_ring_name(instrument: str) -> str:
+    return f"{LIVE_RING_NAME_PREFIX}{instrument}"
+
+
+def _slot_stride(num_levels):
+    # In 8 byte units: seq + timestamp + 4 values per level
+    return 2 + 4 * num_levels
+
+
+class LiveTickRingWriter:
+    """
+    Single writer side of the ring, owned by the collector.
+
+    Creates (or replaces a stale) shared memory segment on init, and removes it on `close()`.
+    """
+
+    def __init__(self, instrument: str, num_levels: int = DEFAULT_NUM_LEVELS,
+                 capacity: int = DEFAULT_LIVE_RING_CAPACITY):
+        self.name = live_ring_name(instrument)
+        self.num_levels = num_levels
+        self.capacity = capacity
+
+        self._slot_stride = _slot_stride(num_levels)
+        self._ask_offset = 2 + 2 * num_levels
+
+        size = _HEADER_SIZE + capacity * self._slot_stride * 8
+        try:
+            self._shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a collector that was killed
+            stale = shared_memory.SharedMemory(name=self.name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+
+        self._shm.buf[:_HEADER_SIZE] = bytes(_HEADER_SIZE)
+        self._shm.buf[:len(LIVE_RING_MAGIC)] = LIVE_RING_MAGIC
+
+        # Memoryviews (in 8 byte units) used for fast scalar writes
+        self._header = self._shm.buf[:_HEADER_SIZE].cast('Q')
+        self._seqs = self._shm.buf[_HEADER_SIZE:size].cast('Q')
+        self._timestamps = self._shm.buf[_HEADER_SIZE:size].cast('q')
+        self._values = self._shm.buf[_HEADER_SIZE:size].cast('d')
+
+        self._header[_HEADER_NUM_LEVELS] = num_levels
+        self._header[_HEADER_CAPACITY] = capacity
+        self._write_count = 0
+
+    def publish(self, timestamp_us: int, bids, asks) -> None:
+        """
+        Publishes one order book update (same arguments as OrderbookTickBuffer.record()).
+        """
+        n = self._write_count
+        slot_start = (n % self.capacity) * self._slot_stride
+        values = self._values
+
+        # Mark the slot as being written
+        self._seqs[slot_start] = 2 * n + 1
+
+        pos = slot_start + 2
+        num_bids = len(bids)
+        for i in range(self.num_levels):
+            if i < num_bids:
+                level = bids[i]
+                values[pos] = level.price
+                values[pos + 1] = level.size
+            else:
+                values[pos] = 0.0
+                values[pos + 1] = 0.0
+            pos += 2
+
+        pos = slot_start + self._ask_offset
+        num_asks = len(asks)
+        for i in range(self.num_levels):
+            if i < num_asks:
+                level = asks[i]
+                values[pos] = level.price
+                values[pos + 1] = level.size
+            else:
+                values[pos] = 0.0
+                values[pos + 1] = 0.0
+            pos += 2
+
+        self._timestamps[slot_start + 1] = timestamp_us
+
+        # Mark the slot as holding the n-th book, then make it visible to readers
+        self._seqs[slot_start] = 2 * n + 2
+        self._write_count = n + 1
+        self._header[_HEADER_WRITE_COUNT] = n + 1
+
+    def close(self) -> None:
+        # Every view on the segment has to be dropped, before it can be closed
+        for view in (self._header, self._seqs, self._timestamps, self._values):
+            view.release()
+        self._shm.close()
+        self._shm.unlink()
+
+
+class LiveTickRingReader:
+    """
+    Reader side of the ring, for consumer processes. Never blocks the writer.
+
+    The segment is mapped read-only, straight from SHARED_MEMORY_DIRECTORY (not through
+    multiprocessing's SharedMemory, whose resource tracker would unlink it when the
+    reader exits). If the collector restarts, it creates a new segment: re-attach.
+
+    Usage:
+        reader = LiveTickRingReader('EURUSD')
+        next_seq = reader.write_count  # only books published from now on
+        while True:
+            ticks, next_seq, num_missed = reader.wait_for_ticks(next_seq)
+    """
+
+    def __init__(self, instrument: str):
+        self.name = live_ring_name(instrument)
+
+        with open(os.path.join(SHARED_MEMORY_DIRECTORY, self.name), 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(LIVE_RING_MAGIC)] != LIVE_RING_MAGIC:
+            self._mmap.close()
+            raise ValueError(f"Not a live tick ring: {self.name}")
+
+        self._header = np.frombuffer(self._mmap, dtype=np.uint64, count=_HEADER_SIZE // 8)
+        self.num_levels = int(self._header[_HEADER_NUM_LEVELS])
+        self.capacity = int(self._header[_HEADER_CAPACITY])
+        self.dtype = make_tick_dtype(self.num_levels)
+
+        stride = _slot_stride(self.num_levels)
+        self._slots = np.frombuffer(
+            self._mmap, dtype=np.float64, count=self.capacity * stride, offset=_HEADER_SIZE).reshape(self.capacity, stride)
+        self._seqs = self._slots.view(np.uint64)[:, 0]
+
+    @property
+    def write_count(self) -> int:
+        """Number of books published so far (the sequence number of the next one)."""
+        return int(self._header[_HEADER_WRITE_COUNT])
+
+    def read_since(self, next_seq: int):
+        """
+        Copies the books published since `next_seq`.
+
+        Args:
+            next_seq (int): Sequence number of the first book wanted (eg. from the previous call).
+
+        Returns:
+            tuple: (ticks, next_seq, num_missed).
+                   ticks: structured array of the books (see orderbook_buffer.make_tick_dtype).
+                   next_seq: the value to pass to the next call.
+                   num_missed: books that were overwritten before they could be read (reader too slow).
+        """
+        write_count = self.write_count
+        first_seq = max(next_seq, write_count - self.capacity)
+        num_missed = first_seq - next_seq
+
+        seqs = np.arange(first_seq, write_count, dtype=np.uint64)
+        slot_indices = (seqs % self.capacity).astype(np.intp)
+        expected = 2 * seqs + 2
+
+        # Seqlock read: seq, then the data, then seq again
+        seq_before = self._seqs[slot_indices]
+        rows = self._slots[slot_indices]
+        seq_after = self._seqs[slot_indices]
+
+        complete = (seq_before == expected) & (seq_after == expected)
+        if not complete.all():
+            # The writer lapped us while copying
+            num_missed += int((~complete).sum())
+            rows = rows[complete]
+
+        ticks = np.ascontiguousarray(rows[:, 1:]).view(self.dtype).reshape(len(rows))
+        return ticks, write_count, num_missed
+
+    def latest(self):
+        """The most recently published book (1 row), or an empty array if nothing was published yet."""
+        write_count = self.write_count
+        ticks, _, _ = self.read_since(max(write_count - 1, 0))
+        return ticks[-1:]
+
+    def wait_for_ticks(self, next_seq: int, timeout: float = None, poll_interval: float = 0.0001):
+        """
+        Like read_since(), but polls until at least one new book is published (or `timeout` seconds pass).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.write_count <= next_seq:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(poll_interval)
+        return self.read_since(next_seq)
+
+    def close(self) -> None:
+        self._header = self._slots = self._seqs = None
+        self._mmap.close()
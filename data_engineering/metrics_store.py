@@ -0,0 +1,160 @@
+"""
+metrics_store.py
+
+Embedded local time-series store for the health monitor's metrics (tick counts,
+file arrival lag, integrity counters), so a month of them can be read back in
+milliseconds, instead of scraping datafeed_monitor.log or GCP Cloud Logging.
+
+One append-only file per metric and UTC day, holding only that metric's
+points, as fixed-width little-endian records (int64 epoch microseconds, float64 value):
+
+    <root>/tick_count.EURUSD/2024-03-04.mts
+    <root>/arrival_lag_ms.EURUSD/2024-03-04.mts
+    <root>/integrity.crossed_books.EURUSD/2024-03-04.mts
+
+Appends are a single write() to a file opened with O_APPEND (16 bytes per
+point), so readers never need a lock. A query reads each day file in the range
+with one np.fromfile call, and returns NumPy arrays (a month of minutes: ~3 ms). If a write was cut short (eg. the
+monitor was killed mid-write), the partial trailing record is ignored.
+
+Usage:
+    store = MetricsStore('/localDataStoreDisk/monitor_metrics')
+    store.append_many(minute_dt, {'tick_count.EURUSD': 5012, 'arrival_lag_ms.EURUSD': 14.2})
+
+    timestamps, values = store.query('tick_count.EURUSD', start, end)  # datetime64[us], float64
+"""
+
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+METRICS_FILE_EXTENSION = 'mts'
+
+METRIC_RECORD_DTYPE = np.dtype([('timestamp', '<i8'), ('value', '<f8')])
+
+# Metric names are also directory names, eg. 'tick_count.EURUSD'
+METRIC_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.\-]+$')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _to_epoch_us(timestamp) -> int:
+    if isinstance(timestamp, np.datetime64):
+        return int(timestamp.astype('datetime64[us]').astype(np.int64))
+    if timestamp.tzinfo is None:
+        # Naive datetimes are UTC (as from datetime.utcnow())
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (timestamp - _EPOCH) // timedelta(microseconds=1)
+
+
+def _day_of_epoch_us(epoch_us: int) -> str:
+    return (_EPOCH + timedelta(microseconds=epoch_us)).strftime('%Y-%m-%d')
+
+
+class MetricsStore:
+    """
+    Append-only, per-metric, per-day time-series files under `root_directory` (see module docstring).
+    """
+
+    def __init__(self, root_directory: str):
+        self.root_directory = root_directory
+        # (metric, day) -> open file descriptor, for the day currently being appended to
+        self._fds = {}
+        os.makedirs(root_directory, exist_ok=True)
+
+    def _metric_file_path(self, metric: str, day: str) -> str:
+        return os.path.join(self.root_directory, metric, f"{day}.{METRICS_FILE_EXTENSION}")
+
+    # ---- Writing ----
+
+    def append(self, metric: str, timestamp, value: float) -> None:
+        """Appends one point. `timestamp`: datetime (naive = UTC) or np.datetime64."""
+        self.append_many(timestamp, {metric: value})
+
+    def append_many(self, timestamp, values: dict) -> None:
+        """Appends one point per metric, all at the same `timestamp` (eg. everything the monitor measured for a minute)."""
+        epoch_us = _to_epoch_us(timestamp)
+        day = _day_of_epoch_us(epoch_us)
+
+        for metric, value in values.items():
+            fd = self._fds.get((metric, day))
+            if fd is None:
+                fd = self._open_for_append(metric, day)
+
+            record = np.array([(epoch_us, np.nan if value is None else value)], dtype=METRIC_RECORD_DTYPE)
+            os.write(fd, record.tobytes())
+
+    def _open_for_append(self, metric, day):
+        if not METRIC_NAME_PATTERN.match(metric):
+            raise ValueError(f"Invalid metric name: {metric!r}. Only letters, digits, '_', '.' and '-' are allowed.")
+
+        # A new day: the previous days' files are complete, so close them
+        for key in [key for key in self._fds if key[1] != day]:
+            os.close(self._fds.pop(key))
+
+        file_path = self._metric_file_path(metric, day)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        fd = os.open(file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        # Drop a partial record left by an interrupted write, so the records stay aligned
+        size = os.fstat(fd).st_size
+        if size % METRIC_RECORD_DTYPE.itemsize:
+            os.truncate(file_path, size - size % METRIC_RECORD_DTYPE.itemsize)
+
+        self._fds[(metric, day)] = fd
+        return fd
+
+    def close(self) -> None:
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+    # ---- Reading ----
+
+    def metrics(self) -> list:
+        """Names of all the metrics in the store."""
+        return sorted(entry.name for entry in os.scandir(self.root_directory) if entry.is_dir())
+
+    def query(self, metric: str, start, end) -> tuple:
+        """
+        Points of a metric with start <= timestamp < end.
+
+        Args:
+            metric (str): Eg. 'tick_count.EURUSD'.
+            start, end: datetime (naive = UTC) or np.datetime64.
+
+        Returns:
+            tuple: (timestamps, values): datetime64[us] and float64 arrays, in time order.
+        """
+        start_us, end_us = _to_epoch_us(start), _to_epoch_us(end)
+
+        chunks = []
+        day = (_EPOCH + timedelta(microseconds=start_us)).date()
+        last_day = (_EPOCH + timedelta(microseconds=end_us)).date()
+        while day <= last_day:
+            file_path = self._metric_file_path(metric, day.strftime('%Y-%m-%d'))
+            try:
+                # Only whole records (a write may be in progress)
+                count = os.path.getsize(file_path) // METRIC_RECORD_DTYPE.itemsize
+                chunks.append(np.fromfile(file_path, dtype=METRIC_RECORD_DTYPE, count=count))
+            except FileNotFoundError:
+                pass
+            day += timedelta(days=1)
+
+        records = np.concatenate(chunks) if chunks else np.empty(0, dtype=METRIC_RECORD_DTYPE)
+
+        timestamps = records['timestamp']
+        if len(timestamps) > 1 and (np.diff(timestamps) < 0).any():
+            # Appended out of order (eg. the clock was set back): sort, so the range lookup below works
+            records = records[np.argsort(timestamps, kind='stable')]
+            timestamps = records['timestamp']
+
+        first, last = np.searchsorted(timestamps, [start_us, end_us])
+        records = records[first:last]
+        return records['timestamp'].astype('datetime64[us]'), records['value'].copy()
+
+    def query_many(self, metrics: list, start, end) -> dict:
+        """query() for several metrics: metric -> (timestamps, values)."""
+        return {metric: self.query(metric, start, end) for metric in metrics}
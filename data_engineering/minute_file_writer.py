@@ -0,0 +1,348 @@
+"""
+minute_file_writer.py
+
+Persistent writer thread(s) for the data collector's one-minute data files.
+
+Replaces starting a new `threading.Thread(target=dump_buffer_to_file)` every
+minute. The main loop submits each minute's batch of buffers to a bounded
+queue, and a fixed number of long-lived worker threads write them to disk.
+
+If the disk is slow and the queue is full, new batches are spilled to disk
+(a raw pickle in `spill_directory`, written by a spill thread, so `submit()`
+never waits on the disk) instead of piling up in memory, and picked up again
+by the workers once the queue has drained. Spill files are written to a
+temporary name and renamed when complete, so a crash mid-spill never leaves
+a truncated one. Spill files left behind by a crash are picked up on the
+next start; one that can't be read is renamed to `*.spill.corrupt` and skipped.
+
+A batch whose write fails is persisted to a spill file (if it isn't one
+already), to be written on the next start. Journal batches are already on
+disk, and are recovered on the next start by the collector.
+
+`close()` waits until every queued and spilled batch has been written, and
+fails if any is left.
+
+Batches carry the time they were drained at (in each buffer's capture meta),
+so a batch written late still gets the file names of its own minute.
+"""
+
+import collections
+import glob
+import logging
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+
+from tick_journal import TickJournal
+
+SPILL_FILE_EXTENSION = 'spill'
+
+# Suffix of spill files that couldn't be read, moved out of the way so they aren't picked up again
+CORRUPT_SPILL_FILE_SUFFIX = '.corrupt'
+
+# Suffix of spill files being written (renamed to the final name once complete)
+TEMPORARY_SPILL_FILE_SUFFIX = '.tmp'
+
+
+class _SpilledBatch:
+    # A batch waiting behind the queue: in memory (`batch`) until the spill thread has written it to `path`.
+    # A worker may take it while it's still in memory (`taken`), then the spill file is no longer needed.
+    __slots__ = ('submitted_at', 'batch', 'path', 'spilling', 'taken')
+
+    def __init__(self, submitted_at, batch=None, path=None):
+        self.submitted_at = submitted_at
+        self.batch = batch
+        self.path = path
+        self.spilling = False
+        self.taken = False
+
+
+class MinuteFileWriter:
+    """
+    Bounded-queue writer for batches of minute buffers.
+
+    A batch is a list of (instrument, data, capture meta) tuples, as returned by the
+    collector's drain_all_tick_buffers(). `write_batch(batch)` is called on a
+    worker thread for every submitted batch, in submission order (with one worker).
+    """
+
+    def __init__(self, write_batch, max_queue_size: int = 4, num_workers: int = 1,
+                 spill_directory: str = None, logger: logging.Logger = None):
+        self._write_batch = write_batch
+        self.max_queue_size = max_queue_size
+        self.spill_directory = spill_directory
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._cond = threading.Condition()
+        self._queued = collections.deque()   # (submitted_at, batch)
+        self._spilled = collections.deque()  # _SpilledBatch
+        self._num_in_flight = 0
+        self._stopping = False
+
+        # Metrics (see get_metrics())
+        self._flush_latencies = collections.deque(maxlen=1024)
+        self._write_durations = collections.deque(maxlen=1024)
+        self.num_batches_written = 0
+        self.num_batches_spilled = 0
+        self.num_write_errors = 0
+        self.num_corrupt_spill_files = 0
+        # Batches that were neither written nor persisted for the next start
+        self.num_batches_lost = 0
+
+        if spill_directory is not None:
+            os.makedirs(spill_directory, exist_ok=True)
+            for spill_file_path in glob.glob(os.path.join(spill_directory, f"*.{SPILL_FILE_EXTENSION}{TEMPORARY_SPILL_FILE_SUFFIX}")):
+                # Interrupted mid-spill by a crash: incomplete, and the batch was never anywhere else
+                self.logger.error(f"Removing incomplete spill file from a previous run: {spill_file_path}")
+                os.remove(spill_file_path)
+            for spill_file_path in sorted(glob.glob(os.path.join(spill_directory, f"*.{SPILL_FILE_EXTENSION}"))):
+                self.logger.info(f"Found spilled batch from a previous run, queueing it for writing: {spill_file_path}")
+                self._spilled.append(_SpilledBatch(time.perf_counter(), path=spill_file_path))
+
+        self._workers = [
+            threading.Thread(target=self._run, name=f"minute-file-writer-{i}", daemon=True)
+            for i in range(num_workers)]
+        if spill_directory is not None:
+            self._workers.append(threading.Thread(target=self._run_spiller, name="minute-file-spiller", daemon=True))
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of batches not yet written (queued, spilled and in flight)."""
+        with self._cond:
+            return len(self._queued) + len(self._spilled) + self._num_in_flight
+
+    def submit(self, batch: list) -> None:
+        """
+        Queues a batch for writing. Never blocks on disk I/O.
+
+        If the queue is full, the batch is spilled to disk instead (by the spill
+        thread). Once anything has been spilled, later batches are spilled too
+        until the backlog clears, so batches are still written in submission order.
+        """
+        submitted_at = time.perf_counter()
+
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("MinuteFileWriter is closed.")
+
+            if len(self._queued) < self.max_queue_size and not self._spilled:
+                self._queued.append((submitted_at, batch))
+            else:
+                self._spilled.append(_SpilledBatch(submitted_at, batch=batch))
+                self.num_batches_spilled += 1
+
+            self._cond.notify_all()
+
+    def _can_spill(self, batch):
+        # Journals are already on disk (and can't be pickled), so only the small journal objects are kept in memory
+        return self.spill_directory is not None and not any(isinstance(data, TickJournal) for _, data, _ in batch)
+
+    def _write_spill_file(self, batch):
+        spill_file_path = os.path.join(
+            self.spill_directory, f"{time.time_ns()}_{threading.get_ident()}.{SPILL_FILE_EXTENSION}")
+        temporary_path = spill_file_path + TEMPORARY_SPILL_FILE_SUFFIX
+
+        try:
+            with open(temporary_path, 'wb') as f:
+                pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, spill_file_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+        return spill_file_path
+
+    def _next_batch_to_spill(self):
+        # The first spilled batch still only in memory (called with self._cond held)
+        for spilled in self._spilled:
+            if spilled.batch is not None and spilled.path is None and not spilled.spilling and self._can_spill(spilled.batch):
+                return spilled
+        return None
+
+    def _run_spiller(self):
+        while True:
+            with self._cond:
+                while not self._stopping and self._next_batch_to_spill() is None:
+                    self._cond.wait()
+                if self._stopping:
+                    # The workers write whatever is still in memory
+                    return
+
+                spilled = self._next_batch_to_spill()
+                spilled.spilling = True
+
+            try:
+                spill_file_path = self._write_spill_file(spilled.batch)
+            except Exception as e:
+                # Stays in memory (and is written from there)
+                self.logger.exception(f"Error spilling minute batch to disk: {e}.")
+                continue
+
+            with self._cond:
+                if not spilled.taken:
+                    spilled.path = spill_file_path
+                    spilled.batch = None
+                    self.logger.warning(
+                        f"Minute file writer queue is full ({self.max_queue_size} batches). "
+                        f"Spilled batch to disk: {spill_file_path}")
+                    continue
+
+            # A worker took the batch from memory while it was being spilled
+            os.remove(spill_file_path)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queued and not self._spilled and not self._stopping:
+                    self._cond.wait()
+
+                if self._queued:
+                    submitted_at, batch = self._queued.popleft()
+                    spill_file_path = None
+                elif self._spilled:
+                    spilled = self._spilled.popleft()
+                    spilled.taken = True
+                    submitted_at, batch, spill_file_path = spilled.submitted_at, spilled.batch, spilled.path
+                else:
+                    # Stopping, and nothing left to write
+                    return
+
+                self._num_in_flight += 1
+
+            try:
+                self._write(submitted_at, batch, spill_file_path)
+            except Exception as e:
+                # Keep the worker alive, whatever happened to this batch
+                self.num_batches_lost += 1
+                self.logger.exception(f"Unexpected error in the minute file writer: {e}.")
+            finally:
+                with self._cond:
+                    self._num_in_flight -= 1
+                    self._cond.notify_all()
+
+    def _load_spill_file(self, spill_file_path):
+        try:
+            with open(spill_file_path, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            self.num_corrupt_spill_files += 1
+            self.num_batches_lost += 1
+            corrupt_file_path = spill_file_path + CORRUPT_SPILL_FILE_SUFFIX
+            self.logger.error(f"Can't read spill file {spill_file_path} ({e!r}), moved it to: {corrupt_file_path}")
+            os.replace(spill_file_path, corrupt_file_path)
+            return None
+
+    def _write(self, submitted_at, batch, spill_file_path=None):
+        if spill_file_path is not None:
+            batch = self._load_spill_file(spill_file_path)
+            if batch is None:
+                return
+
+        write_started_at = time.perf_counter()
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            self.num_write_errors += 1
+            self.logger.exception(f"Error writing minute files: {e}.")
+            self._persist_failed_batch(batch, spill_file_path)
+            return
+
+        finished_at = time.perf_counter()
+        self._write_durations.append(finished_at - write_started_at)
+        self._flush_latencies.append(finished_at - submitted_at)
+        self.num_batches_written += 1
+
+        if spill_file_path is not None:
+            os.remove(spill_file_path)
+
+    def _persist_failed_batch(self, batch, spill_file_path):
+        # Keeps a batch whose write failed on disk, to be written on the next start
+        if spill_file_path is not None:
+            self.logger.error(f"Kept spill file, to be written on the next start: {spill_file_path}")
+            return
+
+        if any(isinstance(data, TickJournal) for _, data, _ in batch):
+            self.logger.error("Kept the batch's tick journals, to be recovered on the next start.")
+            return
+
+        if self.spill_directory is None:
+            self.num_batches_lost += 1
+            self.logger.error("No spill directory, the batch is lost.")
+            return
+
+        try:
+            spill_file_path = self._write_spill_file(batch)
+        except Exception as e:
+            self.num_batches_lost += 1
+            self.logger.exception(f"Error spilling the batch to disk, the batch is lost: {e}.")
+            return
+        self.logger.error(f"Spilled batch to disk, to be written on the next start: {spill_file_path}")
+
+    def get_metrics(self) -> dict:
+        """
+        Writer metrics, for logging.
+
+        Returns:
+            dict: queue depth, batch counters, and flush latency (submit -> on disk)
+                  and write duration percentiles in milliseconds, over the last 1024 batches.
+        """
+        flush_latencies_ms = np.array(self._flush_latencies) * 1000
+        write_durations_ms = np.array(self._write_durations) * 1000
+
+        def percentiles(values, prefix):
+            if len(values) == 0:
+                return {}
+            p50, p99 = np.percentile(values, [50, 99])
+            return {
+                f"{prefix}_p50_ms": round(float(p50), 3),
+                f"{prefix}_p99_ms": round(float(p99), 3),
+                f"{prefix}_max_ms": round(float(values.max()), 3),
+            }
+
+        with self._cond:
+            metrics = dict(
+                queue_depth=len(self._queued) + len(self._spilled) + self._num_in_flight,
+                num_queued=len(self._queued),
+                num_spilled_pending=len(self._spilled),
+                num_in_flight=self._num_in_flight,
+                num_batches_written=self.num_batches_written,
+                num_batches_spilled=self.num_batches_spilled,
+                num_write_errors=self.num_write_errors,
+                num_corrupt_spill_files=self.num_corrupt_spill_files,
+                num_batches_lost=self.num_batches_lost,
+            )
+
+        metrics.update(percentiles(flush_latencies_ms, 'flush_latency'))
+        metrics.update(percentiles(write_durations_ms, 'write_duration'))
+        return metrics
+
+    def close(self, timeout: float = None) -> bool:
+        """
+        Stops accepting batches, and waits for every queued/spilled batch to be written.
+
+        Returns:
+            bool: True if all workers finished within the timeout, with nothing left to write, and
+                  every batch was either written or persisted for the next start (see `num_batches_lost`).
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+        with self._cond:
+            num_left = len(self._queued) + len(self._spilled) + self._num_in_flight
+
+        if num_left:
+            self.logger.error(f"Minute file writer closed with {num_left} batches not written.")
+        return not any(worker.is_alive() for worker in self._workers) and num_left == 0 and self.num_batches_lost == 0
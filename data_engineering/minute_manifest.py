@@ -0,0 +1,194 @@
+"""
+minute_manifest.py
+
+Small per-minute, per-instrument JSON manifests, written by the collector next
+to its data files (WRITE_MINUTE_MANIFESTS = True), and read by health_monitor.py.
+
+A manifest is written only once its data file is fully on disk, under a
+temporary name that is then renamed into place, so its existence alone means
+the minute's data is complete. It holds what the monitor needs (tick count,
+first/last tick time, level 1 spread and mid price range, size, checksum), so
+the monitor checks each instrument and builds its volume summary with a single
+small read, instead of listing the whole day directory and opening (or
+unpickling) the data files.
+
+    <date directory>/EURUSD_orderbook_manifest_2024-03-04T22:16.json
+
+    {"instrument": "EURUSD", "minute": "2024-03-04T22:16", "n_ticks": 1234,
+     "first_timestamp": "...", "last_timestamp": "...", "spread_mean": 0.00001, "spread_min": ...,
+     "spread_max": ..., "mid_low": 1.08512, "mid_high": 1.08544, "bytes": 182345,
+     "integrity": {"n_ticks": 1234, "crossed_books": 0, ...},
+     "files": [{"file": "EURUSD_orderbook_ticks_2024-03-04T22:16:00.010191.obt", "n_ticks": 1234, ...}]}
+
+`minute` is the minute the data file was written in (same as in its file
+name). If more than one data file is written for an instrument in the same
+minute (eg. a restart), each is listed in `files`, and the totals add up.
+`integrity` holds the data integrity counters (see tick_integrity.py), when
+the collector validates its files.
+"""
+
+import json
+import os
+import zlib
+
+import numpy as np
+
+from orderbook_buffer import DEFAULT_NUM_LEVELS
+from tick_integrity import merge_integrity_counters
+
+MANIFEST_FILE_EXTENSION = 'json'
+
+# Format of the `minute` field (and file name part), eg. '2024-03-04T22:16'
+MANIFEST_MINUTE_FORMAT = '%Y-%m-%dT%H:%M'
+
+_CHECKSUM_CHUNK_SIZE = 1 << 20
+
+
+def manifest_file_name(instrument: str, minute: str) -> str:
+    return f"{instrument}_orderbook_manifest_{minute}.{MANIFEST_FILE_EXTENSION}"
+
+
+def file_checksum(file_path: str) -> str:
+    """CRC-32 of a file's bytes, eg. 'crc32:1a2b3c4d'."""
+    crc = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(_CHECKSUM_CHUNK_SIZE)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return f"crc32:{crc:08x}"
+
+
+# Columns summarize_ticks() needs from a tick file
+SUMMARY_COLUMNS = ['timestamp', 'bid_price_1', 'ask_price_1']
+
+_PRICE_STATISTICS = ('spread_mean', 'spread_min', 'spread_max', 'mid_low', 'mid_high')
+
+
+def summarize_ticks(ticks, num_levels: int = DEFAULT_NUM_LEVELS) -> dict:
+    """
+    Volume statistics of a minute's data: tick count, first/last tick time, and level 1 spread and mid price range.
+
+    Args:
+        ticks: Structured tick array (see orderbook_buffer.make_tick_dtype), depth change
+               events (see orderbook_deltas.DEPTH_EVENT_DTYPE, counted per book update),
+               a dict of columns (eg. SUMMARY_COLUMNS from tick_file_format.read_tick_file()), or a legacy list of tick dicts.
+        num_levels (int): Book depth of depth change events.
+
+    Returns:
+        dict: n_ticks, first_timestamp, last_timestamp (ISO strings), spread_mean, spread_min, spread_max,
+              mid_low, mid_high. Everything but n_ticks is None if there are no ticks (prices: no two-sided books).
+    """
+    if isinstance(ticks, list):
+        ticks = {name: np.array([tick[name] for tick in ticks]) for name in SUMMARY_COLUMNS}
+        ticks['timestamp'] = ticks['timestamp'].astype('datetime64[us]')
+
+    names = ticks.keys() if isinstance(ticks, dict) else ticks.dtype.names
+
+    timestamps = np.asarray(ticks['timestamp'])
+    if 'update_end' in names:
+        # Depth delta files: one book update per event with update_end set
+        from orderbook_deltas import top_of_book
+
+        timestamps = timestamps[np.asarray(ticks['update_end']) != 0]
+        bid_prices, ask_prices = top_of_book(ticks, num_levels)
+    else:
+        bid_prices, ask_prices = np.asarray(ticks['bid_price_1']), np.asarray(ticks['ask_price_1'])
+
+    summary = dict(n_ticks=len(timestamps), first_timestamp=None, last_timestamp=None)
+    summary.update(dict.fromkeys(_PRICE_STATISTICS))
+
+    if len(timestamps) == 0:
+        return summary
+
+    first_timestamp, last_timestamp = np.datetime_as_string(
+        timestamps[[0, -1]].astype('datetime64[us]'), unit='us')
+    summary.update(first_timestamp=str(first_timestamp), last_timestamp=str(last_timestamp))
+
+    # Only books with both sides (empty levels are 0)
+    two_sided = (bid_prices > 0) & (ask_prices > 0)
+    if two_sided.any():
+        spreads = ask_prices[two_sided] - bid_prices[two_sided]
+        mids = (ask_prices[two_sided] + bid_prices[two_sided]) / 2
+        summary.update(
+            spread_mean=float(spreads.mean()), spread_min=float(spreads.min()), spread_max=float(spreads.max()),
+            mid_low=float(mids.min()), mid_high=float(mids.max()))
+
+    return summary
+
+
+def read_minute_manifest(directory: str, instrument: str, minute: str) -> dict:
+    """
+    Returns an instrument's manifest for `minute` (eg. '2024-03-04T22:16'), or None if it doesn't exist (yet).
+    """
+    try:
+        with open(os.path.join(directory, manifest_file_name(instrument, minute)), 'rb') as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def write_minute_manifest(data_file_path: str, instrument: str, minute: str, tick_summary: dict,
+                          integrity: dict = None) -> str:
+    """
+    Writes (or extends) the manifest for a data file that is fully written, in the data file's directory.
+
+    Args:
+        data_file_path (str): The minute's data file (already renamed into place).
+        instrument (str): Eg. 'EURUSD'.
+        minute (str): Minute the data file was written in, formatted with MANIFEST_MINUTE_FORMAT.
+        tick_summary (dict): The data file's summarize_ticks().
+        integrity (dict): The data file's tick_integrity.validate_ticks() counters, if validated.
+
+    Returns:
+        str: The manifest's path.
+    """
+    directory, data_file_name = os.path.split(data_file_path)
+
+    file_entry = dict(
+        file=data_file_name,
+        **tick_summary,
+        bytes=os.path.getsize(data_file_path),
+        checksum=file_checksum(data_file_path))
+    if integrity is not None:
+        file_entry['integrity'] = integrity
+
+    # Only the collector writing this instrument touches its manifests, so read-modify-write is safe
+    existing = read_minute_manifest(directory, instrument, minute)
+    files = (existing['files'] if existing is not None else []) + [file_entry]
+
+    def values(key):
+        return [f[key] for f in files if f.get(key) is not None]
+
+    # Mean spread over all files, weighted by tick count
+    priced_files = [f for f in files if f.get('spread_mean') is not None]
+    priced_ticks = sum(f['n_ticks'] for f in priced_files)
+
+    manifest = dict(
+        instrument=instrument,
+        minute=minute,
+        n_ticks=sum(f['n_ticks'] for f in files),
+        first_timestamp=min(values('first_timestamp'), default=None),
+        last_timestamp=max(values('last_timestamp'), default=None),
+        spread_mean=sum(f['spread_mean'] * f['n_ticks'] for f in priced_files) / priced_ticks if priced_ticks else None,
+        spread_min=min(values('spread_min'), default=None),
+        spread_max=max(values('spread_max'), default=None),
+        mid_low=min(values('mid_low'), default=None),
+        mid_high=max(values('mid_high'), default=None),
+        bytes=sum(f['bytes'] for f in files),
+        files=files)
+
+    validated_files = [f['integrity'] for f in files if 'integrity' in f]
+    if validated_files:
+        manifest['integrity'] = merge_integrity_counters(validated_files)
+
+    manifest_path = os.path.join(directory, manifest_file_name(instrument, minute))
+    temp_manifest_path = os.path.join(directory, f".{manifest_file_name(instrument, minute)}.tmp")
+
+    with open(temp_manifest_path, 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+
+    os.replace(temp_manifest_path, manifest_path)
+
+    return manifest_path
@@ -0,0 +1,201 @@
+"""
+orderbook_buffer.py
+
+Preallocated NumPy tick buffer used by the data collector's capture path.
+
+Every depth update from ib_insync is written straight into a row of a
+preallocated structured array (timestamp + bid/ask price and size for each
+level), instead of building a DataFrame and a dict per tick. The field names
+match the legacy list-of-dicts layout ('timestamp', 'bid_price_1',
+'bid_size_1', ..., 'ask_size_10'), so `pd.DataFrame(buffer.drain())` gives the
+same columns the notebooks and feature engineering functions already expect.
+"""
+
+import time
+
+import numpy as np
+
+# Default number of order book levels requested from IB (see ib_connect()).
+DEFAULT_NUM_LEVELS = 10
+
+# Rows preallocated per minute. A busy minute for EURUSD is ~5-8k updates,
+# news bursts can go higher, in which case the buffer grows (doubles).
+DEFAULT_TICKS_PER_MINUTE = 16384
+
+
+def make_tick_dtype(num_levels: int = DEFAULT_NUM_LEVELS) -> np.dtype:
+    """
+    Builds the structured dtype for a single order book tick.
+
+    All fields are 8 bytes wide, so a row can also be addressed as a flat run
+    of float64 values (used by TickRowRecorder for fast writes).
+
+    Args:
+        num_levels (int): The number of order book levels per side.
+
+    Returns:
+        np.dtype: Structured dtype with 'timestamp' (datetime64[us]) followed by
+                  'bid_price_i'/'bid_size_i' for every level, then
+                  'ask_price_i'/'ask_size_i' for every level.
+    """
+    fields = [('timestamp', 'datetime64[us]')]
+    for side in ('bid', 'ask'):
+        for i in range(1, num_levels + 1):
+            fields.append((f'{side}_price_{i}', np.float64))
+            fields.append((f'{side}_size_{i}', np.float64))
+    return np.dtype(fields)
+
+
+def now_epoch_us() -> int:
+    """Current wall-clock time, as integer microseconds since the epoch (UTC)."""
+    return time.time_ns() // 1000
+
+
+class TickRowRecorder:
+    """
+    Order book ticks recorded into a preallocated array (grown by doubling when full).
+
+    `record()` writes one depth update in place - no pandas objects, no dict,
+    no per-tick array allocation. What happens to a full minute of rows is up to
+    the subclass: OrderbookTickBuffer.drain() hands back a copy and rewinds,
+    tick_journal.TickJournal.finalize() turns its memory-mapped file into a data file.
+
+    With `dedup=True`, an update whose levels are identical to the previous
+    recorded update is not stored, and only counted in `num_suppressed`.
+    """
+
+    def __init__(self, num_levels: int = DEFAULT_NUM_LEVELS, capacity: int = DEFAULT_TICKS_PER_MINUTE,
+                 dedup: bool = False):
+        self.num_levels = num_levels
+        self.dtype = make_tick_dtype(num_levels)
+        self.dedup = dedup
+
+        # Number of 8 byte slots per row: 1 timestamp + 4 values per level
+        self._stride = 1 + 4 * num_levels
+
+        # Offset (in slots) of the first ask field within a row
+        self._ask_offset = 1 + 2 * num_levels
+
+        self._count = 0
+        self._allocate(capacity)
+
+        # Levels of the last recorded update (dedup=True), kept outside the buffer so they survive drain()
+        self._last_book = memoryview(np.zeros(self._stride - 1, dtype=np.float64))
+        self.num_suppressed = 0
+
+    def _allocate(self, capacity):
+        self._bind(np.zeros(capacity * self._stride, dtype=np.float64), capacity)
+
+    def _bind(self, raw, capacity):
+        # One flat float64 block holds all rows. The structured array, and the
+        # memoryviews used for writing, are all views on this same memory.
+        self._raw = raw
+        self._array = self._raw.view(self.dtype)
+        self._values = memoryview(self._raw)
+        self._timestamps = memoryview(self._raw.view(np.int64))
+        self.capacity = capacity
+
+    def _grow(self):
+        old_raw = self._raw
+        self._allocate(self.capacity * 2)
+        self._raw[:old_raw.size] = old_raw
+
+    def __len__(self):
+        return self._count
+
+    def record(self, timestamp_us: int, bids, asks) -> None:
+        """
+        Appends one order book update to the buffer.
+
+        Args:
+            timestamp_us (int): Capture time, in microseconds since the epoch.
+            bids: Sequence of levels with `.price` and `.size` (eg. ticker.domBids).
+            asks: Sequence of levels with `.price` and `.size` (eg. ticker.domAsks).
+                  Missing levels are stored as 0, same as the legacy capture path.
+        """
+        if self._count == self.capacity:
+            self._grow()
+
+        values = self._values
+        row_start = self._count * self._stride
+
+        # Bids, eg. levels 1 through 10
+        pos = row_start + 1
+        n = len(bids)
+        for i in range(self.num_levels):
+            if i < n:
+                level = bids[i]
+                values[pos] = level.price
+                values[pos + 1] = level.size
+            else:
+                values[pos] = 0.0
+                values[pos + 1] = 0.0
+            pos += 2
+
+        # Asks
+        pos = row_start + self._ask_offset
+        n = len(asks)
+        for i in range(self.num_levels):
+            if i < n:
+                level = asks[i]
+                values[pos] = level.price
+                values[pos + 1] = level.size
+            else:
+                values[pos] = 0.0
+                values[pos + 1] = 0.0
+            pos += 2
+
+        if self.dedup:
+            # Same levels as the last recorded update: leave the row uncommitted (it's overwritten by the next update).
+            # Comparing memoryviews of the same native format runs in C, without allocating any array.
+            book = values[row_start + 1:row_start + self._stride]
+            if book == self._last_book:
+                self.num_suppressed += 1
+                return
+            self._last_book[:] = book
+
+        self._timestamps[row_start] = timestamp_us
+        self._count += 1
+
+
+
+class OrderbookTickBuffer(TickRowRecorder):
+    """
+    Per-minute buffer of order book ticks, backed by a preallocated array.
+
+    `drain()` is called once per minute by the main loop, and hands back the
+    filled rows as a compact structured array, then rewinds the buffer so the
+    same memory is reused for the next minute (and resets `num_suppressed`).
+    """
+
+    def drain(self) -> np.ndarray:
+        """
+        Returns the buffered ticks, and resets the buffer for the next minute.
+
+        Returns:
+            np.ndarray: Structured array (see make_tick_dtype) with one row per tick.
+                        This is a copy, so it's safe to hand to a writer thread
+                        while the capture path keeps filling the buffer.
+        """
+        ticks = self._array[:self._count].copy()
+        self._count = 0
+        self.num_suppressed = 0
+        return ticks
+
+
+
+def ticks_from_records(records: list, num_levels: int = DEFAULT_NUM_LEVELS) -> np.ndarray:
+    """
+    Converts legacy list-of-dicts ticks (TICK_CAPTURE_MODE = 'legacy') into a structured tick array.
+    """
+    import pandas as pd
+
+    ticks = np.zeros(len(records), dtype=make_tick_dtype(num_levels))
+    if len(records) == 0:
+        return ticks
+
+    dataframe = pd.DataFrame(records)
+    for name in ticks.dtype.names:
+        ticks[name] = dataframe[name].to_numpy()
+
+    return ticks
@@ -0,0 +1,366 @@
+"""
+orderbook_deltas.py
+
+Incremental L2 book maintenance from IB depth deltas (TICK_CAPTURE_MODE = 'deltas').
+
+Instead of re-serializing all 10 levels of `domBids`/`domAsks` on every update,
+the collector consumes `ticker.domTicks` (the per-level changes received since
+the previous update event: position, operation, side, price, size), applies
+them to an in-place NumPy book, and records each change as a compact event row.
+
+Every `snapshot_interval` events (and at the start of every minute, and after a
+reset), the full book is also recorded as a block of 'snapshot' events, so any
+point in a minute file can be reconstructed by replaying from the nearest
+snapshot instead of from the start of the day.
+
+Event operations follow the IB API, plus one of our own:
+    0 = insert, 1 = update, 2 = delete, 3 = snapshot (set level)
+Sides follow the IB API: 0 = ask, 1 = bid.
+"""
+
+import numpy as np
+
+from orderbook_buffer import DEFAULT_NUM_LEVELS, make_tick_dtype, now_epoch_us
+
+OPERATION_INSERT = 0
+OPERATION_UPDATE = 1
+OPERATION_DELETE = 2
+OPERATION_SNAPSHOT = 3
+
+SIDE_ASK = 0
+SIDE_BID = 1
+
+DEPTH_EVENT_DTYPE = np.dtype([
+    ('timestamp', 'datetime64[us]'),
+    ('position', np.int16),
+    ('operation', np.int8),
+    ('side', np.int8),
+    ('update_end', np.int8),  # 1 on the last event of each ib_insync update event
+    ('price', np.float64),
+    ('size', np.float64),
+])
+
+# Events preallocated per minute (each update event is usually 1-2 depth events)
+DEFAULT_EVENTS_PER_MINUTE = 32768
+
+DEFAULT_SNAPSHOT_INTERVAL = 4096
+
+
+class IncrementalOrderBook:
+    """
+    In-place NumPy order book, maintained from IB depth operations.
+
+    `levels[side, 0]` holds prices and `levels[side, 1]` sizes, best level first.
+    Empty levels are 0, same as the padding in the snapshot capture path.
+    """
+
+    def __init__(self, num_levels: int = DEFAULT_NUM_LEVELS):
+        self.num_levels = num_levels
+        self.levels = np.zeros((2, 2, num_levels), dtype=np.float64)
+
+    def reset(self):
+        self.levels[:] = 0.0
+
+    def apply(self, position: int, operation: int, side: int, price: float, size: float) -> None:
+        if position >= self.num_levels:
+            return
+
+        book_side = self.levels[side]
+
+        if operation == OPERATION_INSERT:
+            # Shift the levels below `position` down by one (the last level falls off)
+            book_side[:, position + 1:] = book_side[:, position:-1]
+            book_side[0, position] = price
+            book_side[1, position] = size
+
+        elif operation == OPERATION_DELETE:
+            # Shift the levels below `position` up by one
+            book_side[:, position:-1] = book_side[:, position + 1:]
+            book_side[:, -1] = 0.0
+
+        else:
+            # OPERATION_UPDATE or OPERATION_SNAPSHOT
+            book_side[0, position] = price
+            book_side[1, position] = size
+
+
+class DepthDeltaRecorder:
+    """
+    Per-minute recorder of depth change events (see module docstring).
+
+    `record()` is called with `ticker.domTicks` on every update event.
+    `drain()` returns the minute's events as a DEPTH_EVENT_DTYPE array and
+    starts the next minute with a snapshot of the current book.
+
+    With `dedup=True`, level updates that don't change the book are dropped, and
+    an update event left with no changes is only counted in `num_suppressed`.
+    Update events with no depth changes at all (an empty domTicks) are not
+    recorded either, and are counted in `num_empty_updates`.
+    """
+
+    def __init__(self, num_levels: int = DEFAULT_NUM_LEVELS, capacity: int = DEFAULT_EVENTS_PER_MINUTE,
+                 snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL, dedup: bool = False):
+        self.num_levels = num_levels
+        self.snapshot_interval = snapshot_interval
+        self.dedup = dedup
+        self.num_suppressed = 0
+        self.num_empty_updates = 0
+        self.book = IncrementalOrderBook(num_levels)
+
+        self._count = 0
+        self._num_updates = 0
+        self._events_since_snapshot = 0
+        self._last_timestamp_us = now_epoch_us()
+        self._allocate(capacity)
+
+        # Every minute's events start with a snapshot, so each file can be replayed on its own
+        self.record_snapshot(self._last_timestamp_us)
+
+    def _allocate(self, capacity):
+        # One array per field, with a memoryview per array for fast scalar writes
+        self._columns = {name: np.zeros(capacity, dtype=DEPTH_EVENT_DTYPE[name]) for name in DEPTH_EVENT_DTYPE.names}
+        self._timestamps = memoryview(self._columns['timestamp'].view(np.int64))
+        self._positions = memoryview(self._columns['position'])
+        self._operations = memoryview(self._columns['operation'])
+        self._sides = memoryview(self._columns['side'])
+        self._update_ends = memoryview(self._columns['update_end'])
+        self._prices = memoryview(self._columns['price'])
+        self._sizes = memoryview(self._columns['size'])
+        self.capacity = capacity
+
+    def _grow(self):
+        old_columns, old_count = self._columns, self._count
+        self._allocate(self.capacity * 2)
+        for name, column in old_columns.items():
+            self._columns[name][:old_count] = column[:old_count]
+
+    def __len__(self):
+        # Number of update events (comparable to the number of rows in the snapshot capture modes)
+        return self._num_updates
+
+    def _append(self, timestamp_us, position, operation, side, price, size):
+        if self._count == self.capacity:
+            self._grow()
+
+        i = self._count
+        self._timestamps[i] = timestamp_us
+        self._positions[i] = position
+        self._operations[i] = operation
+        self._sides[i] = side
+        self._update_ends[i] = 0
+        self._prices[i] = price
+        self._sizes[i] = size
+        self._count += 1
+
+    def record(self, timestamp_us: int, dom_ticks) -> None:
+        """
+        Applies and records one update event's depth changes.
+
+        Args:
+            timestamp_us (int): Capture time, in microseconds since the epoch.
+            dom_ticks: Sequence with `.position`, `.operation`, `.side`, `.price`, `.size`
+                       (eg. ticker.domTicks, the MktDepthData received since the last update event).
+        """
+        apply = self.book.apply
+        levels = self.book.levels
+        num_events = 0
+        num_deduped = 0
+        for dom_tick in dom_ticks:
+            position, operation, side, price, size = (
+                dom_tick.position, dom_tick.operation, dom_tick.side, dom_tick.price, dom_tick.size)
+
+            if (self.dedup and operation == OPERATION_UPDATE and position < self.num_levels
+                    and levels[side, 0, position] == price and levels[side, 1, position] == size):
+                num_deduped += 1
+                continue
+
+            apply(position, operation, side, price, size)
+            self._append(timestamp_us, position, operation, side, price, size)
+            num_events += 1
+
+        if num_events == 0:
+            # Nothing changed, so there is no event to mark as the end of this update
+            if num_deduped:
+                self.num_suppressed += 1
+            else:
+                self.num_empty_updates += 1
+            return
+
+        self._update_ends[self._count - 1] = 1
+        self._num_updates += 1
+        self._last_timestamp_us = timestamp_us
+
+        self._events_since_snapshot += num_events
+        if self._events_since_snapshot >= self.snapshot_interval:
+            self.record_snapshot(timestamp_us)
+
+    def record_snapshot(self, timestamp_us: int) -> None:
+        """Records the full current book as a block of snapshot events (2 sides x num_levels)."""
+        levels = self.book.levels
+        for side in (SIDE_ASK, SIDE_BID):
+            for position in range(self.num_levels):
+                self._append(timestamp_us, position, OPERATION_SNAPSHOT, side, levels[side, 0, position], levels[side, 1, position])
+        self._events_since_snapshot = 0
+
+    def reset(self, timestamp_us: int) -> None:
+        """Empties the book (eg. after IB Error 317 'Market depth data has been RESET'), and records it."""
+        self.book.reset()
+        self.record_snapshot(timestamp_us)
+
+    def drain(self) -> np.ndarray:
+        """
+        Returns the minute's events, and starts the next minute with a snapshot of the book.
+
+        Returns:
+            np.ndarray: DEPTH_EVENT_DTYPE array (a copy).
+        """
+        events = np.empty(self._count, dtype=DEPTH_EVENT_DTYPE)
+        for name, column in self._columns.items():
+            events[name] = column[:self._count]
+
+        self._count = 0
+        self._num_updates = 0
+        self.num_suppressed = 0
+        self.num_empty_updates = 0
+        self.record_snapshot(self._last_timestamp_us)
+
+        return events
+
+
+def snapshot_event_indices(events: np.ndarray, num_levels: int = DEFAULT_NUM_LEVELS) -> np.ndarray:
+    """Indices of the first event of every snapshot block (for random access)."""
+    is_snapshot = events['operation'] == OPERATION_SNAPSHOT
+    return np.flatnonzero(is_snapshot & (events['position'] == 0) & (events['side'] == SIDE_ASK))
+
+
+def book_at(events: np.ndarray, event_index: int, num_levels: int = DEFAULT_NUM_LEVELS) -> IncrementalOrderBook:
+    """
+    Reconstructs the book as of just after `events[event_index]`, replaying from the nearest snapshot.
+    """
+    starts = snapshot_event_indices(events, num_levels)
+    starts = starts[starts <= event_index]
+    if len(starts) == 0:
+        raise ValueError("No snapshot before this event. Minute files always start with a snapshot.")
+
+    book = IncrementalOrderBook(num_levels)
+    for event in events[starts[-1]:event_index + 1].tolist():
+        _, position, operation, side, _, price, size = event
+        book.apply(position, operation, side, price, size)
+
+    return book
+
+
+def _replayed_levels(events: np.ndarray, num_levels: int, depth: int) -> tuple:
+    """
+    The top `depth` levels of the book after every update event, as (prices, sizes), (side, level, n_updates) arrays.
+
+    A level's value after an update event is the one set by the last event that changed that level before it,
+    found with a running max of event indices per level, for all the levels and events at once. Level updates and
+    snapshots (almost every event) set their own level, with their own price and size. An insert or delete shifts
+    every level from its position down, so it counts as setting all of them, with the values of the book just
+    after it: the shifts (a few per minute) are applied one by one, to the book just before them, read from the running max.
+    """
+    update_ends = np.flatnonzero(events['update_end'])
+    if len(update_ends) == 0:
+        return np.zeros((2, depth, 0)), np.zeros((2, depth, 0))
+
+    positions = events['position'].astype(np.int64)
+    operations = events['operation']
+    sides = events['side'].astype(np.int64)
+
+    # Positions beyond the book are ignored (as in IncrementalOrderBook.apply())
+    in_book = positions < num_levels
+    is_shift = ((operations == OPERATION_INSERT) | (operations == OPERATION_DELETE)) & in_book
+    shift_indices = np.flatnonzero(is_shift)
+
+    # Shifts move deeper levels up into the top `depth`, so then every level is needed
+    num_tracked = num_levels if len(shift_indices) else depth
+
+    # Index of the last event that changed each level, as of every event (-1: none yet, the level is empty)
+    last_set = np.full((2, num_tracked, len(events)), -1, dtype=np.int32)
+    set_indices = np.flatnonzero(~is_shift & (positions < num_tracked))
+    last_set[sides[set_indices], positions[set_indices], set_indices] = set_indices
+    for i in shift_indices.tolist():
+        last_set[sides[i], positions[i]:, i] = i
+    np.maximum.accumulate(last_set, axis=2, out=last_set)
+
+    # The levels of each shift's side just after it, applied one shift at a time (on plain lists, much faster
+    # than NumPy for such small changes), in event order, so the shifts before each one are already known
+    shift_levels = []
+    shift_number = np.full(len(events) + 1, -1)
+    shift_number[shift_indices] = np.arange(len(shift_indices))
+    if len(shift_indices):
+        shift_number_of = shift_number.tolist()
+        event_prices, event_sizes = events['price'].tolist() + [0.0], events['size'].tolist() + [0.0]
+
+        for i in shift_indices.tolist():
+            side, position = int(sides[i]), int(positions[i])
+            # The book side just before the shift
+            setters = last_set[side, :, i - 1].tolist() if i > 0 else [-1] * num_tracked
+            book_side = [shift_levels[shift_number_of[setter]][level] if shift_number_of[setter] >= 0
+                         else (event_prices[setter], event_sizes[setter])
+                         for level, setter in enumerate(setters)]
+
+            if operations[i] == OPERATION_INSERT:
+                book_side.insert(position, (event_prices[i], event_sizes[i]))
+                book_side.pop()
+            else:
+                book_side.pop(position)
+                book_side.append((0.0, 0.0))
+            shift_levels.append(book_side)
+
+    # A 0 after the events' values, for the levels never set (index -1)
+    last_set = last_set[:, :depth, update_ends]
+    prices, sizes = np.append(events['price'], 0.0)[last_set], np.append(events['size'], 0.0)[last_set]
+
+    if len(shift_indices):
+        # (shift, level, price/size)
+        shift_levels = np.array(shift_levels)
+        from_shift = shift_number[last_set]
+        changed_by_shift = from_shift >= 0
+        levels = np.broadcast_to(np.arange(depth)[None, :, None], last_set.shape)[changed_by_shift]
+        prices[changed_by_shift] = shift_levels[from_shift[changed_by_shift], levels, 0]
+        sizes[changed_by_shift] = shift_levels[from_shift[changed_by_shift], levels, 1]
+
+    return prices, sizes
+
+
+def reconstruct_ticks(events: np.ndarray, num_levels: int = DEFAULT_NUM_LEVELS) -> np.ndarray:
+    """
+    Replays a minute of events into full book snapshots, one row per update event.
+
+    Vectorized over the minute's events (see _replayed_levels()), instead of applying each one to an IncrementalOrderBook:
+    ~10 ms for a busy minute of 8000 updates, vs ~45 ms (see benchmarks/benchmark_depth_replay.py).
+
+    Returns:
+        np.ndarray: Structured array with the same layout as the snapshot capture
+                    modes (see orderbook_buffer.make_tick_dtype).
+    """
+    prices, sizes = _replayed_levels(events, num_levels, num_levels)
+
+    update_end_indices = np.flatnonzero(events['update_end'])
+    ticks = np.zeros(len(update_end_indices), dtype=make_tick_dtype(num_levels))
+    ticks['timestamp'] = events['timestamp'][update_end_indices]
+
+    # Views of the output as (n_ticks, level, price/size), matching make_tick_dtype's field order (bids, then asks)
+    flat = ticks.view(np.float64).reshape(len(ticks), 1 + 4 * num_levels)
+    bids = flat[:, 1:1 + 2 * num_levels].reshape(len(ticks), num_levels, 2)
+    asks = flat[:, 1 + 2 * num_levels:].reshape(len(ticks), num_levels, 2)
+
+    for book_side, side in ((bids, SIDE_BID), (asks, SIDE_ASK)):
+        book_side[:, :, 0] = prices[side].T
+        book_side[:, :, 1] = sizes[side].T
+
+    return ticks
+
+
+def top_of_book(events: np.ndarray, num_levels: int = DEFAULT_NUM_LEVELS) -> tuple:
+    """
+    Best bid and ask price after every update event (the same rows as reconstruct_ticks()),
+    for per-minute statistics such as spread and price range.
+
+    Returns:
+        tuple: (bid_price_1, ask_price_1) float64 arrays, 0 where a side is empty.
+    """
+    prices, _ = _replayed_levels(events, num_levels, 1)
+    return prices[SIDE_BID, 0], prices[SIDE_ASK, 0]
@@ -0,0 +1,203 @@
+"""
+session_calendar.py
+
+Precomputed market session calendar per instrument class, shared by the
+collector, the health monitor and model training.
+
+For each instrument class, a year of sessions (plus a week on either side) is
+generated once, in the exchange's time zone, and stored as two sorted arrays
+of UTC epoch seconds: session opens and session closes. DST is handled by the
+time zone conversion, when the calendar is built. A lookup is then a bisect
+on the opens (O(log n)), with no time zone or DST logic per call.
+
+Instrument classes:
+    - 'forex' (IDEALPRO): Sunday 17:15 ET to Friday 17:00 ET, with a daily
+      break from 17:00 to 17:15 ET. Each session runs from 17:15 ET to 17:00 ET
+      the next day (1425 minutes).
+    - 'crypto' (ZEROHASH): trades around the clock, so one continuous session.
+
+Holidays are not included: pass `closed_dates` (exchange time zone dates whose
+session, ie. the one closing on that date, is cancelled) if needed.
+
+Usage:
+    calendar = get_session_calendar('forex', 2024)
+    calendar.is_trading_minute(datetime(2024, 3, 4, 22, 15, tzinfo=timezone.utc))  # True
+    calendar.is_first_session_minute(...)  # True at 17:15 ET, in UTC: 21:15 during DST, 22:15 otherwise
+"""
+
+import bisect
+import functools
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+INSTRUMENT_CLASS_FOREX = 'forex'
+INSTRUMENT_CLASS_CRYPTO = 'crypto'
+
+FOREX_TIMEZONE = ZoneInfo('America/New_York')
+FOREX_DAILY_OPEN = dt_time(17, 15)
+FOREX_DAILY_CLOSE = dt_time(17, 0)
+
+# Minutes from a forex session's open to its close (17:15 ET to 17:00 ET the next day)
+FOREX_SESSION_MINUTES = 24 * 60 - 15
+
+# Days generated on either side of the calendar's year, so sessions that span the new year are complete
+_MARGIN_DAYS = 7
+
+
+def instrument_class_of_contract_type(type_of_contract: str) -> str:
+    """Maps the collector's contract type argument ('Forex' or 'Crypto') to an instrument class."""
+    return type_of_contract.lower()
+
+
+def _epoch_seconds(dt: datetime) -> int:
+    # Naive datetimes are taken as UTC (as from datetime.utcnow())
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _forex_sessions(first_day: date, last_day: date, closed_dates: set):
+    opens, closes = [], []
+    day = first_day
+    while day <= last_day:
+        # Sessions open Sunday through Thursday, and close the next day
+        if day.weekday() in (6, 0, 1, 2, 3):
+            next_day = day + timedelta(days=1)
+            if next_day not in closed_dates:
+                opens.append(_epoch_seconds(datetime.combine(day, FOREX_DAILY_OPEN, tzinfo=FOREX_TIMEZONE)))
+                closes.append(_epoch_seconds(datetime.combine(next_day, FOREX_DAILY_CLOSE, tzinfo=FOREX_TIMEZONE)))
+        day += timedelta(days=1)
+    return opens, closes
+
+
+def _crypto_sessions(first_day: date, last_day: date, closed_dates: set):
+    start = _epoch_seconds(datetime.combine(first_day, dt_time(0), tzinfo=timezone.utc))
+    end = _epoch_seconds(datetime.combine(last_day + timedelta(days=1), dt_time(0), tzinfo=timezone.utc))
+    return [start], [end]
+
+
+_SESSION_GENERATORS = {
+    INSTRUMENT_CLASS_FOREX: _forex_sessions,
+    INSTRUMENT_CLASS_CRYPTO: _crypto_sessions,
+}
+
+
+class SessionCalendar:
+    """
+    Sorted session opens/closes (UTC epoch seconds) for one instrument class and year.
+
+    Scalar lookups bisect plain lists (fastest for single datetimes, eg. once a
+    minute in the monitor); the `*_array` methods use np.searchsorted on the
+    same boundaries, for whole columns of timestamps (eg. in training).
+    """
+
+    def __init__(self, instrument_class: str, year: int, closed_dates=()):
+        if instrument_class not in _SESSION_GENERATORS:
+            raise ValueError(f"Unknown instrument class: {instrument_class}. Options are: {list(_SESSION_GENERATORS)}")
+
+        self.instrument_class = instrument_class
+        self.year = year
+
+        first_day = date(year, 1, 1) - timedelta(days=_MARGIN_DAYS)
+        last_day = date(year, 12, 31) + timedelta(days=_MARGIN_DAYS)
+        self.opens, self.closes = _SESSION_GENERATORS[instrument_class](first_day, last_day, set(closed_dates))
+
+        self.opens_array = np.array(self.opens, dtype=np.int64)
+        self.closes_array = np.array(self.closes, dtype=np.int64)
+
+        # A session open directly after the previous session's close (eg. crypto) isn't a "first minute"
+        self._is_reopen = [True] + [previous_close < session_open
+                                    for previous_close, session_open in zip(self.closes, self.opens[1:])]
+
+        self.covers_from = self.opens[0]
+        self.covers_until = self.closes[-1]
+
+    def _session_index(self, t: int) -> int:
+        # Index of the last session that opened at or before `t`, or -1
+        if not self.covers_from <= t < self.covers_until:
+            raise ValueError(
+                f"{datetime.fromtimestamp(t, timezone.utc)} is outside the {self.instrument_class} calendar for {self.year}.")
+        return bisect.bisect_right(self.opens, t) - 1
+
+    def is_open(self, dt: datetime) -> bool:
+        """True if the market is open at `dt`."""
+        t = _epoch_seconds(dt)
+        i = self._session_index(t)
+        return i >= 0 and t < self.closes[i]
+
+    def is_trading_minute(self, minute_dt: datetime) -> bool:
+        """True if the market is open during the minute starting at `minute_dt`."""
+        return self.is_open(minute_dt.replace(second=0, microsecond=0))
+
+    def is_first_session_minute(self, minute_dt: datetime) -> bool:
+        """True if `minute_dt` is the minute a session opens (after a break), eg. 17:15 ET for forex."""
+        t = _epoch_seconds(minute_dt.replace(second=0, microsecond=0))
+        i = self._session_index(t)
+        return i >= 0 and self.opens[i] == t and self._is_reopen[i]
+
+    def minutes_since_open(self, dt: datetime):
+        """Whole minutes since the current session opened, or None if the market is closed."""
+        t = _epoch_seconds(dt)
+        i = self._session_index(t)
+        if i < 0 or t >= self.closes[i]:
+            return None
+        return (t - self.opens[i]) // 60
+
+    def next_open(self, dt: datetime) -> datetime:
+        """The next session open strictly after `dt` (UTC)."""
+        i = bisect.bisect_right(self.opens, _epoch_seconds(dt))
+        if i == len(self.opens):
+            raise ValueError(f"No session open after {dt} in the {self.instrument_class} calendar for {self.year}.")
+        return datetime.fromtimestamp(self.opens[i], timezone.utc)
+
+    def minutes_since_open_array(self, timestamps) -> np.ndarray:
+        """
+        Vectorized minutes_since_open().
+
+        Args:
+            timestamps: datetime64 array (or DatetimeIndex), UTC.
+
+        Returns:
+            np.ndarray: float64 minutes since the session opened, NaN where the market is closed.
+        """
+        t = np.asarray(timestamps, dtype='datetime64[s]').astype(np.int64)
+        i = np.searchsorted(self.opens_array, t, side='right') - 1
+        safe_i = np.maximum(i, 0)
+        is_open = (i >= 0) & (t < self.closes_array[safe_i])
+        return np.where(is_open, (t - self.opens_array[safe_i]) // 60, np.nan)
+
+
+@functools.lru_cache(maxsize=None)
+def get_session_calendar(instrument_class: str, year: int) -> SessionCalendar:
+    """The (cached) calendar for an instrument class and year. Built once, in a few milliseconds."""
+    return SessionCalendar(instrument_class, year)
+
+
+def is_trading_minute(instrument_class: str, minute_dt: datetime) -> bool:
+    """Shortcut for get_session_calendar(instrument_class, <minute's year>).is_trading_minute(minute_dt)."""
+    if minute_dt.tzinfo is not None:
+        minute_dt = minute_dt.astimezone(timezone.utc)
+    return get_session_calendar(instrument_class, minute_dt.year).is_trading_minute(minute_dt)
+
+
+def minutes_since_open_array(instrument_class: str, timestamps) -> np.ndarray:
+    """
+    Shortcut for SessionCalendar.minutes_since_open_array(), over timestamps that may span several years
+    (each timestamp is looked up in its own year's calendar).
+
+    Args:
+        instrument_class: 'forex' or 'crypto'.
+        timestamps: datetime64 array (or DatetimeIndex), UTC if time zone naive.
+
+    Returns:
+        np.ndarray: float64 minutes since the session opened, NaN where the market is closed.
+    """
+    t = np.asarray(timestamps, dtype='datetime64[s]')
+    years = t.astype('datetime64[Y]').astype(np.int64) + 1970
+    minutes = np.full(len(t), np.nan)
+    for year in np.unique(years):
+        in_year = years == year
+        minutes[in_year] = get_session_calendar(instrument_class, int(year)).minutes_since_open_array(t[in_year])
+    return minutes
@@ -0,0 +1,370 @@
+"""
+simulated_ib.py
+
+Offline stand-in for the parts of `ib_insync.IB` the data collector uses, for
+load testing without an IB gateway (SIMULATED_FEED in data_collector.py).
+
+Implements `connect`, `isConnected`, `disconnect`, `qualifyContracts`,
+`reqMktDepth`, `cancelMktDepth`, `sleep`, `errorEvent`, and tickers with
+`updateEvent`, `domBids`, `domAsks` and `domTicks`, like ib_insync does.
+
+Depth updates are emitted while `sleep()` runs (as ib_insync does while its
+event loop runs), replayed from either:
+    - recorded minute files ('.obt' or '.joblib'), with the original spacing
+      between updates, looping when the recording ends, or
+    - synthetic random-walk books at a fixed update rate,
+sped up by `speed` (eg. 100 = a minute of recorded updates every 0.6 seconds).
+
+Faults are injected at random (exponentially distributed, wall clock) times:
+    - Error 317 (depth RESET) for one subscription, or 1101 (connectivity
+      restored, data lost) for the whole connection, via errorEvent.
+    - Disconnects: updates stop, `sleep()` raises ConnectionError (so the
+      collector's reconnect path runs), and `connect()` is refused until
+      `disconnect_duration` seconds have passed. Subscriptions are lost.
+"""
+
+import glob
+import itertools
+import logging
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+
+from orderbook_buffer import DEFAULT_NUM_LEVELS
+from tick_file_format import load_minute_file_as_dataframe
+
+# Same fields as ib_insync's DOMLevel and MktDepthData
+DOMLevel = namedtuple('DOMLevel', 'price size marketMaker')
+MktDepthData = namedtuple('MktDepthData', 'time position marketMaker operation side price size')
+
+# IB depth sides/operations (see orderbook_deltas.py)
+_SIDE_ASK = 0
+_SIDE_BID = 1
+_OPERATION_INSERT = 0
+_OPERATION_UPDATE = 1
+
+# Seconds of synthetic books generated per instrument (replayed in a loop)
+SYNTHETIC_DURATION_SECONDS = 600
+
+_ERROR_MESSAGES = {
+    317: "Market depth data has been RESET. Please empty deep book contents before applying any new entries.",
+    1101: "Connectivity between IB and Trader Workstation has been restored - data lost.",
+}
+
+
+class SimulatedEvent:
+    """Minimal ib_insync Event: handlers are added with `+=`, removed with `-=`, and called by emit()."""
+
+    def __init__(self):
+        self._handlers = []
+
+    def __iadd__(self, handler):
+        self._handlers.append(handler)
+        return self
+
+    def __isub__(self, handler):
+        self._handlers.remove(handler)
+        return self
+
+    def emit(self, *args):
+        for handler in list(self._handlers):
+            handler(*args)
+
+
+class SimulatedTicker:
+    def __init__(self, contract, req_id):
+        self.contract = contract
+        self.req_id = req_id
+        self.updateEvent = SimulatedEvent()
+        self.domBids = []
+        self.domAsks = []
+        self.domTicks = []
+        self.time = None
+
+        # Replay position (see SimulatedIB._emit_due_updates)
+        self.cursor = None
+        self.last_book = None
+
+
+class ReplayTimeline:
+    """
+    One instrument's books as (n, num_levels) arrays, plus each book's offset (seconds) from the first one.
+    """
+
+    def __init__(self, offsets, bid_prices, bid_sizes, ask_prices, ask_sizes):
+        self.offsets = offsets
+        self.bid_prices, self.bid_sizes = bid_prices, bid_sizes
+        self.ask_prices, self.ask_sizes = ask_prices, ask_sizes
+
+        # Loop with the same spacing as between the last two books
+        gap = offsets[-1] - offsets[-2] if len(offsets) > 1 else 1.0
+        self.duration = offsets[-1] + gap
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def offset_of(self, cursor):
+        # `cursor` counts books across loops
+        num_loops, i = divmod(cursor, len(self))
+        return num_loops * self.duration + self.offsets[i]
+
+    def cursor_at(self, replay_seconds):
+        num_loops, remainder = divmod(replay_seconds, self.duration)
+        return int(num_loops) * len(self) + int(np.searchsorted(self.offsets, remainder))
+
+    def book(self, cursor):
+        i = cursor % len(self)
+        return (self.bid_prices[i].tolist(), self.bid_sizes[i].tolist(),
+                self.ask_prices[i].tolist(), self.ask_sizes[i].tolist())
+
+
+def load_replay_timeline(file_paths: list, num_levels: int = DEFAULT_NUM_LEVELS) -> ReplayTimeline:
+    """Builds a timeline from recorded minute files (any format load_minute_file_as_dataframe() reads)."""
+    frames = [load_minute_file_as_dataframe(file_path) for file_path in sorted(file_paths)]
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        raise ValueError(f"No ticks in recorded files: {file_paths}")
+
+    timestamps = np.concatenate([frame['timestamp'].to_numpy(dtype='datetime64[us]') for frame in frames])
+    offsets = (timestamps - timestamps[0]).astype(np.int64) / 1e6
+
+    def stack(side, field):
+        return np.concatenate([
+            frame[[f'{side}_{field}_{i}' for i in range(1, num_levels + 1)]].to_numpy(dtype=np.float64)
+            for frame in frames])
+
+    return ReplayTimeline(offsets, stack('bid', 'price'), stack('bid', 'size'), stack('ask', 'price'), stack('ask', 'size'))
+
+
+def make_synthetic_timeline(updates_per_second: float, num_levels: int = DEFAULT_NUM_LEVELS,
+                            mid_price: float = 1.1, pip: float = 0.00001, seed: int = 0) -> ReplayTimeline:
+    """Random-walk FX-like books: the mid moves by whole pips, and each update changes ~1 size."""
+    rng = np.random.default_rng(seed)
+    num_books = int(SYNTHETIC_DURATION_SECONDS * updates_per_second)
+
+    offsets = np.cumsum(rng.exponential(1 / updates_per_second, num_books))
+    offsets -= offsets[0]
+
+    best_bid_pips = np.round(mid_price / pip) + np.cumsum(rng.choice([-1, 0, 0, 0, 0, 0, 0, 0, 1], num_books))
+    spread_pips = rng.choice([1, 1, 1, 2], num_books)
+    levels = np.arange(num_levels)
+
+    bid_prices = np.round((best_bid_pips[:, None] - levels) * pip, 5)
+    ask_prices = np.round((best_bid_pips[:, None] + spread_pips[:, None] + levels) * pip, 5)
+
+    def random_sizes():
+        # One level's size changes per update, in lots of 100k: forward fill each level's last change
+        changed_levels = rng.integers(0, num_levels, num_books)
+        new_sizes = rng.integers(1, 50, (num_books, num_levels)) * 100000.0
+        is_change = (changed_levels[:, None] == levels) | (np.arange(num_books)[:, None] == 0)
+        last_change = np.maximum.accumulate(np.where(is_change, np.arange(num_books)[:, None], 0), axis=0)
+        return np.take_along_axis(new_sizes, last_change, axis=0)
+
+    return ReplayTimeline(offsets, bid_prices, random_sizes(), ask_prices, random_sizes())
+
+
+def instrument_of(contract) -> str:
+    # Forex('EURUSD') has symbol='EUR', currency='USD'. Crypto('BTC', ...) has symbol='BTC'.
+    if getattr(contract, 'secType', '') == 'CASH':
+        return contract.symbol + contract.currency
+    return contract.symbol
+
+
+class SimulatedIB:
+    """
+    Stand-in for `ib_insync.IB` (see module docstring).
+
+    Args:
+        recorded_files (str): Glob of recorded minute files, with an `{instrument}`
+                              placeholder, eg. '/data/2024-03-04/{instrument}_orderbook_ticks_*.obt'.
+                              None: synthetic books.
+        speed (float): Replay speed multiplier (1 = real time).
+        synthetic_updates_per_second (float): Update rate of synthetic books, at 1x.
+        error_317_every, error_1101_every, disconnect_every (float): Mean wall clock seconds
+                              between injected faults of each kind (None: never).
+        disconnect_duration (float): Seconds connect() is refused after a disconnect.
+    """
+
+    def __init__(self, recorded_files: str = None, speed: float = 1.0, num_levels: int = DEFAULT_NUM_LEVELS,
+                 synthetic_updates_per_second: float = 50.0, error_317_every: float = None,
+                 error_1101_every: float = None, disconnect_every: float = None,
+                 disconnect_duration: float = 5.0, seed: int = 0, logger: logging.Logger = None):
+        self.recorded_files = recorded_files
+        self.speed = speed
+        self.num_levels = num_levels
+        self.synthetic_updates_per_second = synthetic_updates_per_second
+        self.disconnect_duration = disconnect_duration
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.errorEvent = SimulatedEvent()
+
+        self._rng = np.random.default_rng(seed)
+        self._seed = seed
+        self._timelines = {}
+        self._tickers = []
+        self._con_ids = {}
+        self._req_ids = itertools.count(1)
+        self._connected = False
+        self._refuse_connect_until = 0.0
+        self._replay_started_at = None
+
+        self._fault_every = {317: error_317_every, 1101: error_1101_every, 'disconnect': disconnect_every}
+        self._next_fault_at = {}
+
+        # Counters, for load test reports
+        self.num_updates_emitted = 0
+        self.num_faults_injected = {317: 0, 1101: 0, 'disconnect': 0}
+
+    # ---- Connection ----
+
+    def connect(self, host: str = '127.0.0.1', port: int = 7497, clientId: int = 1, **kwargs):
+        now = time.monotonic()
+        if now < self._refuse_connect_until:
+            raise ConnectionRefusedError(f"Simulated IB gateway is down for another {self._refuse_connect_until - now:.1f}s.")
+
+        self._connected = True
+        if self._replay_started_at is None:
+            self._replay_started_at = now
+        for kind, every in self._fault_every.items():
+            if every is not None:
+                self._next_fault_at[kind] = now + self._rng.exponential(every)
+        return self
+
+    def isConnected(self) -> bool:
+        return self._connected
+
+    def disconnect(self):
+        self._connected = False
+        self._tickers = []
+
+    def _check_connected(self):
+        if not self._connected:
+            raise ConnectionError("Not connected")
+
+    # ---- Contracts and subscriptions ----
+
+    def qualifyContracts(self, *contracts):
+        self._check_connected()
+        for contract in contracts:
+            instrument = instrument_of(contract)
+            contract.conId = self._con_ids.setdefault(instrument, 100000 + len(self._con_ids))
+        return list(contracts)
+
+    def _timeline(self, instrument):
+        if instrument not in self._timelines:
+            if self.recorded_files is None:
+                self._timelines[instrument] = make_synthetic_timeline(
+                    self.synthetic_updates_per_second, self.num_levels, seed=self._seed + len(self._timelines))
+            else:
+                file_paths = glob.glob(self.recorded_files.format(instrument=instrument))
+                self._timelines[instrument] = load_replay_timeline(file_paths, self.num_levels)
+        return self._timelines[instrument]
+
+    def reqMktDepth(self, contract, numRows: int = 5, isSmartDepth: bool = False, mktDepthOptions=None):
+        self._check_connected()
+        ticker = SimulatedTicker(contract, next(self._req_ids))
+
+        # Like a live subscription, start from the current replay time
+        timeline = self._timeline(instrument_of(contract))
+        ticker.cursor = timeline.cursor_at(self._replay_seconds(time.monotonic()))
+
+        self._tickers.append(ticker)
+        return ticker
+
+    def cancelMktDepth(self, contract, isSmartDepth: bool = False):
+        self._check_connected()
+        self._tickers = [ticker for ticker in self._tickers if ticker.contract is not contract]
+
+    # ---- Event loop ----
+
+    def _replay_seconds(self, now):
+        return (now - self._replay_started_at) * self.speed
+
+    def sleep(self, *args) -> bool:
+        """Runs the simulated feed for `seconds` (emitting updates and faults), like ib_insync.IB.sleep()."""
+        deadline = time.monotonic() + (args[0] if args else 0)
+        while True:
+            now = time.monotonic()
+            self._inject_due_faults(now)
+            if self._connected:
+                self._emit_due_updates(now, deadline)
+            if now >= deadline:
+                return True
+            time.sleep(min(deadline - now, 0.0005))
+
+    def _emit_due_updates(self, now, deadline):
+        # One update per ticker per round, so every instrument falls behind evenly when the handlers can't keep up.
+        # Stops at the deadline (after at least one round), even with updates still due: the backlog is left for the
+        # next sleep(), like updates waiting in the socket, instead of sleep() never returning
+        replay_seconds = self._replay_seconds(now)
+        while True:
+            emitted = False
+            for ticker in list(self._tickers):
+                timeline = self._timelines[instrument_of(ticker.contract)]
+                if ticker in self._tickers and timeline.offset_of(ticker.cursor) <= replay_seconds:
+                    self._emit_update(ticker, timeline.book(ticker.cursor))
+                    ticker.cursor += 1
+                    emitted = True
+
+            if not emitted or time.monotonic() >= deadline:
+                return
+
+    def _emit_update(self, ticker, book):
+        bid_prices, bid_sizes, ask_prices, ask_sizes = book
+        update_time = datetime.now(timezone.utc)
+
+        # Padding levels (0 price) are not part of the book
+        ticker.domBids = [DOMLevel(p, s, '') for p, s in zip(bid_prices, bid_sizes) if p]
+        ticker.domAsks = [DOMLevel(p, s, '') for p, s in zip(ask_prices, ask_sizes) if p]
+
+        dom_ticks = []
+        if ticker.last_book is None:
+            # First update of a subscription: the whole book, as inserts
+            for side, prices, sizes in ((_SIDE_BID, bid_prices, bid_sizes), (_SIDE_ASK, ask_prices, ask_sizes)):
+                for position, (price, size) in enumerate(zip(prices, sizes)):
+                    if price:
+                        dom_ticks.append(MktDepthData(update_time, position, '', _OPERATION_INSERT, side, price, size))
+        else:
+            last_bid_prices, last_bid_sizes, last_ask_prices, last_ask_sizes = ticker.last_book
+            for side, prices, sizes, last_prices, last_sizes in (
+                    (_SIDE_BID, bid_prices, bid_sizes, last_bid_prices, last_bid_sizes),
+                    (_SIDE_ASK, ask_prices, ask_sizes, last_ask_prices, last_ask_sizes)):
+                for position in range(len(prices)):
+                    if prices[position] != last_prices[position] or sizes[position] != last_sizes[position]:
+                        dom_ticks.append(MktDepthData(
+                            update_time, position, '', _OPERATION_UPDATE, side, prices[position], sizes[position]))
+
+        ticker.last_book = book
+        ticker.domTicks = dom_ticks
+        ticker.time = update_time
+
+        self.num_updates_emitted += 1
+        ticker.updateEvent.emit(ticker)
+
+    def _inject_due_faults(self, now):
+        for kind, fault_at in list(self._next_fault_at.items()):
+            if now < fault_at:
+                continue
+
+            self._next_fault_at[kind] = now + self._rng.exponential(self._fault_every[kind])
+            if not self._connected:
+                continue
+
+            self.num_faults_injected[kind] += 1
+
+            if kind == 317 and self._tickers:
+                ticker = self._tickers[self._rng.integers(len(self._tickers))]
+                self.logger.info(f"Simulated IB: injecting Error 317 for {instrument_of(ticker.contract)}.")
+                self.errorEvent.emit(ticker.req_id, 317, _ERROR_MESSAGES[317], ticker.contract)
+
+            elif kind == 1101:
+                self.logger.info("Simulated IB: injecting Error 1101.")
+                self.errorEvent.emit(-1, 1101, _ERROR_MESSAGES[1101], None)
+
+            elif kind == 'disconnect':
+                self.logger.info(f"Simulated IB: injecting a disconnect ({self.disconnect_duration}s).")
+                self.disconnect()
+                self._refuse_connect_until = now + self.disconnect_duration
+                raise ConnectionError("Socket disconnect")
@@ -0,0 +1,169 @@
+"""
+tick_codec.py
+
+Delta + block compression codec for order book tick columns.
+
+Consecutive L2 snapshots mostly repeat the same prices and sizes, and levels
+only move by a pip or two. So instead of storing raw float64 values, each
+column is stored as:
+
+    1. Integers: prices/sizes are scaled by a power of 10 (eg. 1e5 for EURUSD
+       prices, 1e-5 for sizes in lots of 100k), only if the float64 values
+       round-trip exactly. Timestamps are integer microseconds.
+    2. Deltas: each value minus the previous tick's value, with the first tick
+       stored relative to a per-file base (the first value of the column).
+    3. Narrow ints: the deltas are stored as int8/16/32/64, the narrowest that fits.
+    4. Block compression: zstd if installed, else lz4, else zlib (stdlib).
+
+Columns that don't round-trip exactly (eg. non-finite values) fall back to raw
+float64 with byte shuffling, which is still lossless. Decoding is vectorized:
+decompress, np.cumsum, and one scale per column.
+"""
+
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Range of power-of-10 exponents tried when converting float columns to integers
+_MIN_EXPONENT = -8
+_MAX_EXPONENT = 10
+
+_NARROW_INT_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+
+
+def default_compressor() -> str:
+    """Fastest available block compressor: 'zstd', 'lz4', or 'zlib'."""
+    if zstandard is not None:
+        return 'zstd'
+    if lz4 is not None:
+        return 'lz4'
+    return 'zlib'
+
+
+def compress(data: bytes, compressor: str) -> bytes:
+    if compressor == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if compressor == 'lz4':
+        return lz4.frame.compress(data)
+    if compressor == 'zlib':
+        return zlib.compress(data, 6)
+    raise ValueError(f"Unknown compressor: {compressor}. Options are: <zstd|lz4|zlib>")
+
+
+def decompress(data: bytes, compressor: str) -> bytes:
+    if compressor == 'zstd':
+        if zstandard is None:
+            raise ImportError("Decoding this tick file requires the 'zstandard' package.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if compressor == 'lz4':
+        if lz4 is None:
+            raise ImportError("Decoding this tick file requires the 'lz4' package.")
+        return lz4.frame.decompress(data)
+    if compressor == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown compressor: {compressor}. Options are: <zstd|lz4|zlib>")
+
+
+def _scale_to_float(q, exponent):
+    # Division/multiplication of exact integers by an exact power of 10 is correctly
+    # rounded, so this gives back the same float64 the value was parsed into.
+    if exponent >= 0:
+        return q / 10.0 ** exponent
+    return q * 10.0 ** -exponent
+
+
+def _find_integer_scale(values):
+    # Smallest power of 10 that turns every value into an integer, losslessly
+    if not np.all(np.isfinite(values)):
+        return None, None
+
+    for exponent in range(_MIN_EXPONENT, _MAX_EXPONENT + 1):
+        scaled = values * 10.0 ** exponent if exponent >= 0 else values / 10.0 ** -exponent
+        q = np.rint(scaled)
+        if np.abs(q).max(initial=0) >= 2 ** 53:
+            return None, None
+        q = q.astype(np.int64)
+        if np.array_equal(_scale_to_float(q, exponent), values):
+            return exponent, q
+
+    return None, None
+
+
+def _narrowest_int_dtype(deltas):
+    low, high = deltas.min(initial=0), deltas.max(initial=0)
+    for int_dtype in _NARROW_INT_DTYPES:
+        info = np.iinfo(int_dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(int_dtype)
+
+
+def encode_column(values: np.ndarray, compressor: str) -> tuple:
+    """
+    Encodes one tick column.
+
+    Args:
+        values (np.ndarray): 1D float64, signed int or datetime64 column.
+        compressor (str): 'zstd', 'lz4' or 'zlib'.
+
+    Returns:
+        tuple: (encoding, payload). `encoding` is a short JSON-serializable list
+               needed to decode the payload: ['d', exponent, base, int dtype],
+               or ['r'] for raw (byte shuffled) float64.
+    """
+    # Fields of a structured tick array are strided views
+    values = np.ascontiguousarray(values)
+
+    if values.dtype.kind == 'M':
+        exponent, q = 0, values.view(np.int64)
+    elif values.dtype.kind == 'i':
+        exponent, q = 0, values.astype(np.int64)
+    else:
+        exponent, q = _find_integer_scale(values.astype(np.float64, copy=False))
+
+    if q is None:
+        # Lossless fallback: group the n-th byte of every value together, which compresses much better
+        shuffled = np.ascontiguousarray(values.view(np.uint8).reshape(-1, values.dtype.itemsize).T)
+        return ['r'], compress(shuffled.tobytes(), compressor)
+
+    base = int(q[0]) if len(q) else 0
+    deltas = np.diff(q, prepend=np.int64(base))
+    delta_dtype = _narrowest_int_dtype(deltas)
+
+    return ['d', exponent, base, delta_dtype.str], compress(deltas.astype(delta_dtype).tobytes(), compressor)
+
+
+def decode_column(encoding: list, payload: bytes, n_ticks: int, dtype: np.dtype, compressor: str) -> np.ndarray:
+    """
+    Decodes one tick column (see encode_column).
+
+    Returns:
+        np.ndarray: 1D array of `dtype`, with `n_ticks` values.
+    """
+    dtype = np.dtype(dtype)
+    raw = decompress(payload, compressor)
+
+    if encoding[0] == 'r':
+        shuffled = np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, n_ticks)
+        return np.ascontiguousarray(shuffled.T).view(dtype).reshape(n_ticks)
+
+    _, exponent, base, delta_dtype = encoding
+
+    q = np.cumsum(np.frombuffer(raw, dtype=delta_dtype), dtype=np.int64)
+    q += base
+
+    if dtype.kind == 'M':
+        return q.view(dtype)
+    if dtype.kind == 'i':
+        return q.astype(dtype)
+
+    return _scale_to_float(q, exponent)
@@ -0,0 +1,267 @@
+"""
+tick_file_format.py
+
+Columnar on-disk format for the collector's one-minute order book files.
+
+Replaces the joblib pickle of a list of dicts. A file is a fixed size header,
+followed by one contiguous, typed block per column:
+
+    [ 8 byte magic ][ JSON header, padded to HEADER_SIZE ][ column 1 ][ column 2 ] ...
+
+The JSON header holds the number of ticks, the column names/dtypes/offsets,
+and a free-form 'meta' dict (eg. instrument, minute). Column blocks are 64 byte
+aligned, so a reader can memory-map any column directly as a NumPy array,
+without unpickling anything or building per-row Python objects.
+
+Files finalized from a tick journal (see tick_journal.py) use the 'records'
+layout instead: the same header, followed by fixed-size rows. There, each
+column's offset is its byte offset within a row.
+
+Files written with codec='delta' use the 'delta' layout: each column block is
+delta encoded and compressed (see tick_codec.py), and its header entry also
+holds the block's size and encoding. Readers handle all three layouts.
+"""
+
+import json
+import os
+
+import numpy as np
+
+import tick_codec
+
+TICK_FILE_EXTENSION = 'obt'
+
+TICK_FILE_MAGIC = b'OBTICKS1'
+
+FORMAT_VERSION = 1
+
+# Header is always this size (magic included), so it can be read with a single small read
+HEADER_SIZE = 4096
+
+_COLUMN_ALIGNMENT = 64
+
+
+def _align(offset):
+    return (offset + _COLUMN_ALIGNMENT - 1) // _COLUMN_ALIGNMENT * _COLUMN_ALIGNMENT
+
+
+def encode_tick_file_header(header: dict) -> bytes:
+    """Encodes a header dict into the fixed HEADER_SIZE bytes at the start of a tick file."""
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    space = HEADER_SIZE - len(TICK_FILE_MAGIC)
+    if len(header_bytes) >= space:
+        raise ValueError(f"Tick file header too large: {len(header_bytes)} bytes (max {space - 1}).")
+    return TICK_FILE_MAGIC + header_bytes.ljust(space - 1) + b'\n'
+
+
+def write_tick_file(file_path: str, ticks: np.ndarray, meta: dict = None, codec: str = None) -> int:
+    """
+    Writes a structured tick array to a columnar tick file.
+
+    The file is written under a temporary name and renamed into place, so
+    readers (eg. health_monitor.py) never see a partially written file.
+
+    Args:
+        file_path (str): Destination path (normally ending in '.obt').
+        ticks (np.ndarray): Structured array, eg. from OrderbookTickBuffer.drain().
+        meta (dict): Optional JSON-serializable metadata stored in the header.
+        codec (str): None for raw columns, or 'delta' for delta encoded + compressed columns.
+
+    Returns:
+        int: The number of bytes written.
+    """
+    if codec == 'delta':
+        return _write_delta_tick_file(file_path, ticks, meta)
+    if codec is not None:
+        raise ValueError(f"Unknown tick file codec: {codec}. Options are: <None|delta>")
+
+    columns = []
+    offset = HEADER_SIZE
+    for name in ticks.dtype.names:
+        column_dtype = ticks.dtype[name]
+        nbytes = column_dtype.itemsize * len(ticks)
+        columns.append([name, column_dtype.str, offset])
+        offset = _align(offset + nbytes)
+
+    header = dict(
+        version=FORMAT_VERSION,
+        n_ticks=len(ticks),
+        columns=columns,
+        meta=meta or {},
+    )
+
+    directory, file_name = os.path.split(file_path)
+    temp_file_path = os.path.join(directory, f".{file_name}.tmp")
+
+    with open(temp_file_path, 'wb') as f:
+        f.write(encode_tick_file_header(header))
+        for name, _, column_offset in columns:
+            f.seek(column_offset)
+            np.ascontiguousarray(ticks[name]).tofile(f)
+        f.truncate(f.tell())
+        file_size = f.tell()
+
+    os.replace(temp_file_path, file_path)
+
+    return file_size
+
+
+def _write_delta_tick_file(file_path, ticks, meta):
+    compressor = tick_codec.default_compressor()
+
+    columns = []
+    payloads = []
+    offset = HEADER_SIZE
+    for name in ticks.dtype.names:
+        encoding, payload = tick_codec.encode_column(ticks[name], compressor)
+        columns.append([name, ticks.dtype[name].str, offset, len(payload), encoding])
+        payloads.append(payload)
+        offset += len(payload)
+
+    header = dict(
+        version=FORMAT_VERSION,
+        layout='delta',
+        compressor=compressor,
+        n_ticks=len(ticks),
+        columns=columns,
+        meta=meta or {},
+    )
+
+    directory, file_name = os.path.split(file_path)
+    temp_file_path = os.path.join(directory, f".{file_name}.tmp")
+
+    with open(temp_file_path, 'wb') as f:
+        f.write(encode_tick_file_header(header))
+        for payload in payloads:
+            f.write(payload)
+        file_size = f.tell()
+
+    os.replace(temp_file_path, file_path)
+
+    return file_size
+
+
+def read_tick_file_header(file_path: str) -> dict:
+    """
+    Reads only the header of a tick file (a single 4 KB read).
+
+    Useful when only the tick count or metadata is needed, eg. for volume monitoring.
+
+    Returns:
+        dict: Header with 'n_ticks', 'columns' ([name, dtype, offset] list) and 'meta'.
+    """
+    with open(file_path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+
+    return decode_tick_file_header(raw, file_path)
+
+
+def decode_tick_file_header(raw: bytes, file_path: str = None) -> dict:
+    """Decodes the first HEADER_SIZE bytes of a tick file."""
+    if raw[:len(TICK_FILE_MAGIC)] != TICK_FILE_MAGIC:
+        raise ValueError(f"Not a tick file (bad magic): {file_path}")
+
+    return json.loads(raw[len(TICK_FILE_MAGIC):HEADER_SIZE])
+
+
+def records_dtype_from_header(header: dict) -> np.dtype:
+    """Row dtype of a 'records' layout tick file."""
+    names, formats, offsets = zip(*header['columns'])
+    return np.dtype(dict(names=list(names), formats=list(formats), offsets=list(offsets), itemsize=header['row_size']))
+
+
+def read_tick_file(file_path: str, columns: list = None, mmap: bool = False) -> dict:
+    """
+    Reads columns from a tick file, as NumPy arrays.
+
+    Args:
+        file_path (str): Path to a '.obt' file.
+        columns (list): Column names to read (eg. ['timestamp', 'bid_price_1']). Defaults to all.
+        mmap (bool): If True, return read-only memory-mapped arrays instead of reading into memory.
+                     (Ignored for 'delta' files, which are always decoded into memory.)
+
+    Returns:
+        dict: Column name -> 1D NumPy array (timestamps are datetime64[us]).
+    """
+    header = read_tick_file_header(file_path)
+    n_ticks = header['n_ticks']
+
+    layout = header.get('layout', 'columnar')
+
+    if layout == 'delta':
+        column_index = {column[0]: column[1:] for column in header['columns']}
+        if columns is None:
+            columns = list(column_index)
+
+        arrays = {}
+        with open(file_path, 'rb') as f:
+            for name in columns:
+                dtype_str, offset, nbytes, encoding = column_index[name]
+                f.seek(offset)
+                arrays[name] = tick_codec.decode_column(
+                    encoding, f.read(nbytes), n_ticks, np.dtype(dtype_str), header['compressor'])
+        return arrays
+
+    column_index = {name: (np.dtype(dtype_str), offset) for name, dtype_str, offset in header['columns']}
+    if columns is None:
+        columns = list(column_index)
+
+    if layout == 'records':
+        row_dtype = records_dtype_from_header(header)
+        with open(file_path, 'rb') as f:
+            if mmap and n_ticks > 0:
+                rows = np.memmap(f, dtype=row_dtype, mode='r', offset=HEADER_SIZE, shape=(n_ticks,))
+            else:
+                f.seek(HEADER_SIZE)
+                rows = np.fromfile(f, dtype=row_dtype, count=n_ticks)
+        return {name: rows[name] for name in columns}
+
+    arrays = {}
+    with open(file_path, 'rb') as f:
+        for name in columns:
+            column_dtype, offset = column_index[name]
+            if n_ticks == 0:
+                arrays[name] = np.empty(0, dtype=column_dtype)
+            elif mmap:
+                arrays[name] = np.memmap(f, dtype=column_dtype, mode='r', offset=offset, shape=(n_ticks,))
+            else:
+                f.seek(offset)
+                arrays[name] = np.fromfile(f, dtype=column_dtype, count=n_ticks)
+
+    return arrays
+
+
+def read_tick_file_as_dataframe(file_path: str, columns: list = None):
+    """
+    Reads a tick file into a pandas DataFrame (same columns as the legacy joblib files).
+    """
+    import pandas as pd
+
+    return pd.DataFrame(read_tick_file(file_path, columns=columns))
+
+
+def load_minute_file_as_dataframe(file_path: str):
+    """
+    Loads a collector minute file of either format ('.obt' or legacy '.joblib') into a DataFrame.
+
+    Depth delta files (TICK_CAPTURE_MODE = 'deltas') are replayed into one full
+    book row per update, so callers get the same columns for every capture mode.
+    """
+    import pandas as pd
+
+    if file_path.endswith('.' + TICK_FILE_EXTENSION):
+        header = read_tick_file_header(file_path)
+        if header['meta'].get('kind') == 'depth_deltas':
+            from orderbook_deltas import DEPTH_EVENT_DTYPE, reconstruct_ticks
+
+            columns = read_tick_file(file_path)
+            events = np.empty(header['n_ticks'], dtype=DEPTH_EVENT_DTYPE)
+            for name in DEPTH_EVENT_DTYPE.names:
+                events[name] = columns[name]
+            return pd.DataFrame(reconstruct_ticks(events, num_levels=header['meta']['num_levels']))
+
+        return read_tick_file_as_dataframe(file_path)
+
+    import joblib
+
+    return pd.DataFrame(joblib.load(file_path))
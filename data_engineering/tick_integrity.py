@@ -0,0 +1,157 @@
+"""
+tick_integrity.py
+
+Data integrity checks for a minute of order book ticks, vectorized over all the
+minute's ticks (and all book levels) in one pass, fast enough to run on every
+minute file (a few ms for a busy minute of 10 level books).
+
+Depth delta files ('deltas' capture mode) are replayed into books first
+(orderbook_deltas.reconstruct_ticks, also vectorized: ~10 ms for a busy minute,
+see benchmarks/benchmark_depth_replay.py).
+
+Checks (each is a counter, 0 when the minute is clean):
+    - crossed_books: two-sided books with bid_price_1 >= ask_price_1.
+    - zero_levels: books with at least one zero-filled level (the collector pads
+      levels IB didn't send with 0, eg. a thin book, or right after a resubscribe).
+    - non_monotonic_timestamps: ticks timestamped before the previous tick.
+    - unordered_ladders: books whose bid prices don't strictly decrease, or ask
+      prices don't strictly increase, level by level (zero-filled levels ignored).
+    - stale_books: periods of at least `stale_book_seconds` in which the top of
+      the book (level 1 bid and ask) didn't change, while ticks kept coming.
+
+Used by the collector, which stores the counters in the minute manifest (see
+minute_manifest.py), and by health_monitor.py, which adds them to the minute's
+Pub/Sub event (and validates the data files itself when there's no manifest).
+"""
+
+import numpy as np
+
+from orderbook_buffer import DEFAULT_NUM_LEVELS, make_tick_dtype
+
+INTEGRITY_CHECKS = (
+    'crossed_books',
+    'zero_levels',
+    'non_monotonic_timestamps',
+    'unordered_ladders',
+    'stale_books',
+)
+
+# Top of the book unchanged for this long, while updates are still arriving, counts as a stale book
+STALE_BOOK_SECONDS = 10.0
+
+
+def _price_ladders(ticks, num_levels):
+    # (n_ticks, num_levels) bid and ask price matrices, level 1 first
+    if isinstance(ticks, np.ndarray) and ticks.dtype == make_tick_dtype(num_levels):
+        # All fields are 8 bytes, so rows are runs of float64: [timestamp, bid price/size x levels, ask price/size x levels]
+        flat = np.ascontiguousarray(ticks).view(np.float64).reshape(len(ticks), 1 + 4 * num_levels)
+        return flat[:, 1:1 + 2 * num_levels:2], flat[:, 1 + 2 * num_levels::2]
+
+    bids = np.column_stack([np.asarray(ticks[f'bid_price_{i}'], dtype=np.float64) for i in range(1, num_levels + 1)])
+    asks = np.column_stack([np.asarray(ticks[f'ask_price_{i}'], dtype=np.float64) for i in range(1, num_levels + 1)])
+    return bids, asks
+
+
+def _num_levels_of(ticks, default):
+    names = ticks.keys() if isinstance(ticks, dict) else ticks.dtype.names
+    num_levels = sum(1 for name in names if name.startswith('bid_price_'))
+    return num_levels or default
+
+
+def validate_ticks(ticks, num_levels: int = DEFAULT_NUM_LEVELS, stale_book_seconds: float = STALE_BOOK_SECONDS) -> dict:
+    """
+    Runs every integrity check on a minute of ticks.
+
+    Args:
+        ticks: Structured tick array (see orderbook_buffer.make_tick_dtype), depth change
+               events (see orderbook_deltas.DEPTH_EVENT_DTYPE, replayed into books first),
+               a dict of columns (eg. from tick_file_format.read_tick_file()), or a legacy list of tick dicts.
+        num_levels (int): Book depth of depth change events (for the other inputs, it's taken from the columns).
+        stale_book_seconds (float): See STALE_BOOK_SECONDS.
+
+    Returns:
+        dict: n_ticks, and a counter per check in INTEGRITY_CHECKS.
+    """
+    if isinstance(ticks, list):
+        if not ticks:
+            return dict(n_ticks=0, **dict.fromkeys(INTEGRITY_CHECKS, 0))
+        ticks = {name: np.array([tick[name] for tick in ticks]) for name in ticks[0]}
+        ticks['timestamp'] = ticks['timestamp'].astype('datetime64[us]')
+
+    names = ticks.keys() if isinstance(ticks, dict) else ticks.dtype.names
+    if 'update_end' in names:
+        # Depth delta files: the books only exist once the events are replayed
+        from orderbook_deltas import reconstruct_ticks
+
+        if isinstance(ticks, dict):
+            from orderbook_deltas import DEPTH_EVENT_DTYPE
+
+            events = np.empty(len(ticks['timestamp']), dtype=DEPTH_EVENT_DTYPE)
+            for name in DEPTH_EVENT_DTYPE.names:
+                events[name] = ticks[name]
+            ticks = events
+        ticks = reconstruct_ticks(ticks, num_levels)
+    else:
+        num_levels = _num_levels_of(ticks, num_levels)
+
+    timestamps = np.asarray(ticks['timestamp']).astype('datetime64[us]').view(np.int64)
+    counters = dict(n_ticks=len(timestamps), **dict.fromkeys(INTEGRITY_CHECKS, 0))
+    if len(timestamps) == 0:
+        return counters
+
+    bids, asks = _price_ladders(ticks, num_levels)
+
+    best_bids, best_asks = bids[:, 0], asks[:, 0]
+    two_sided = (best_bids > 0) & (best_asks > 0)
+    counters['crossed_books'] = int(np.count_nonzero(two_sided & (best_bids >= best_asks)))
+
+    counters['zero_levels'] = int(np.count_nonzero((bids == 0).any(axis=1) | (asks == 0).any(axis=1)))
+
+    counters['non_monotonic_timestamps'] = int(np.count_nonzero(np.diff(timestamps) < 0))
+
+    if num_levels > 1:
+        # Deeper level vs the one above it, only where the deeper level has a price
+        deeper_bids, deeper_asks = bids[:, 1:], asks[:, 1:]
+        unordered_bids = (deeper_bids > 0) & (deeper_bids >= bids[:, :-1])
+        unordered_asks = (deeper_asks > 0) & (deeper_asks <= asks[:, :-1])
+        counters['unordered_ladders'] = int(np.count_nonzero(unordered_bids.any(axis=1) | unordered_asks.any(axis=1)))
+
+    # Ticks where the top of the book changed (the first tick starts the first period)
+    changed = np.ones(len(timestamps), dtype=bool)
+    changed[1:] = (best_bids[1:] != best_bids[:-1]) | (best_asks[1:] != best_asks[:-1])
+    change_times = timestamps[changed]
+    # Each period runs from a change to the next change (the last one, to the minute's last tick)
+    period_ends = np.append(change_times[1:], timestamps[-1])
+    counters['stale_books'] = int(np.count_nonzero((period_ends - change_times) >= stale_book_seconds * 1e6))
+
+    return counters
+
+
+def merge_integrity_counters(counters_list) -> dict:
+    """Adds up the counters of several files (eg. an instrument's files for one minute)."""
+    merged = dict(n_ticks=0, **dict.fromkeys(INTEGRITY_CHECKS, 0))
+    for counters in counters_list:
+        for key in merged:
+            merged[key] += counters.get(key, 0)
+    return merged
+
+
+def integrity_errors(counters: dict) -> dict:
+    """Only the checks that failed, eg. {'crossed_books': 3}. Empty if the minute is clean."""
+    return {check: counters[check] for check in INTEGRITY_CHECKS if counters.get(check)}
+
+
+def validate_tick_file(file_path: str, stale_book_seconds: float = STALE_BOOK_SECONDS) -> dict:
+    """
+    validate_ticks() for a collector minute file ('.obt', of any capture mode, or legacy '.joblib').
+    """
+    from tick_file_format import TICK_FILE_EXTENSION, read_tick_file, read_tick_file_header
+
+    if file_path.endswith('.' + TICK_FILE_EXTENSION):
+        header = read_tick_file_header(file_path)
+        num_levels = header['meta'].get('num_levels', DEFAULT_NUM_LEVELS)
+        return validate_ticks(read_tick_file(file_path, mmap=True), num_levels, stale_book_seconds)
+
+    import joblib
+
+    return validate_ticks(joblib.load(file_path), stale_book_seconds=stale_book_seconds)
@@ -0,0 +1,170 @@
+"""
+tick_journal.py
+
+Crash-safe, memory-mapped tick journal for the data collector.
+
+Instead of holding a full minute of ticks in Python heap memory, the capture
+path writes each tick as a fixed-size record into an append-only, memory-mapped
+journal file (one per instrument-minute). Writes land in the OS page cache, so
+the ticks survive a Python crash, an OOM kill or a `systemctl stop/kill` of the
+collector (but not a power loss of the VM).
+
+A journal is a 'records' layout tick file (see tick_file_format.py):
+
+    [ tick file header ][ row 1 ][ row 2 ] ... [ preallocated, unused rows ]
+
+At the end of the minute, the journal is finalized in place: the header is
+updated with the tick count, the unused rows are truncated off, and the file
+is renamed to its final data file name. An unfinished journal found on
+restart is recovered the same way, by counting the rows that were fully
+written (the timestamp is always written last, so a row with a zero
+timestamp was never completed).
+"""
+
+import mmap
+import os
+
+import numpy as np
+
+from orderbook_buffer import DEFAULT_NUM_LEVELS, DEFAULT_TICKS_PER_MINUTE, TickRowRecorder
+from tick_file_format import (
+    FORMAT_VERSION,
+    HEADER_SIZE,
+    decode_tick_file_header,
+    encode_tick_file_header,
+    records_dtype_from_header,
+)
+
+TICK_JOURNAL_EXTENSION = 'journal'
+
+
+def _records_header(dtype, n_ticks, meta):
+    return dict(
+        version=FORMAT_VERSION,
+        layout='records',
+        n_ticks=n_ticks,
+        row_size=dtype.itemsize,
+        columns=[[name, dtype[name].str, dtype.fields[name][1]] for name in dtype.names],
+        meta=meta,
+    )
+
+
+class TickJournal(TickRowRecorder):
+    """
+    Tick rows that live in a memory-mapped journal file, for one minute.
+
+    `record()` is inherited unchanged, so the capture path is the same as
+    TICK_CAPTURE_MODE = 'numpy'. The file is extended (sparse) as needed.
+    There is no drain(): the collector hands the whole journal over to be
+    finalized into the minute's data file, and opens a new one.
+    """
+
+    def __init__(self, journal_path: str, num_levels: int = DEFAULT_NUM_LEVELS,
+                 capacity: int = DEFAULT_TICKS_PER_MINUTE, meta: dict = None, dedup: bool = False):
+        self.journal_path = journal_path
+        self.meta = dict(meta or {})
+
+        self._file = open(journal_path, 'w+b')
+        self._mmap = None
+
+        super().__init__(num_levels=num_levels, capacity=capacity, dedup=dedup)
+
+    def _allocate(self, capacity):
+        self._release_mapping()
+
+        # Extending the file with truncate() doesn't write anything to disk (sparse file).
+        file_size = HEADER_SIZE + capacity * self.dtype.itemsize
+        self._file.truncate(file_size)
+
+        self._mmap = mmap.mmap(self._file.fileno(), file_size)
+        self._mmap[:HEADER_SIZE] = encode_tick_file_header(_records_header(self.dtype, 0, self.meta))
+
+        raw = np.frombuffer(self._mmap, dtype=np.float64, count=capacity * self._stride, offset=HEADER_SIZE)
+        self._bind(raw, capacity)
+
+    def _grow(self):
+        # Rows already written stay in the file, so just map a larger file
+        self._allocate(self.capacity * 2)
+
+    def _release_mapping(self):
+        if self._mmap is None:
+            return
+
+        # Every view on the mapping has to be dropped, before it can be closed
+        self._values.release()
+        self._timestamps.release()
+        self._raw = self._array = self._values = self._timestamps = None
+
+        self._mmap.close()
+        self._mmap = None
+
+    def finalize(self, file_path: str) -> int:
+        """
+        Finalizes the journal into a data file: update header, truncate, rename.
+
+        Args:
+            file_path (str): Final data file path (normally ending in '.obt').
+
+        Returns:
+            int: The size of the data file, in bytes.
+        """
+        n_ticks = self._count
+        if self.dedup:
+            self.meta['num_suppressed_updates'] = self.num_suppressed
+
+        self._mmap[:HEADER_SIZE] = encode_tick_file_header(_records_header(self.dtype, n_ticks, self.meta))
+        self._mmap.flush()
+        self._release_mapping()
+
+        file_size = HEADER_SIZE + n_ticks * self.dtype.itemsize
+        self._file.truncate(file_size)
+        self._file.close()
+
+        os.replace(self.journal_path, file_path)
+
+        return file_size
+
+
+def read_tick_journal_meta(journal_path: str) -> dict:
+    """Returns the 'meta' dict stored in a journal's header (eg. instrument, opened_at)."""
+    with open(journal_path, 'rb') as f:
+        return decode_tick_file_header(f.read(HEADER_SIZE), journal_path)['meta']
+
+
+def recover_tick_journal(journal_path: str, file_path: str) -> int:
+    """
+    Finalizes a journal left behind by a crashed collector.
+
+    Args:
+        journal_path (str): Path of the unfinished journal.
+        file_path (str): Data file path to recover it to.
+
+    Returns:
+        int: The number of ticks recovered. If 0, the journal is removed and no data file is created.
+    """
+    with open(journal_path, 'r+b') as f:
+        header = decode_tick_file_header(f.read(HEADER_SIZE), journal_path)
+        row_dtype = records_dtype_from_header(header)
+
+        f.seek(0, os.SEEK_END)
+        capacity = (f.tell() - HEADER_SIZE) // row_dtype.itemsize
+
+        f.seek(HEADER_SIZE)
+        timestamps = np.fromfile(f, dtype=row_dtype, count=capacity)['timestamp'].view(np.int64)
+
+        # Rows are written in order, and the timestamp is written last,
+        # so the complete rows are everything before the first zero timestamp.
+        unwritten_rows = np.flatnonzero(timestamps == 0)
+        n_ticks = int(unwritten_rows[0]) if len(unwritten_rows) else capacity
+
+        header['n_ticks'] = n_ticks
+        f.seek(0)
+        f.write(encode_tick_file_header(header))
+        f.truncate(HEADER_SIZE + n_ticks * row_dtype.itemsize)
+
+    if n_ticks == 0:
+        os.remove(journal_path)
+    else:
+        os.replace(journal_path, file_path)
+
+    return n_ticks
@@ -0,0 +1,249 @@
+"""
+volume_anomaly.py
+
+Rolling tick volume baseline per instrument and minute of the session, and
+anomaly alerts, for health_monitor.py (VOLUME_ANOMALY_DETECTION = True).
+
+Tick volume depends heavily on the time of day (eg. the Asian session vs the
+London/New York overlap), so the baseline is kept per `bucket_minutes` slice
+of the session (minutes since the session opened, from session_calendar.py;
+for crypto, minutes of the UTC day). Per instrument and slice, on log(1 + ticks):
+
+    - EWMA mean and variance (`alpha`), for a z-score.
+    - A quantile sketch: a histogram over fixed log-spaced bins, with exponentially
+      decayed weights (`sketch_alpha`), for robust low/high quantiles.
+
+Each update touches one slice of one instrument (O(1): a few arithmetic
+operations and one histogram bin). A minute is anomalous when it's both beyond
+`z_threshold` standard deviations, and outside the [low_quantile, high_quantile]
+range of its slice:
+
+    - 'stall': too few ticks (or none: the instrument's data file is missing), eg. a
+      frozen feed, or USDJPY not resubscribing after the 5 PM ET pause.
+    - 'flood': too many ticks, eg. a feed replaying updates in a loop.
+
+Anomalous minutes are not added to the baseline, so a long outage doesn't
+become the new normal. The state (a few arrays, tens of KB) is saved to a
+`.npz` file after every minute, and loaded on start, so a restart doesn't need
+a new warmup.
+"""
+
+import math
+import os
+from datetime import timedelta
+
+import numpy as np
+
+from session_calendar import FOREX_SESSION_MINUTES, INSTRUMENT_CLASS_CRYPTO, INSTRUMENT_CLASS_FOREX, get_session_calendar
+
+# Length of the daily volume cycle, per instrument class
+CYCLE_MINUTES = {
+    INSTRUMENT_CLASS_FOREX: FOREX_SESSION_MINUTES,
+    INSTRUMENT_CLASS_CRYPTO: 24 * 60,
+}
+
+# Quantile sketch bins, over log(1 + ticks) from 0 to log(1 + SKETCH_MAX_TICKS) (the first bin only holds 0 ticks)
+SKETCH_NUM_BINS = 48
+SKETCH_MAX_TICKS = 1e6
+
+# Floor of the standard deviation, on the log scale (~5%), so a very regular slice doesn't alert on tiny changes
+_MIN_STD = 0.05
+
+# Decayed sketch weights are renormalized when the next weight gets this large
+_MAX_SKETCH_WEIGHT = 1e150
+
+
+class VolumeAnomalyDetector:
+    """
+    Tick volume baseline and anomaly detection (see module docstring).
+
+    Usage:
+        detector = VolumeAnomalyDetector(['EURUSD', 'GBPUSD'], state_path='volume_baseline.npz')
+        alerts = detector.update(minute_dt, {'EURUSD': 5012, 'GBPUSD': 3870})  # minute_dt: the minute the ticks are from
+        detector.save()
+    """
+
+    def __init__(self, instruments: list, instrument_class: str = 'forex', bucket_minutes: int = 15,
+                 alpha: float = 0.05, sketch_alpha: float = 0.02, z_threshold: float = 5.0,
+                 low_quantile: float = 0.005, high_quantile: float = 0.995, min_observations: int = 20,
+                 state_path: str = None):
+        self.instruments = list(instruments)
+        self.instrument_class = instrument_class
+        self.bucket_minutes = bucket_minutes
+        self.alpha = alpha
+        self.sketch_growth = 1.0 / (1.0 - sketch_alpha)
+        self.z_threshold = z_threshold
+        self.low_quantile = low_quantile
+        self.high_quantile = high_quantile
+        self.min_observations = min_observations
+        self.state_path = state_path
+
+        self.num_buckets = math.ceil(CYCLE_MINUTES[instrument_class] / bucket_minutes)
+        self._cycle_minutes = CYCLE_MINUTES[instrument_class]
+        self._bin_width = math.log1p(SKETCH_MAX_TICKS) / (SKETCH_NUM_BINS - 1)
+
+        shape = (len(self.instruments), self.num_buckets)
+        self.mean = np.zeros(shape)
+        self.var = np.zeros(shape)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.sketch = np.zeros(shape + (SKETCH_NUM_BINS,))
+        # Weight of the next sketch observation, per slice (grows by sketch_growth, instead of decaying every bin)
+        self.sketch_weight = np.ones(shape)
+
+        # Consecutive anomalous minutes per instrument (any slice), for the alerts
+        self.consecutive = dict.fromkeys(self.instruments, 0)
+
+        self._index_of_instrument = {instrument: i for i, instrument in enumerate(self.instruments)}
+
+        if state_path is not None and os.path.exists(state_path):
+            self.load(state_path)
+
+    # ---- Baseline ----
+
+    def bucket_of_minute(self, minute_dt):
+        """The session slice of a minute, or None if the market was closed."""
+        minutes_since_open = get_session_calendar(self.instrument_class, minute_dt.year).minutes_since_open(minute_dt)
+        if minutes_since_open is None:
+            return None
+        return (minutes_since_open % self._cycle_minutes) // self.bucket_minutes
+
+    def _sketch_bin(self, value):
+        return min(SKETCH_NUM_BINS - 1, 0 if value == 0 else 1 + int(value / self._bin_width))
+
+    def quantile(self, instrument: str, bucket: int, q: float) -> float:
+        """The `q` quantile of an instrument's tick count in a session slice (NaN if no observations yet)."""
+        weights = self.sketch[self._index_of_instrument[instrument], bucket]
+        total = weights.sum()
+        if total == 0:
+            return math.nan
+
+        cumulative = np.cumsum(weights) / total
+        b = int(np.searchsorted(cumulative, q))
+        if b == 0:
+            return 0.0
+
+        # Linear interpolation within the bin, on the log scale
+        below = cumulative[b - 1]
+        fraction = (q - below) / (cumulative[b] - below) if cumulative[b] > below else 0.5
+        return math.expm1((b - 1 + fraction) * self._bin_width)
+
+    def _add_observation(self, i, bucket, value):
+        n = self.count[i, bucket] + 1
+        self.count[i, bucket] = n
+
+        if n == 1:
+            self.mean[i, bucket] = value
+            self.var[i, bucket] = 0.0
+        else:
+            # Cumulative average until there are 1/alpha observations, EWMA after
+            alpha = max(self.alpha, 1.0 / n)
+            diff = value - self.mean[i, bucket]
+            increment = alpha * diff
+            self.mean[i, bucket] += increment
+            self.var[i, bucket] = (1.0 - alpha) * (self.var[i, bucket] + diff * increment)
+
+        weight = self.sketch_weight[i, bucket]
+        self.sketch[i, bucket, self._sketch_bin(value)] += weight
+        weight *= self.sketch_growth
+        if weight > _MAX_SKETCH_WEIGHT:
+            self.sketch[i, bucket] /= weight
+            weight = 1.0
+        self.sketch_weight[i, bucket] = weight
+
+    # ---- Detection ----
+
+    def update(self, minute_dt, tick_counts: dict) -> list:
+        """
+        Checks a minute's tick counts against the baseline, then adds the normal ones to it.
+
+        Args:
+            minute_dt (datetime): The minute the ticks are from (UTC), ie. one minute before the minute in the data file names.
+            tick_counts (dict): Instrument -> tick count (0 for a missing data file). Other instruments are left as is.
+
+        Returns:
+            list: An alert dict per anomalous instrument (see module docstring): name, kind ('stall' or 'flood'),
+                  instrument, minute, n_ticks, expected_ticks, zscore, low_quantile_ticks, high_quantile_ticks,
+                  session_slice, consecutive_minutes.
+        """
+        bucket = self.bucket_of_minute(minute_dt)
+        if bucket is None:
+            return []
+
+        alerts = []
+        for instrument, n_ticks in tick_counts.items():
+            i = self._index_of_instrument.get(instrument)
+            if i is None:
+                continue
+
+            value = math.log1p(n_ticks)
+            kind = None
+
+            if self.count[i, bucket] >= self.min_observations:
+                std = max(math.sqrt(self.var[i, bucket]), _MIN_STD)
+                zscore = (value - self.mean[i, bucket]) / std
+                low = self.quantile(instrument, bucket, self.low_quantile)
+                high = self.quantile(instrument, bucket, self.high_quantile)
+
+                if zscore < -self.z_threshold and n_ticks < low:
+                    kind = 'stall'
+                elif zscore > self.z_threshold and n_ticks > high:
+                    kind = 'flood'
+
+            if kind is None:
+                self.consecutive[instrument] = 0
+                self._add_observation(i, bucket, value)
+                continue
+
+            self.consecutive[instrument] += 1
+            alerts.append(dict(
+                name=f'Tick volume anomaly ({kind}).',
+                kind=kind,
+                instrument=instrument,
+                minute=minute_dt.isoformat(),
+                n_ticks=int(n_ticks),
+                expected_ticks=round(math.expm1(self.mean[i, bucket]), 1),
+                zscore=round(float(zscore), 2),
+                low_quantile_ticks=round(low, 1),
+                high_quantile_ticks=round(high, 1),
+                session_slice=f"{bucket * self.bucket_minutes}-{(bucket + 1) * self.bucket_minutes} min after open",
+                consecutive_minutes=self.consecutive[instrument]))
+
+        return alerts
+
+    # ---- Persistence ----
+
+    def save(self, path: str = None) -> None:
+        """Saves the baseline (atomically: temp file + rename)."""
+        path = path or self.state_path
+        # Scaled so the next observation's weight is 1 (only the ratios between bins matter), which fits in float32
+        scaled_sketch = (self.sketch / self.sketch_weight[..., None]).astype(np.float32)
+        temp_path = f"{path}.tmp.npz"
+        np.savez(
+            temp_path,
+            instruments=np.array(self.instruments),
+            bucket_minutes=self.bucket_minutes,
+            instrument_class=self.instrument_class,
+            mean=self.mean, var=self.var, count=self.count,
+            sketch=scaled_sketch)
+        os.replace(temp_path, path)
+
+    def load(self, path: str) -> None:
+        """Loads a saved baseline. Instruments missing from it start empty; a baseline with other slices is ignored."""
+        with np.load(path) as state:
+            if int(state['bucket_minutes']) != self.bucket_minutes or str(state['instrument_class']) != self.instrument_class:
+                return
+
+            for saved_index, instrument in enumerate(state['instruments'].tolist()):
+                i = self._index_of_instrument.get(instrument)
+                if i is None:
+                    continue
+                self.mean[i] = state['mean'][saved_index]
+                self.var[i] = state['var'][saved_index]
+                self.count[i] = state['count'][saved_index]
+                self.sketch[i] = state['sketch'][saved_index]
+                self.sketch_weight[i] = 1.0
+
+
+def ticks_minute_of_file_minute(file_minute_dt):
+    """The minute a data file's ticks are from (its name has the minute it was flushed at, one minute later)."""
+    return file_minute_dt - timedelta(minutes=1)
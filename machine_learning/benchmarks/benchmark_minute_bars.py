@@ -0,0 +1,104 @@
+"""
+benchmark_minute_bars.py
+
+Time of the segment-index minute bar engine (minute_bars.minute_bars) vs
+pandas groupbys (per minute, then per 10 second window within each minute, as
+in the feature engineering notebook), on a synthetic session of ticks (1M by
+default). Also checks that both give the same columns.
+
+Usage (from the machine_learning directory):
+    python benchmarks/benchmark_minute_bars.py [num_ticks] [depth]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from feature_engineering_sample import EPSILON
+from minute_bars import BAR_WINDOW_SECONDS, minute_bar_columns, minute_bars
+
+INSTRUMENT = 'EURUSD'
+
+
+def make_synthetic_ticks(num_ticks, depth, pip=0.00001, seed=0):
+    # A forex session (~1425 minutes), with random gaps between ticks (some 10 second windows have none)
+    rng = np.random.default_rng(seed)
+    gaps_us = rng.exponential(1425 * 60e6 / num_ticks, num_ticks).astype(np.int64)
+    timestamps = np.datetime64('2024-03-04T22:00', 'us') + np.cumsum(gaps_us).astype('timedelta64[us]')
+
+    # The level 1 price changes on ~1 tick in 3
+    moves = rng.integers(-1, 2, num_ticks) * (rng.random(num_ticks) < 0.35)
+    mid = 1.1 + np.cumsum(moves) * pip
+    half_spread = rng.integers(1, 3, num_ticks) * 0.5 * pip
+
+    data = {'timestamp': timestamps}
+    for i in range(1, depth + 1):
+        data[f'bid_price_{i}'] = mid - half_spread - (i - 1) * pip
+        data[f'bid_size_{i}'] = rng.integers(1, 50, num_ticks) * 100000.0
+        data[f'ask_price_{i}'] = mid + half_spread + (i - 1) * pip
+        data[f'ask_size_{i}'] = rng.integers(1, 50, num_ticks) * 100000.0
+    return pd.DataFrame(data)
+
+
+def minute_bars_with_groupbys(df, instrument, depth):
+    df = df.copy()
+    df['minute'] = df['timestamp'].dt.floor('min')
+    df['window'] = df['timestamp'].dt.second // BAR_WINDOW_SECONDS
+
+    bid_change = df['bid_price_1'].diff().fillna(0) != 0
+    ask_change = df['ask_price_1'].diff().fillna(0) != 0
+    df['price_changed'] = bid_change | ask_change
+
+    ladder_size = sum(df[f'bid_size_{i}'] + df[f'ask_size_{i}'] for i in range(1, depth + 1))
+    ladder_density = ladder_size / (df[f'ask_price_{depth}'] - df[f'bid_price_{depth}'] + EPSILON)
+    df['density_gradient'] = ladder_density.diff().fillna(0)
+
+    rows = {}
+    for minute, minute_df in df.groupby('minute'):
+        row = {}
+        for side in ('ask', 'bid'):
+            prices = minute_df[f'{side}_price_1']
+            row[f'{instrument}_open_price__{side}_level_1'] = prices.iloc[0]
+            row[f'{instrument}_close_price__{side}_level_1'] = prices.iloc[-1]
+            row[f'{instrument}_high_price__{side}_level_1'] = prices.max()
+            row[f'{instrument}_low_price__{side}_level_1'] = prices.min()
+        row[f'{instrument}_total_ticks'] = len(minute_df)
+        row[f'{instrument}_meaningful_ticks__L1_price_change_ticks'] = minute_df['price_changed'].sum()
+        row[f'{instrument}_meaningful_ratio__L1_price_change_ticks_to_total_ticks'] = minute_df['price_changed'].sum() / len(minute_df)
+
+        window_means = minute_df.groupby('window')['density_gradient'].mean()
+        for w in range(60 // BAR_WINDOW_SECONDS):
+            start = w * BAR_WINDOW_SECONDS
+            row[f'{instrument}_density_gradient_mean_in_{start}_to_{start + BAR_WINDOW_SECONDS}_second_window'] = window_means.get(w, np.nan)
+        rows[minute] = row
+
+    return pd.DataFrame.from_dict(rows, orient='index')[minute_bar_columns(instrument)]
+
+
+if __name__ == '__main__':
+
+    num_ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    df = make_synthetic_ticks(num_ticks, depth)
+
+    started = time.perf_counter()
+    expected = minute_bars_with_groupbys(df, INSTRUMENT, depth)
+    groupby_seconds = time.perf_counter() - started
+
+    ticks = {name: df[name].to_numpy() for name in df.columns}
+    started = time.perf_counter()
+    bars = minute_bars(ticks, INSTRUMENT, depth)
+    engine_seconds = time.perf_counter() - started
+
+    assert (bars.index == expected.index).all()
+    np.testing.assert_allclose(bars.to_numpy(dtype=np.float64), expected.to_numpy(dtype=np.float64), rtol=1e-12, atol=1e-3)
+
+    print(f"--- Minute bar benchmark ({num_ticks:,} ticks, {len(bars)} minutes, depth {depth}) ---")
+    print(f"pandas groupbys:   {groupby_seconds:7.3f} s")
+    print(f"segment reduceat:  {engine_seconds:7.3f} s ({groupby_seconds / engine_seconds:.0f}x)")
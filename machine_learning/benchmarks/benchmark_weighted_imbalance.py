@@ -0,0 +1,110 @@
+"""
+benchmark_weighted_imbalance.py
+
+End-to-end time of calculate_weighted_order_book_imbalance() (DataFrame in,
+Series out, through the weighted_order_book_imbalance kernel) vs the original
+per-level pandas implementation, on 1M ticks x 10 levels by default. Also the
+float32 path: order_book_blocks() (reading and casting the columns) and the
+kernel, timed separately.
+
+Times are the median of `repeats` runs.
+
+Usage (from the machine_learning directory):
+    python benchmarks/benchmark_weighted_imbalance.py [num_ticks] [depth] [repeats]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from feature_engineering_sample import EPSILON, calculate_weighted_order_book_imbalance, order_book_blocks, weighted_order_book_imbalance
+
+
+def make_synthetic_blocks(num_ticks, depth, dtype, pip=0.00001, seed=0):
+    # (n_ticks, depth) column-major blocks, like order_book_blocks() returns (float32 prices relative to the first mid)
+    rng = np.random.default_rng(seed)
+    mid = np.cumsum(rng.normal(0, 0.2 * pip, num_ticks))
+    if dtype == np.float64:
+        mid += 1.1
+    half_spread = rng.integers(1, 4, num_ticks) * 0.5 * pip
+
+    blocks = [np.empty((num_ticks, depth), dtype=dtype, order='F') for _ in range(4)]
+    bid_prices, bid_sizes, ask_prices, ask_sizes = blocks
+    for i in range(depth):
+        bid_prices[:, i] = mid - half_spread - i * pip
+        ask_prices[:, i] = mid + half_spread + i * pip
+        bid_sizes[:, i] = rng.integers(1, 50, num_ticks) * 100000
+        ask_sizes[:, i] = rng.integers(1, 50, num_ticks) * 100000
+    return blocks
+
+
+def blocks_to_dataframe(blocks, depth):
+    bid_prices, bid_sizes, ask_prices, ask_sizes = blocks
+    data = {}
+    for i in range(depth):
+        data[f'bid_price_{i + 1}'] = bid_prices[:, i].astype(np.float64)
+        data[f'bid_size_{i + 1}'] = bid_sizes[:, i].astype(np.float64)
+        data[f'ask_price_{i + 1}'] = ask_prices[:, i].astype(np.float64)
+        data[f'ask_size_{i + 1}'] = ask_sizes[:, i].astype(np.float64)
+    return pd.DataFrame(data)
+
+
+def calculate_weighted_order_book_imbalance_per_level(df, depth):
+    # The original implementation: one pandas Series per level and operation
+    mid_price = (df['bid_price_1'] + df['ask_price_1']) / 2
+
+    weighted_bid_volume = pd.Series(0.0, index=df.index)
+    weighted_ask_volume = pd.Series(0.0, index=df.index)
+
+    for i in range(1, depth + 1):
+        bid_weight = 1 / (np.abs(mid_price - df[f'bid_price_{i}']) + EPSILON)
+        ask_weight = 1 / (np.abs(df[f'ask_price_{i}'] - mid_price) + EPSILON)
+
+        weighted_bid_volume += df[f'bid_size_{i}'] * bid_weight
+        weighted_ask_volume += df[f'ask_size_{i}'] * ask_weight
+
+    imbalance = (weighted_bid_volume - weighted_ask_volume) / (weighted_bid_volume + weighted_ask_volume + EPSILON)
+    return imbalance.clip(-1, 1)
+
+
+def median_seconds(function, repeats):
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - started)
+    return float(np.median(seconds)), result
+
+
+if __name__ == '__main__':
+
+    num_ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 7
+
+    print(f"--- Weighted order book imbalance benchmark ({num_ticks:,} ticks x {depth} levels, median of {repeats}) ---")
+
+    df = blocks_to_dataframe(make_synthetic_blocks(num_ticks, depth, np.float64), depth)
+
+    pandas_seconds, expected = median_seconds(lambda: calculate_weighted_order_book_imbalance_per_level(df, depth), repeats)
+    seconds64, result = median_seconds(lambda: calculate_weighted_order_book_imbalance(df, depth), repeats)
+    assert np.array_equal(result.to_numpy(), expected.to_numpy(), equal_nan=True)
+
+    # float32: the columns are read and cast into blocks first, then the kernel runs on them
+    blocks_seconds, blocks32 = median_seconds(lambda: order_book_blocks(df, depth, dtype=np.float32), repeats)
+    kernel32_seconds, result32 = median_seconds(lambda: weighted_order_book_imbalance(*blocks32), repeats)
+    max_error32 = np.abs(result32 - expected.to_numpy()).max()
+
+    def describe(seconds):
+        return f"{seconds:7.3f} s ({num_ticks / seconds / 1e6:6.1f}M ticks/s, {pandas_seconds / seconds:4.1f}x)"
+
+    print(f"pandas, per level:                            {describe(pandas_seconds)}")
+    print(f"calculate_weighted_order_book_imbalance():    {describe(seconds64)}")
+    print(f"float32, order_book_blocks() + kernel:        {describe(blocks_seconds + kernel32_seconds)}, "
+          f"max abs error vs float64: {max_error32:.2e}")
+    print(f"    order_book_blocks(): {blocks_seconds:.3f} s, kernel: {kernel32_seconds:.3f} s")
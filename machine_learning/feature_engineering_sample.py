@@ -16,6 +16,131 @@ import numpy as np
 # A small constant to prevent division by zero in calculations.
 EPSILON = 1e-10
 
+# Size of the weighted_order_book_imbalance() scratch array, per chunk of ticks (fits in a typical L2 cache)
+IMBALANCE_CHUNK_BYTES = 256 * 1024
+
+def order_book_blocks(df: pd.DataFrame, depth: int = 5, dtype=np.float64) -> tuple:
+    """
+    Reads the order book columns once into contiguous (n_ticks, depth) arrays.
+
+    For float32, prices are stored relative to the first tick's mid-price (in
+    float64, before the cast), since only price distances matter to the
+    imbalance, and an absolute FX price in float32 is only accurate to ~1e-7
+    (a sizeable fraction of a 1 pip spread).
+
+    Args:
+        df (pd.DataFrame): DataFrame with 'bid_price_i', 'bid_size_i', 'ask_price_i', 'ask_size_i' columns.
+        depth (int): The number of order book levels to read.
+        dtype: np.float64 or np.float32.
+
+    Returns:
+        tuple: (bid_prices, bid_sizes, ask_prices, ask_sizes), each (n_ticks, depth), level 1 first.
+    """
+    dtype = np.dtype(dtype)
+    reference_price = 0.0
+    if dtype != np.float64 and len(df):
+        reference_price = (df['bid_price_1'].iloc[0] + df['ask_price_1'].iloc[0]) / 2
+
+    blocks = []
+    for side, field in (('bid', 'price'), ('bid', 'size'), ('ask', 'price'), ('ask', 'size')):
+        # Column-major, so each level is contiguous: summing over levels is then a few fast vector adds
+        block = np.empty((len(df), depth), dtype=dtype, order='F')
+        for i in range(1, depth + 1):
+            column = df[f'{side}_{field}_{i}'].to_numpy(dtype=np.float64)
+            block[:, i - 1] = column - reference_price if field == 'price' and reference_price else column
+        blocks.append(block)
+
+    return tuple(blocks)
+
+
+def distance_weighted_size(distance_to_mid: np.ndarray, sizes: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """
+    A level's size, weighted inversely to its distance from the mid-price: size * 1 / (|distance| + EPSILON).
+
+    The per-level term of the weighted order book imbalance (a side's weighted volume is the sum over its levels).
+    `distance_to_mid` is |price - mid price|; `out` may be `distance_to_mid` itself.
+    """
+    out = np.add(distance_to_mid, distance_to_mid.dtype.type(EPSILON), out=out)
+    np.reciprocal(out, out=out)
+    out *= sizes
+    return out
+
+
+def weighted_volume_imbalance(weighted_bid_volume: np.ndarray, weighted_ask_volume: np.ndarray,
+                              out: np.ndarray = None, scratch: np.ndarray = None) -> np.ndarray:
+    """
+    The weighted order book imbalance, from each side's weighted volume: (bid - ask) / (bid + ask + EPSILON), clipped to [-1, 1].
+
+    `scratch` holds the denominator (defaults to a new array); it may be `weighted_bid_volume`, if that isn't needed after.
+    """
+    out = np.subtract(weighted_bid_volume, weighted_ask_volume, out=out)
+    denominator = np.add(weighted_bid_volume, weighted_ask_volume, out=scratch)
+    denominator += denominator.dtype.type(EPSILON)
+    np.divide(out, denominator, out=out)
+    return np.clip(out, -1, 1, out=out)
+
+
+def weighted_order_book_imbalance(bid_prices, bid_sizes, ask_prices, ask_sizes, out: np.ndarray = None) -> np.ndarray:
+    """
+    Weighted order book imbalance kernel: calculate_weighted_order_book_imbalance() on NumPy arrays.
+
+    Same calculation, for all levels at once: chunk by chunk of ticks, each
+    level's weighted size is computed into one cache-sized scratch array and
+    added to its side's total, instead of a new Series per level and operation.
+
+    Args:
+        bid_prices, bid_sizes, ask_prices, ask_sizes: Per-level float32 or float64 values, either as
+            (n_ticks, depth) arrays (see order_book_blocks()), or as a list of (n_ticks,) arrays per
+            level, level 1 first (eg. DataFrame columns, read without a copy).
+        out (np.ndarray): Optional (n_ticks,) array to write the result into (eg. a slice of a larger
+                          array, to process a long series in chunks). Defaults to a new array of the inputs' dtype.
+
+    Returns:
+        np.ndarray: The imbalance for each tick, clipped to [-1, 1] (`out`, if given).
+    """
+    bid_prices, bid_sizes, ask_prices, ask_sizes = (
+        [values[:, i] for i in range(values.shape[1])] if isinstance(values, np.ndarray) else list(values)
+        for values in (bid_prices, bid_sizes, ask_prices, ask_sizes))
+
+    dtype = np.result_type(*bid_prices, *bid_sizes, *ask_prices, *ask_sizes)
+    n_ticks = len(bid_prices[0])
+
+    if out is None:
+        out = np.empty(n_ticks, dtype=dtype)
+
+    # Rows are processed in chunks small enough for the scratch arrays to stay in the CPU cache,
+    # so the several passes over each chunk don't each go back to main memory
+    chunk_size = max(1, IMBALANCE_CHUNK_BYTES // (4 * dtype.itemsize))
+    scratch = np.empty(min(chunk_size, n_ticks), dtype=dtype)
+    mid_price = np.empty(len(scratch), dtype=dtype)
+    weighted_bid_volume = np.empty(len(scratch), dtype=dtype)
+    weighted_ask_volume = np.empty(len(scratch), dtype=dtype)
+
+    for start in range(0, n_ticks, chunk_size):
+        end = min(start + chunk_size, n_ticks)
+        n = end - start
+        rows = slice(start, end)
+        chunk_scratch, chunk_mid_price = scratch[:n], mid_price[:n]
+        bid_volume, ask_volume = weighted_bid_volume[:n], weighted_ask_volume[:n]
+
+        np.add(bid_prices[0][rows], ask_prices[0][rows], out=chunk_mid_price)
+        chunk_mid_price /= dtype.type(2)
+
+        # Each side's weighted volume: distance_weighted_size() summed over the levels in order
+        for prices, sizes, volume in ((bid_prices, bid_sizes, bid_volume), (ask_prices, ask_sizes, ask_volume)):
+            for level, (level_prices, level_sizes) in enumerate(zip(prices, sizes)):
+                level_volume = volume if level == 0 else chunk_scratch
+                np.subtract(level_prices[rows], chunk_mid_price, out=level_volume)
+                np.abs(level_volume, out=level_volume)
+                distance_weighted_size(level_volume, level_sizes[rows], out=level_volume)
+                if level > 0:
+                    volume += level_volume
+
+        weighted_volume_imbalance(bid_volume, ask_volume, out=out[rows], scratch=bid_volume)
+
+    return out
+
+
 def calculate_weighted_order_book_imbalance(df: pd.DataFrame, depth: int = 5) -> pd.Series:
     """
     Calculates the order book imbalance, weighted by price distance.
@@ -32,28 +157,96 @@ def calculate_weighted_order_book_imbalance(df: pd.DataFrame, depth: int = 5) ->
     Returns:
         pd.Series: A series representing the weighted imbalance for each tick.
     """
-    mid_price = (df['bid_price_1'] + df['ask_price_1']) / 2
-    
-    weighted_bid_volume = pd.Series(0.0, index=df.index)
-    weighted_ask_volume = pd.Series(0.0, index=df.index)
+    # The kernel reads each level's column in place (no copy into blocks)
+    bid_prices, bid_sizes, ask_prices, ask_sizes = (
+        [df[f'{side}_{field}_{i}'].to_numpy(dtype=np.float64) for i in range(1, depth + 1)]
+        for side, field in (('bid', 'price'), ('bid', 'size'), ('ask', 'price'), ('ask', 'size')))
 
-    for i in range(1, depth + 1):
-        bid_price = df[f'bid_price_{i}']
-        bid_size = df[f'bid_size_{i}']
-        ask_price = df[f'ask_price_{i}']
-        ask_size = df[f'ask_size_{i}']
+    imbalance = weighted_order_book_imbalance(bid_prices, bid_sizes, ask_prices, ask_sizes)
 
-        # Weight is inversely proportional to distance from mid-price.
-        # Closer orders have more weight.
-        bid_weight = 1 / (np.abs(mid_price - bid_price) + EPSILON)
-        ask_weight = 1 / (np.abs(ask_price - mid_price) + EPSILON)
+    return pd.Series(imbalance, index=df.index)
 
-        weighted_bid_volume += bid_size * bid_weight
-        weighted_ask_volume += ask_size * ask_weight
 
-    imbalance = (weighted_bid_volume - weighted_ask_volume) / (weighted_bid_volume + weighted_ask_volume + EPSILON)
-    
-    return imbalance.clip(-1, 1)
+def size_changes(sizes: np.ndarray) -> np.ndarray:
+    """Change of each tick's size since the previous tick (0 for the first tick, or next to a missing size), as float64."""
+    sizes = np.asarray(sizes, dtype=np.float64)
+    changes = np.zeros(len(sizes))
+    np.subtract(sizes[1:], sizes[:-1], out=changes[1:])
+    # Same as .diff().fillna(0): a missing size contributes no volume
+    return np.nan_to_num(changes, nan=0.0)
+
+
+def order_flow_volume(size_changes: np.ndarray) -> np.ndarray:
+    """VPIN volume of each tick: the increase in size (increase in bid size = buy, increase in ask size = sell)."""
+    return np.maximum(size_changes, 0)
+
+
+def vpin_from_sizes(bid_sizes: np.ndarray, ask_sizes: np.ndarray, volume_bucket_size: int = 100000,
+                    window: int = 50, min_periods: int = 10) -> np.ndarray:
+    """
+    VPIN kernel: calculate_vpin() on NumPy arrays, without a groupby.
+
+    Args:
+        bid_sizes (np.ndarray): Level 1 bid sizes, one per tick.
+        ask_sizes (np.ndarray): Level 1 ask sizes, one per tick.
+        volume_bucket_size (int): The total volume that defines one bucket.
+        window (int): Number of buckets in the VPIN window.
+        min_periods (int): Buckets needed before VPIN is defined (0 before that).
+
+    Returns:
+        np.ndarray: float64 VPIN of each tick's bucket.
+    """
+    buy_volume = order_flow_volume(size_changes(bid_sizes))
+    sell_volume = order_flow_volume(size_changes(ask_sizes))
+
+    return vpin_from_volumes(buy_volume, sell_volume, volume_bucket_size, window, min_periods)
+
+
+def vpin_from_volumes(buy_volume: np.ndarray, sell_volume: np.ndarray, volume_bucket_size: int = 100000,
+                      window: int = 50, min_periods: int = 10) -> np.ndarray:
+    """
+    vpin_from_sizes(), from each tick's buy and sell volumes.
+
+    The bucket index is monotone (cumulative volume only grows), so each bucket
+    is one run of consecutive ticks: per-bucket sums are a single np.add.reduceat
+    over the run starts, the rolling sum over the last `window` buckets is a
+    difference of cumulative sums, and each tick gets its bucket's value by
+    direct indexing.
+
+    Args:
+        buy_volume (np.ndarray): float64 buy volume of each tick (>= 0).
+        sell_volume (np.ndarray): float64 sell volume of each tick (>= 0).
+        volume_bucket_size, window, min_periods: See vpin_from_sizes().
+
+    Returns:
+        np.ndarray: float64 VPIN of each tick's bucket.
+    """
+    n_ticks = len(buy_volume)
+    if n_ticks == 0:
+        return np.empty(0, dtype=np.float64)
+
+    bucket_indices = (np.cumsum(buy_volume + sell_volume) // volume_bucket_size).astype(int)
+
+    # First tick of each bucket, and each tick's position among the buckets
+    new_bucket = np.empty(n_ticks, dtype=bool)
+    new_bucket[0] = True
+    np.not_equal(bucket_indices[1:], bucket_indices[:-1], out=new_bucket[1:])
+    bucket_starts = np.flatnonzero(new_bucket)
+    bucket_of_tick = np.cumsum(new_bucket) - 1
+
+    bucket_imbalance = np.add.reduceat(np.abs(buy_volume - sell_volume), bucket_starts)
+
+    # Rolling sum over the last `window` buckets
+    cumulative_imbalance = np.concatenate(([0.0], np.cumsum(bucket_imbalance)))
+    bucket_positions = np.arange(1, len(bucket_imbalance) + 1)
+    rolling_imbalance = cumulative_imbalance[bucket_positions] - cumulative_imbalance[np.maximum(bucket_positions - window, 0)]
+
+    vpin = rolling_imbalance / (window * volume_bucket_size)
+    # Undefined (0) until there are min_periods buckets
+    if min_periods > 1:
+        vpin[:min_periods - 1] = 0.0
+
+    return vpin[bucket_of_tick]
 
 
 def calculate_vpin(df: pd.DataFrame, volume_bucket_size: int = 100000) -> pd.Series:
@@ -74,44 +267,10 @@ def calculate_vpin(df: pd.DataFrame, volume_bucket_size: int = 100000) -> pd.Ser
     Returns:
         pd.Series: A series representing the VPIN value at the end of each volume bucket.
     """
-    # Calculate trade direction based on change in best bid/ask sizes
-    bid_vol_change = df['bid_size_1'].diff().fillna(0)
-    ask_vol_change = df['ask_size_1'].diff().fillna(0)
-    
-    # Simple heuristic for order flow: increase in bid size = buy, increase in ask size = sell
-    buy_volume = bid_vol_change.clip(lower=0)
-    sell_volume = ask_vol_change.clip(lower=0)
-    
-    total_volume = buy_volume + sell_volume
-    
-    # Create volume buckets
-    cumulative_volume = total_volume.cumsum()
-    bucket_indices = (cumulative_volume // volume_bucket_size).astype(int)
-    
-    # Group by volume bucket and calculate order flow imbalance
-    bucket_df = pd.DataFrame({
-        'bucket': bucket_indices,
-        'buy_vol': buy_volume,
-        'sell_vol': sell_volume
-    })
-    
-    bucket_imbalance = bucket_df.groupby('bucket').apply(
-        lambda x: (x['buy_vol'] - x['sell_vol']).abs().sum()
-    )
-    
-    total_bucket_volume = bucket_df.groupby('bucket').apply(
-        lambda x: (x['buy_vol'] + x['sell_vol']).sum()
-    )
-    
-    # VPIN is the sum of absolute imbalances divided by total volume over N buckets
-    vpin = bucket_imbalance.rolling(window=50, min_periods=10).sum() / \
-           (50 * volume_bucket_size)
-           
-    # Map results back to the original DataFrame index
-    vpin_series = vpin.reindex(bucket_indices).ffill().fillna(0)
-    vpin_series.index = df.index
-    
-    return vpin_series
+    # VPIN is the sum of absolute imbalances divided by total volume over N (50) buckets, see vpin_from_sizes()
+    vpin = vpin_from_sizes(df['bid_size_1'].to_numpy(), df['ask_size_1'].to_numpy(), volume_bucket_size)
+
+    return pd.Series(vpin, index=df.index)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,198 @@
+"""
+feature_registry.py
+
+Feature registry with shared intermediates: each feature declares the
+features (or dataset columns) it's computed from, and FeatureRegistry.compute()
+runs only what the requested features need:
+
+    - In topological order (the inputs of a feature always run before it).
+    - Each intermediate once per dataset, however many features use it (eg. the
+      mid price, used by the spreads, every level's distance to mid, and the imbalances).
+    - Freeing each intermediate (and dataset column) as soon as its last consumer
+      has run, so peak memory stays close to the widest layer of the graph, not the whole graph.
+
+So requesting 50 features costs about as much as their unique intermediates,
+instead of 50 independent passes over the data. Names that aren't registered
+are read from the dataset (a DataFrame, a dict of columns, or a structured array).
+
+Registered features (see register_order_book_features() and register_mid_price_features()):
+
+    Ticks: mid_price, spread, relative_spread, {bid|ask}_distance_to_mid_{i},
+           {bid|ask}_size_diff_{i}, buy_volume, sell_volume,
+           weighted_order_book_imbalance_{depth}, vpin.
+    Minute bars: {pair}_mid_open/close/high/low, {pair}_p, {pair}_r, {pair}_hl, {pair}_oc, {pair}_spr.
+
+The tick features give the same values as the functions in feature_engineering_sample.py,
+and the bar features the same as model_training.py's price transform.
+
+Usage:
+    registry = FeatureRegistry()
+    register_order_book_features(registry, depth=10)
+    features = registry.compute(ticks_df, ['vpin', 'relative_spread'] + [f'weighted_order_book_imbalance_{d}' for d in range(1, 11)])
+"""
+
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from feature_engineering_sample import (distance_weighted_size, order_flow_volume, size_changes, vpin_from_volumes,
+                                        weighted_volume_imbalance)
+
+Feature = namedtuple('Feature', 'name inputs function')
+
+
+class FeatureRegistry:
+    """
+    Features and their inputs, and the executor that computes them (see module docstring).
+    """
+
+    def __init__(self):
+        self._features = {}
+
+    def register(self, name: str, inputs, function) -> None:
+        """Registers `name` = function(*inputs), with inputs as the values of other features or dataset columns."""
+        if name in self._features:
+            raise ValueError(f"Feature already registered: {name}")
+        self._features[name] = Feature(name, tuple(inputs), function)
+
+    def feature(self, name: str, inputs):
+        """Decorator form of register()."""
+        def decorator(function):
+            self.register(name, inputs, function)
+            return function
+        return decorator
+
+    def features(self) -> list:
+        """Names of all the registered features."""
+        return list(self._features)
+
+    def plan(self, requested) -> list:
+        """
+        The registered features needed for `requested`, each once, in an order where each one comes after its inputs.
+        """
+        order = []
+        # name -> False while its inputs are being visited, True once it's in `order`
+        visited = {}
+
+        def visit(name, path):
+            if name not in self._features or visited.get(name):
+                return
+            if name in visited:
+                raise ValueError(f"Cycle in feature inputs: {' -> '.join(path + [name])}")
+            visited[name] = False
+            for input_name in self._features[name].inputs:
+                visit(input_name, path + [name])
+            visited[name] = True
+            order.append(name)
+
+        for name in requested:
+            visit(name, [])
+        return order
+
+    def compute(self, dataset, requested) -> dict:
+        """
+        Computes the requested features (see module docstring).
+
+        Args:
+            dataset: DataFrame, dict of columns or structured array, with the columns the features are computed from.
+            requested (list): Feature (or column) names.
+
+        Returns:
+            dict: Name -> np.ndarray, for each requested name (in order).
+        """
+        requested = list(requested)
+        keep = set(requested)
+        order = self.plan(requested)
+
+        # Number of features still to run that use each value, to free it after the last one
+        remaining_consumers = Counter(input_name for name in order for input_name in self._features[name].inputs)
+        values = {}
+
+        def value(name):
+            if name not in values:
+                values[name] = np.asarray(dataset[name], dtype=np.float64)
+            return values[name]
+
+        for name in order:
+            feature = self._features[name]
+            values[name] = feature.function(*[value(input_name) for input_name in feature.inputs])
+
+            for input_name in feature.inputs:
+                remaining_consumers[input_name] -= 1
+                if remaining_consumers[input_name] == 0 and input_name not in keep:
+                    del values[input_name]
+
+        return {name: value(name) for name in requested}
+
+
+# ---- Order book (tick) features ----
+
+def _distance_to_mid(prices, mid_price):
+    return np.abs(prices - mid_price)
+
+
+def _weighted_volume(previous_levels_volume, distance_to_mid, sizes):
+    # The levels above, plus this level's distance weighted size (in the same order as the kernel sums them)
+    level_volume = distance_weighted_size(distance_to_mid, sizes)
+    if previous_levels_volume is None:
+        return level_volume
+    return previous_levels_volume + level_volume
+
+
+def register_order_book_features(registry: FeatureRegistry, depth: int = 5, volume_bucket_size: int = 100000) -> None:
+    """
+    Registers the tick features of feature_engineering_sample.py, as a graph of shared intermediates.
+
+    The nodes use the same building blocks as feature_engineering_sample.py's kernels (distance_weighted_size(),
+    weighted_volume_imbalance(), size_changes(), order_flow_volume(), vpin_from_volumes()), so the formulas live in one place.
+
+    The weighted volumes are cumulative over the levels ('weighted_bid_volume_3' is levels 1 to 3), so the
+    imbalances at every depth up to `depth` share them.
+
+    Args:
+        registry (FeatureRegistry): The registry to add the features to.
+        depth (int): The number of order book levels (the dataset needs 'bid/ask_price_i' and 'bid/ask_size_i' up to it).
+        volume_bucket_size (int): See calculate_vpin().
+    """
+    registry.register('mid_price', ['bid_price_1', 'ask_price_1'], lambda bid, ask: (bid + ask) / 2)
+    registry.register('spread', ['bid_price_1', 'ask_price_1'], lambda bid, ask: ask - bid)
+    registry.register('relative_spread', ['spread', 'mid_price'], np.divide)
+
+    for i in range(1, depth + 1):
+        for side in ('bid', 'ask'):
+            registry.register(f'{side}_distance_to_mid_{i}', [f'{side}_price_{i}', 'mid_price'], _distance_to_mid)
+            registry.register(f'{side}_size_diff_{i}', [f'{side}_size_{i}'], size_changes)
+
+            previous = [f'weighted_{side}_volume_{i - 1}'] if i > 1 else []
+            registry.register(
+                f'weighted_{side}_volume_{i}', previous + [f'{side}_distance_to_mid_{i}', f'{side}_size_{i}'],
+                _weighted_volume if i > 1 else lambda distance_to_mid, sizes: _weighted_volume(None, distance_to_mid, sizes))
+
+        registry.register(f'weighted_order_book_imbalance_{i}', [f'weighted_bid_volume_{i}', f'weighted_ask_volume_{i}'],
+                          weighted_volume_imbalance)
+
+    # Increase in bid size = buy, increase in ask size = sell
+    registry.register('buy_volume', ['bid_size_diff_1'], order_flow_volume)
+    registry.register('sell_volume', ['ask_size_diff_1'], order_flow_volume)
+    registry.register('vpin', ['buy_volume', 'sell_volume'],
+                      lambda buy, sell: vpin_from_volumes(buy, sell, volume_bucket_size))
+
+
+# ---- Minute bar features ----
+
+def register_mid_price_features(registry: FeatureRegistry, pairs) -> None:
+    """
+    Registers model_training.py's price transform of the minute bars (per pair): mid price OHLC (intermediates),
+    log close mid (p), close to close log return (r), high-low range (hl), open to close return (oc), relative spread (spr).
+    """
+    for pair in pairs:
+        for stat in ('open', 'close', 'high', 'low'):
+            registry.register(f'{pair}_mid_{stat}', [f'{pair}_{stat}_price__ask_level_1', f'{pair}_{stat}_price__bid_level_1'],
+                              lambda ask, bid: (ask + bid) / 2)
+
+        registry.register(f'{pair}_p', [f'{pair}_mid_close'], np.log)
+        registry.register(f'{pair}_r', [f'{pair}_p'], lambda p: np.concatenate(([np.nan], np.diff(p))))
+        registry.register(f'{pair}_hl', [f'{pair}_mid_high', f'{pair}_mid_low'], lambda high, low: np.log(high / low))
+        registry.register(f'{pair}_oc', [f'{pair}_mid_close', f'{pair}_mid_open'], lambda close, open_: np.log(close / open_))
+        registry.register(f'{pair}_spr', [f'{pair}_close_price__ask_level_1', f'{pair}_close_price__bid_level_1', f'{pair}_mid_close'],
+                          lambda ask, bid, mid: (ask - bid) / mid)
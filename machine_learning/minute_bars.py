@@ -0,0 +1,151 @@
+"""
+minute_bars.py
+
+Per-minute aggregation of raw order book ticks into the bar and activity
+features model_training.py uses (per instrument):
+
+    - {instrument}_open/close/high/low_price__ask/bid_level_1
+    - {instrument}_total_ticks
+    - {instrument}_meaningful_ticks__L1_price_change_ticks: ticks where the level 1 bid or ask price
+      changed (vs the previous tick; the first tick of the input counts as no change).
+    - {instrument}_meaningful_ratio__L1_price_change_ticks_to_total_ticks
+    - {instrument}_density_gradient_mean_in_{0..50}_to_{10..60}_second_window: mean density gradient
+      of the ticks in each 10 second window of the minute (NaN for a window with no ticks). The ladder
+      density is the total size over `depth` levels of both sides, per unit of price spanned by the
+      ladder (ask_price_depth - bid_price_depth); the density gradient is its change since the previous tick.
+
+All the columns come from one pass over the ticks: a binary search of the
+sorted timestamps gives a segment index (the start of every 10 second window
+with ticks, and of every minute), and each column is one np.ufunc.reduceat
+(or an indexing) over the segments, instead of a pandas groupby per window.
+
+Usage:
+    ticks = read_tick_file(file_path)  # Or a structured array, a dict of columns, or a DataFrame
+    bars = minute_bars(ticks, 'EURUSD')  # One row per minute with ticks, indexed by the minute's start
+"""
+
+import numpy as np
+import pandas as pd
+
+from feature_engineering_sample import EPSILON
+
+BAR_WINDOW_SECONDS = 10
+WINDOWS_PER_MINUTE = 60 // BAR_WINDOW_SECONDS
+
+
+def minute_bar_columns(instrument: str) -> list:
+    """Names of the columns minute_bars() returns, in order."""
+    columns = []
+    for stat in ('open', 'close', 'high', 'low'):
+        for side in ('ask', 'bid'):
+            columns.append(f'{instrument}_{stat}_price__{side}_level_1')
+    columns += [
+        f'{instrument}_total_ticks',
+        f'{instrument}_meaningful_ticks__L1_price_change_ticks',
+        f'{instrument}_meaningful_ratio__L1_price_change_ticks_to_total_ticks',
+    ]
+    for w in range(WINDOWS_PER_MINUTE):
+        start = w * BAR_WINDOW_SECONDS
+        columns.append(f'{instrument}_density_gradient_mean_in_{start}_to_{start + BAR_WINDOW_SECONDS}_second_window')
+    return columns
+
+
+def minute_bars(ticks, instrument: str, depth: int = 5) -> pd.DataFrame:
+    """
+    Aggregates ticks into per-minute bar and activity features (see module docstring).
+
+    Args:
+        ticks: Columns 'timestamp', and 'bid/ask_price_i'/'bid/ask_size_i' for levels 1 to `depth`: a structured
+               tick array (see orderbook_buffer.make_tick_dtype), a dict of columns, or a DataFrame.
+               Any number of minutes; ticks out of time order are sorted first.
+        instrument (str): Prefix of the column names, eg. 'EURUSD'.
+        depth (int): The number of order book levels of the ladder density.
+
+    Returns:
+        pd.DataFrame: One row per minute with ticks, indexed by the start of the minute (UTC), columns as minute_bar_columns().
+    """
+    timestamps = np.asarray(ticks['timestamp']).astype('datetime64[us]').astype(np.int64)
+    n_ticks = len(timestamps)
+    if n_ticks == 0:
+        return pd.DataFrame(columns=minute_bar_columns(instrument), index=pd.DatetimeIndex([], name='minute'))
+
+    order = None
+    if (np.diff(timestamps) < 0).any():
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+
+    def column(name, positions=None):
+        values = np.asarray(ticks[name], dtype=np.float64)
+        if order is not None:
+            return values[order if positions is None else order[positions]]
+        return values if positions is None else values[positions]
+
+    # ---- Segment index: starts of the 10 second windows with ticks, then of the minutes ----
+    window_us = BAR_WINDOW_SECONDS * 1_000_000
+    window_ids = np.arange(timestamps[0] // window_us, timestamps[-1] // window_us + 1)
+    # Binary search of the window boundaries, instead of a division per tick
+    starts = np.searchsorted(timestamps, window_ids * window_us)
+    has_ticks = np.r_[starts[1:], n_ticks] > starts
+    window_starts = starts[has_ticks]
+    window_of_segment = window_ids[has_ticks]
+    window_ends = np.r_[window_starts[1:], n_ticks]
+
+    minute_of_window = window_of_segment // WINDOWS_PER_MINUTE
+    new_minute = np.r_[True, minute_of_window[1:] != minute_of_window[:-1]]
+    minute_starts = window_starts[new_minute]
+    minute_ids = minute_of_window[new_minute]
+    minute_ends = np.r_[minute_starts[1:], n_ticks]
+
+    data = {}
+
+    # ---- Level 1 OHLC ----
+    bid_price_1, ask_price_1 = column('bid_price_1'), column('ask_price_1')
+    for stat in ('open', 'close', 'high', 'low'):
+        for side, prices in (('ask', ask_price_1), ('bid', bid_price_1)):
+            if stat == 'open':
+                values = prices[minute_starts]
+            elif stat == 'close':
+                values = prices[minute_ends - 1]
+            elif stat == 'high':
+                values = np.maximum.reduceat(prices, minute_starts)
+            else:
+                values = np.minimum.reduceat(prices, minute_starts)
+            data[f'{instrument}_{stat}_price__{side}_level_1'] = values
+
+    # ---- Activity ----
+    total_ticks = minute_ends - minute_starts
+    price_changed = np.zeros(n_ticks, dtype=bool)
+    price_changed[1:] = (bid_price_1[1:] != bid_price_1[:-1]) | (ask_price_1[1:] != ask_price_1[:-1])
+    meaningful_ticks = np.add.reduceat(price_changed, minute_starts, dtype=np.int64)
+
+    data[f'{instrument}_total_ticks'] = total_ticks
+    data[f'{instrument}_meaningful_ticks__L1_price_change_ticks'] = meaningful_ticks
+    data[f'{instrument}_meaningful_ratio__L1_price_change_ticks_to_total_ticks'] = meaningful_ticks / total_ticks
+
+    # ---- Density gradient, per 10 second window ----
+    # The gradients of a window add up to the density at its last tick minus the density before it (at the
+    # previous window's last tick, or the first tick), so the density is only needed at those ticks
+    positions = np.r_[0, window_ends - 1]
+    ladder_size = column('bid_size_1', positions) + column('ask_size_1', positions)
+    for i in range(2, depth + 1):
+        ladder_size += column(f'bid_size_{i}', positions)
+        ladder_size += column(f'ask_size_{i}', positions)
+    ladder_density = ladder_size / (column(f'ask_price_{depth}', positions) - column(f'bid_price_{depth}', positions) + EPSILON)
+
+    window_means = np.diff(ladder_density) / (window_ends - window_starts)
+
+    # (minute, window of the minute) grid, NaN where a window has no ticks
+    gradient_means = np.full((len(minute_ids), WINDOWS_PER_MINUTE), np.nan)
+    gradient_means[np.cumsum(new_minute) - 1, window_of_segment % WINDOWS_PER_MINUTE] = window_means
+    for w in range(WINDOWS_PER_MINUTE):
+        start = w * BAR_WINDOW_SECONDS
+        data[f'{instrument}_density_gradient_mean_in_{start}_to_{start + BAR_WINDOW_SECONDS}_second_window'] = gradient_means[:, w]
+
+    index = pd.DatetimeIndex((minute_ids * 60_000_000).astype('datetime64[us]'), name='minute')
+    return pd.DataFrame(data, index=index)
+
+
+def minute_bars_of_instruments(ticks_by_instrument: dict, depth: int = 5) -> pd.DataFrame:
+    """minute_bars() for several instruments (instrument -> ticks), side by side (outer join on the minute)."""
+    bars = [minute_bars(ticks, instrument, depth) for instrument, ticks in ticks_by_instrument.items()]
+    return pd.concat(bars, axis=1, join='outer').sort_index()
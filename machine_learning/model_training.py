@@ -35,6 +35,12 @@ if True:
 
     # Local imports of custom functions
     from helpers.timing_debugging import debuggingTools_format_time, debug_timing
+    from feature_registry import FeatureRegistry, register_mid_price_features
+
+    # Market session calendar, shared with the datafeed. Imported package qualified (repo root on the path), so only
+    # data_engineering/session_calendar.py is shared, not the datafeed's other flat modules.
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from data_engineering.session_calendar import FOREX_SESSION_MINUTES, INSTRUMENT_CLASS_FOREX, minutes_since_open_array
 
     # --------------------------------------------------
 
@@ -883,8 +889,12 @@ if True:
 
             if 'minutes_market_has_been_open' in dataframe:
                 # Create features representing phase within the session
-                cyclic_feature = dataframe['minutes_market_has_been_open']
-                cycle_period = 1425.0 # Use the observed max value (of `minutes_market_has_been_open` summary stats) as the session length period
+                # Minutes since the session opened, from the same session calendar as the datafeed (UTC timestamps).
+                # Falls back to the dataset's column for any minute the calendar has the market closed.
+                cyclic_feature = pd.Series(
+                    minutes_since_open_array(INSTRUMENT_CLASS_FOREX, dataframe.index), index=dataframe.index
+                ).fillna(dataframe['minutes_market_has_been_open'])
+                cycle_period = float(FOREX_SESSION_MINUTES) # Forex session length (17:15 ET - 17:00 ET next day), 1425 minutes
 
                 dataframe['minutes_market_has_been_open_sin'] = np.sin(2 * np.pi * cyclic_feature / cycle_period)
                 dataframe['minutes_market_has_been_open_cos'] = np.cos(2 * np.pi * cyclic_feature / cycle_period)
@@ -1346,44 +1356,22 @@ if True:
 
             pairs = ["EURUSD", "GBPUSD"] # removing "USDJPY" for now - to reduce complexity
 
-            for pair in pairs:
+            # Price features, from the mid price OHLC intermediates (computed once each, and freed once used - see feature_registry.py)
+            price_feature_registry = FeatureRegistry()
+            register_mid_price_features(price_feature_registry, pairs)
 
-                # build mid-price OHLC
-                dataframe[f"{pair}_mid_open"]  = (dataframe[f"{pair}_open_price__ask_level_1"] 
-                                                + dataframe[f"{pair}_open_price__bid_level_1"]) / 2
-                dataframe[f"{pair}_mid_close"] = (dataframe[f"{pair}_close_price__ask_level_1"]
-                                                + dataframe[f"{pair}_close_price__bid_level_1"]) / 2
-                dataframe[f"{pair}_mid_high"]  = (dataframe[f"{pair}_high_price__ask_level_1"]
-                                                + dataframe[f"{pair}_high_price__bid_level_1"]) / 2
-                dataframe[f"{pair}_mid_low"]   = (dataframe[f"{pair}_low_price__ask_level_1"]
-                                                + dataframe[f"{pair}_low_price__bid_level_1"]) / 2
-
-                # (1) log-close-mid level
-                dataframe[f"{pair}_p"]      = np.log(dataframe[f"{pair}_mid_close"])
-                new_features_for_model.append(f"{pair}_p")
-
-                # (2) close‑to‑close log return
-                dataframe[f"{pair}_r"]      = dataframe[f"{pair}_p"].diff()      
-                new_features_for_model.append(f"{pair}_r")        
-
-                # (3) High‑low range divided by mid	(intraminute volatility proxy)
-                dataframe[f"{pair}_hl"]  = np.log(dataframe[f"{pair}_mid_high"] / dataframe[f"{pair}_mid_low"])
-                new_features_for_model.append(f"{pair}_hl")   
-
-                # (4) open‑to‑close intrabar return
-                dataframe[f"{pair}_oc"] = np.log(
-                    dataframe[f"{pair}_mid_close"] / 
-                    dataframe[f"{pair}_mid_open"]
-                )
-                new_features_for_model.append(f"{pair}_oc")   
+            # (1) log-close-mid level, (2) close-to-close log return, (3) high-low range divided by mid (intraminute volatility proxy),
+            # (4) open-to-close intrabar return, (5) relative spread (normalised spread across pairs)
+            price_features = price_feature_registry.compute(
+                dataframe, [f"{pair}_{name}" for pair in pairs for name in ("p", "r", "hl", "oc", "spr")])
 
-                # (5) relative spread (normalised spread across pairs)
-                dataframe[f"{pair}_spr"] = ((dataframe[f"{pair}_close_price__ask_level_1"] - 
-                                             dataframe[f"{pair}_close_price__bid_level_1"]) / 
-                                             dataframe[f"{pair}_mid_close"]) #
-                new_features_for_model.append(f"{pair}_spr")  
+            for name, values in price_features.items():
+                dataframe[name] = values
+                new_features_for_model.append(name)
 
-                # ---------- mark raw bid/ask and helper mids for dropping later ----------
+            for pair in pairs:
+
+                # ---------- mark raw bid/ask for dropping later ----------
 
                 cols_to_drop_after_transform.extend([
                     
@@ -1396,12 +1384,6 @@ if True:
                     f"{pair}_high_price__bid_level_1",
                     f"{pair}_low_price__ask_level_1",
                     f"{pair}_low_price__bid_level_1",
-
-                    # Prune the helper mid_* columns once the engineered features are built	
-                    f"{pair}_mid_open", 
-                    f"{pair}_mid_close",
-                    f"{pair}_mid_high", 
-                    f"{pair}_mid_low"
                 ])
     
             # # ───────── clip abnormally wide spreads ───────── 
@@ -0,0 +1,167 @@
+"""
+streaming_features.py
+
+Tick-at-a-time versions of the order book features in feature_engineering_sample.py,
+for live inference: each order book update is fed to `update()` as it arrives,
+instead of rebuilding the features from whole minute files.
+
+    - StreamingWeightedImbalance: calculate_weighted_order_book_imbalance(), per tick.
+    - StreamingVPIN: calculate_vpin(), with its volume bucket state kept in a ring
+      of the last 50 buckets.
+
+Both cost O(1) per tick (O(depth) for the imbalance), hold their state in
+fixed-size arrays, and can be snapshot()/restore()d (eg. saved on shutdown, to
+resume without replaying the session). The arithmetic is done in the same order
+as the batch functions, so the values are identical (not just close):
+
+    - Imbalance: the batch value of the same tick.
+    - VPIN: the batch value of the sequence up to and including the tick. The batch
+      function gives every tick its whole bucket's VPIN, including ticks that
+      arrive later in the bucket, which isn't known live. At the last tick of each
+      bucket, both are the same.
+
+Usage:
+    vpin = StreamingVPIN(volume_bucket_size=100000)
+    imbalance = StreamingWeightedImbalance(depth=5)
+    for bid_prices, bid_sizes, ask_prices, ask_sizes in order_book_updates:
+        features = (vpin.update(bid_prices, bid_sizes, ask_prices, ask_sizes),
+                    imbalance.update(bid_prices, bid_sizes, ask_prices, ask_sizes))
+"""
+
+import numpy as np
+
+from feature_engineering_sample import EPSILON
+
+
+class StreamingWeightedImbalance:
+    """
+    Weighted order book imbalance of each update (see calculate_weighted_order_book_imbalance()).
+
+    Args:
+        depth (int): The number of order book levels to consider.
+    """
+
+    def __init__(self, depth: int = 5):
+        self.depth = depth
+        self.value = 0.0
+
+    def update(self, bid_prices, bid_sizes, ask_prices, ask_sizes) -> float:
+        """
+        Args:
+            bid_prices, bid_sizes, ask_prices, ask_sizes: Sequences of per-level values (level 1 first), at least `depth` long.
+
+        Returns:
+            float: The imbalance, in [-1, 1].
+        """
+        mid_price = (bid_prices[0] + ask_prices[0]) / 2
+
+        # Summed level by level, in the same order as the batch kernel
+        weighted_bid_volume = 0.0
+        weighted_ask_volume = 0.0
+        for i in range(self.depth):
+            weighted_bid_volume += (1 / (abs(bid_prices[i] - mid_price) + EPSILON)) * bid_sizes[i]
+            weighted_ask_volume += (1 / (abs(ask_prices[i] - mid_price) + EPSILON)) * ask_sizes[i]
+
+        imbalance = (weighted_bid_volume - weighted_ask_volume) / (weighted_bid_volume + weighted_ask_volume + EPSILON)
+
+        self.value = min(max(imbalance, -1.0), 1.0)
+        return self.value
+
+    def snapshot(self) -> dict:
+        return dict(depth=self.depth, value=self.value)
+
+    def restore(self, snapshot: dict) -> None:
+        self.depth = snapshot['depth']
+        self.value = snapshot['value']
+
+
+class StreamingVPIN:
+    """
+    VPIN after each update (see calculate_vpin() and vpin_from_sizes()).
+
+    State: the previous level 1 sizes, the cumulative volume, the current bucket's
+    imbalance so far, and a ring with the cumulative imbalance at the start of each of
+    the last `window` buckets (the rolling sum is the difference with the oldest one).
+
+    Args:
+        volume_bucket_size (int): The total volume that defines one bucket.
+        window (int): Number of buckets in the VPIN window.
+        min_periods (int): Buckets needed before VPIN is defined (0 before that).
+    """
+
+    def __init__(self, volume_bucket_size: int = 100000, window: int = 50, min_periods: int = 10):
+        self.volume_bucket_size = volume_bucket_size
+        self.window = window
+        self.min_periods = min_periods
+
+        self.previous_bid_size = None
+        self.previous_ask_size = None
+        self.cumulative_volume = 0.0
+        # Bucket index (cumulative volume // bucket size) of the current bucket, and number of buckets so far
+        self.bucket_index = None
+        self.num_buckets = 0
+        # Cumulative imbalance of all completed buckets, and the current bucket's imbalance so far
+        self.completed_imbalance = 0.0
+        self.bucket_imbalance = 0.0
+        # completed_imbalance at the start of the last `window` buckets (slot = bucket number % window)
+        self.bucket_start_imbalance = np.zeros(window, dtype=np.float64)
+
+        self.value = 0.0
+
+    def update(self, bid_prices, bid_sizes, ask_prices, ask_sizes) -> float:
+        """
+        Args:
+            bid_prices, bid_sizes, ask_prices, ask_sizes: Sequences of per-level values (level 1 first).
+                                                          Only the level 1 sizes are used.
+
+        Returns:
+            float: VPIN, including the current (incomplete) bucket.
+        """
+        bid_size, ask_size = float(bid_sizes[0]), float(ask_sizes[0])
+
+        # Increase in bid size = buy, increase in ask size = sell (the first tick has no change)
+        if self.previous_bid_size is None:
+            buy_volume = sell_volume = 0.0
+        else:
+            buy_volume = max(bid_size - self.previous_bid_size, 0.0)
+            sell_volume = max(ask_size - self.previous_ask_size, 0.0)
+        self.previous_bid_size, self.previous_ask_size = bid_size, ask_size
+
+        self.cumulative_volume += buy_volume + sell_volume
+        bucket_index = int(self.cumulative_volume // self.volume_bucket_size)
+
+        if bucket_index != self.bucket_index:
+            # A new bucket: the current one is complete
+            if self.bucket_index is not None:
+                self.completed_imbalance += self.bucket_imbalance
+            self.bucket_index = bucket_index
+            self.bucket_imbalance = abs(buy_volume - sell_volume)
+            self.bucket_start_imbalance[self.num_buckets % self.window] = self.completed_imbalance
+            self.num_buckets += 1
+        else:
+            self.bucket_imbalance += abs(buy_volume - sell_volume)
+
+        if self.num_buckets < self.min_periods:
+            self.value = 0.0
+            return self.value
+
+        # Sum of the last `window` buckets' imbalances (the current one included)
+        window_start_imbalance = (
+            self.bucket_start_imbalance[self.num_buckets % self.window] if self.num_buckets > self.window else 0.0)
+        rolling_imbalance = (self.completed_imbalance + self.bucket_imbalance) - window_start_imbalance
+
+        self.value = rolling_imbalance / (self.window * self.volume_bucket_size)
+        return self.value
+
+    def snapshot(self) -> dict:
+        """The full state, as plain values (and a copy of the ring), eg. to pickle on shutdown."""
+        return dict(
+            volume_bucket_size=self.volume_bucket_size, window=self.window, min_periods=self.min_periods,
+            previous_bid_size=self.previous_bid_size, previous_ask_size=self.previous_ask_size,
+            cumulative_volume=self.cumulative_volume, bucket_index=self.bucket_index, num_buckets=self.num_buckets,
+            completed_imbalance=self.completed_imbalance, bucket_imbalance=self.bucket_imbalance,
+            bucket_start_imbalance=self.bucket_start_imbalance.copy(), value=self.value)
+
+    def restore(self, snapshot: dict) -> None:
+        for name, value in snapshot.items():
+            setattr(self, name, value.copy() if isinstance(value, np.ndarray) else value)